@@ -0,0 +1,193 @@
+"""
+Time each stage of the insert workflow on synthetic data and save the results as JSON
+
+Rows are generated from a parsed CREATE TABLE query (src/synth.py) and loaded into a throwaway local SQLite db, so no SQL Server is needed.
+
+Stages, per size:
+    - parse: parse the CREATE TABLE query (schema.parse_ddl())
+    - synthesize: generate the rows (not part of the workflow; reported so the other numbers can be put in context)
+    - allocate_keys: Target.allocate_keys()
+    - validate: Target.check_df()
+    - sqlgen: Target.iter_insert_sql(), every statement made but not written
+    - load: Target.load()
+    - load_to_sql: pd.DataFrame.to_sql(), step 6.3 of reprex.py and the baseline Target.load() replaces
+    - verify: Target.verify_load()
+allocate_keys and verify need an IDENTITY or one-column int primary key; for other tables they are reported as skipped. Synthetic rows get unique PRIMARY KEY and UNIQUE values (synth.unique_groups()).
+
+Usage:
+    python benchmark.py
+    python benchmark.py --sizes 10000 100000 1000000 10000000 --repeat 3 --output benchmark_results.json
+    python benchmark.py --ddl src/qry/create_SurveyEvent.sql --stages parse validate sqlgen
+
+Compare two result files (e.g. from two releases) stage by stage with `--compare old.json`; stages more than `--tolerance` slower are flagged and the exit code is 1.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+import src.schema as schema
+import src.target as t
+import src.sqltypes as sqltypes
+import src.synth as synth
+
+STAGES = ['parse', 'synthesize', 'allocate_keys', 'validate', 'sqlgen', 'load', 'load_to_sql', 'verify']
+
+def _environment() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit':commit
+        ,'python':platform.python_version()
+        ,'platform':platform.platform()
+        ,'cpus':os.cpu_count()
+        ,'pandas':pd.__version__
+        ,'numpy':np.__version__
+        ,'sqlalchemy':sa.__version__
+    }
+
+def _fresh_db(path:str, tgt:t.Target) -> sa.Engine:
+    if os.path.exists(path):
+        os.remove(path)
+    con = sa.create_engine(f'sqlite:///{path}')
+    with con.begin() as conn:
+        conn.exec_driver_sql(synth.sqlite_ddl(tgt.schema))
+    return con
+
+def _timed(fn) -> float:
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull): # Target methods print progress
+        start = time.perf_counter()
+        fn()
+        return time.perf_counter() - start
+
+def run(ddl:str, sizes:list, stages:list, repeat:int=1, seed:int=0, workdir:str=None) -> dict:
+    """
+    Time every stage in `stages` at every size in `sizes`, keeping the fastest of `repeat` runs
+
+    Args:
+        ddl (str): Filepath to a CREATE TABLE query. Required.
+        sizes (list): Row counts. Required.
+        stages (list): Stage names from STAGES. Required.
+        repeat (int): Runs per stage and size; the fastest is kept. Default 1.
+        seed (int): Seed for the synthetic data. Default 0.
+        workdir (str): Directory for the SQLite db. Default a temporary directory.
+
+    Returns:
+        dict: {'environment':{...}, 'ddl', 'seed', 'repeat', 'results':[{'stage', 'rows', 'seconds', 'rows_per_sec'}, ...]}
+    """
+    with open(ddl, 'r', encoding='utf-8-sig') as f:
+        sqltext = f.read()
+    tgt = t.Target(ddl)
+    results = []
+    unique = synth.unique_groups(tgt.schema)
+    keyed = tgt._identity_cols() or list(tgt.schema.primary_key)
+    pkey = keyed[0] if len(keyed) == 1 and tgt.schema.column(keyed[0]).fieldtype.lower() in sqltypes.INT_TYPES else None # allocate_keys() and verify_load() need one int key
+
+    def _record(stage, rows, secs):
+        results.append({'stage':stage, 'rows':rows, 'seconds':secs, 'rows_per_sec':rows / secs if rows and secs > 0 else None})
+        print(f'{stage:>14} {rows:>12,} rows {secs:>10.4f}s' + (f" {results[-1]['rows_per_sec']:>14,.0f} rows/sec" if results[-1]['rows_per_sec'] else ''))
+
+    if 'parse' in stages:
+        n = 200
+        best = min(_timed(lambda: [schema.parse_ddl(sqltext) for _ in range(n)]) for _ in range(repeat))
+        _record('parse', 0, best / n)
+
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        dbpath = os.path.join(tmp, 'benchmark.db')
+        for size in sizes:
+            timings = {s:[] for s in stages if s != 'parse'}
+            for _ in range(repeat):
+                df = None
+                def _synthesize():
+                    nonlocal df
+                    df = synth.synthesize(tgt.reqs, size, seed=seed, unique=unique)
+                secs = _timed(_synthesize)
+                if 'synthesize' in timings:
+                    timings['synthesize'].append(secs)
+                tgt.set_df(df)
+                con = _fresh_db(dbpath, tgt)
+                if pkey is not None: # keys are needed by the later stages, so they are always allocated
+                    timings.setdefault('allocate_keys', []).append(_timed(lambda: tgt.allocate_keys(con, pkey)))
+                if 'validate' in timings:
+                    timings['validate'].append(_timed(tgt.check_df))
+                if 'sqlgen' in timings:
+                    timings['sqlgen'].append(_timed(lambda: sum(len(stmt) for stmt in tgt.iter_insert_sql(batch_size=1000))))
+                if 'load' in timings or 'verify' in timings:
+                    secs = _timed(lambda: tgt.load(con, batch_size=5000))
+                    if 'load' in timings:
+                        timings['load'].append(secs)
+                if 'verify' in timings and pkey is not None:
+                    timings['verify'].append(_timed(lambda: tgt.verify_load(con)))
+                if 'load_to_sql' in timings:
+                    con = _fresh_db(dbpath, tgt)
+                    timings['load_to_sql'].append(_timed(lambda: df.to_sql(tgt.schema.table_name, con, index=False, if_exists='append')))
+                con.dispose()
+            for stage in [s for s in STAGES if s in timings and (s in stages)]:
+                if timings[stage]:
+                    _record(stage, size, min(timings[stage]))
+                else:
+                    print(f'{stage:>14} {size:>12,} rows skipped: {ddl} has no IDENTITY or one-column int primary key')
+
+    return {'environment':_environment(), 'ddl':ddl, 'seed':seed, 'repeat':repeat, 'results':results}
+
+def compare(old:dict, new:dict, tolerance:float=0.2) -> list:
+    """
+    Stages (at the same size) that got more than `tolerance` slower from `old` to `new`
+
+    Args:
+        old (dict): Results from run(), e.g. of the last release. Required.
+        new (dict): Results from run(). Required.
+        tolerance (float): Allowed slow-down, as a share of the old time. Default 0.2 (20%).
+
+    Returns:
+        list: [{'stage', 'rows', 'old_seconds', 'new_seconds', 'ratio'}, ...] for every regression
+    """
+    before = {(r['stage'], r['rows']):r['seconds'] for r in old['results']}
+    out = []
+    for r in new['results']:
+        was = before.get((r['stage'], r['rows']))
+        if was and r['seconds'] > was * (1 + tolerance):
+            out.append({'stage':r['stage'], 'rows':r['rows'], 'old_seconds':was, 'new_seconds':r['seconds'], 'ratio':r['seconds'] / was})
+    return out
+
+def main(argv:list=None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the insert workflow on synthetic data.')
+    parser.add_argument('--ddl', default='src/qry/create_SurveyEvent.sql', help='CREATE TABLE query to generate rows for')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000], help='row counts, e.g. 10000 100000 1000000 10000000')
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES)
+    parser.add_argument('--repeat', type=int, default=1, help='runs per stage and size; the fastest is kept')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON results file; '-' for stdout")
+    parser.add_argument('--compare', help='an earlier JSON results file to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slow-down before a stage counts as a regression')
+    args = parser.parse_args(argv)
+    assert args.repeat >= 1, print(f'`--repeat` must be at least 1. You provided {args.repeat}')
+
+    with contextlib.redirect_stdout(sys.stderr) if args.output == '-' else contextlib.nullcontext():
+        report = run(args.ddl, args.sizes, args.stages, args.repeat, args.seed)
+    if args.output == '-':
+        json.dump(report, sys.stdout, indent=2)
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Results written to {args.output}')
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        for r in regressions:
+            print(f"REGRESSION: {r['stage']} at {r['rows']:,} rows took {r['new_seconds']:.4f}s, was {r['old_seconds']:.4f}s ({r['ratio']:.2f}x)", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,7 +2,7 @@
 A minimal reproducible example to demonstrate how to insert records into a local SQL Server db
 
 1. Restore db to local
-2. SELECT the entire table from db into dataframe
+2. Index the table's keys from db
 3. Create dataframes of dummy data
 4. Prep dummy dataframes to match db
 5. Make SQL
@@ -15,6 +15,8 @@ import numpy as np
 import sqlalchemy as sa
 import assets
 import datetime as dt
+import src.target as t
+import src.db_connect as dbc
 
 ##############################################
 # 1. Restore a local SQL Server db
@@ -25,16 +27,21 @@ import datetime as dt
 """
 
 ##############################################
-# 2. SELECT the entire table from db into dataframe
+# 2. Index the table's keys from db
 ##############################################
 """
 We'll focus on one table for this reprex
 [dbo].[SurveyEvent]
 
-We need the entire table so that we can validate column names and generate primary keys for the INSERTs
+We don't need the entire table (SELECT * would also drag along e.g. SurveyNotes varchar(2000))
+We only need its keys, so that we can check for duplicates and validate the load
+(primary keys for the INSERTs are reserved in step 4 with `Target.allocate_keys()`, which only asks the db for MAX(pkey))
 """
-con = sa.create_engine(assets.SACXN_STR)
-ref_surveys = pd.read_sql_table('SurveyEvent',con) # a shortcut for SELECT * FROM...
+con = dbc.get_engine('db_2023') # one pooled engine per db, shared by every caller; same as sa.create_engine(assets.SACXN_STR) the first time
+surveys = t.Target('src/qry/create_SurveyEvent.sql')
+ref_surveys = surveys.index_ref(con) # streams only the key columns in chunks and keeps their max and hashes, not the rows
+# the old way, SELECT * into memory:
+# ref_surveys = pd.read_sql_table('SurveyEvent',con) # a shortcut for SELECT * FROM...
 # write and execute custom queries:
 # with open(f'src/qry/select_SurveyEvent.sql', 'r') as query:
 #     ref_surveys = pd.read_sql_query(query.read(),con)
@@ -122,6 +129,7 @@ Prep the dataframe of records to match the db schema
     - int should be python int-type
     - decimal should be python float-type
     - char/varchar should be python str-type
+    - Target.transform() does 1-3 in one pass: renames columns with `col_xwalk`, orders them like the CREATE TABLE query and converts each column to its type
 4. this db requires us to assign primary keys for INSERTs
     - some dbs prohibit INSERTS from including values in the primary key field and assign keys upon INSERT instead
 5. foreign keys must be present in the related table(s) in SQL Server
@@ -131,7 +139,7 @@ targets = {
     'dbo.SurveyEvent':[ # the name of a table in the "target" db
         'insert_SurveyEvent' # the name of the INSERT query
         ,survey_inserts # a dataframe of dummy surveys we want to add to the db
-        ,ref_surveys # a dataframe of real surveys present in the db
+        ,ref_surveys # an index of the keys of the real surveys present in the db
         ,'SurveyRecID' # the name of the primary key field from the db
         ]
 }
@@ -139,44 +147,55 @@ targets = {
 # ARMILocal requires that we provide each new records's primary key
 # this is odd, but ok
 for k,v in targets.items():
-    pkey = targets[k][3] # the primary key field in the dataframe
-    maxval = max(targets[k][2][pkey].values) # what's the most-recent primary key in the dataframe (integer)
-    adds = len(targets[k][1]) # how many rows are we adding?
-    targets[k][1][pkey] = np.append(np.arange(maxval+1, maxval+adds, step = 1) ,maxval+adds)
+    tgt = t.Target(f"src/qry/create_{k.split('.')[-1]}.sql")
+    tgt.set_df(v[1])
+    # asks the db for MAX(pkey) and reserves a range of keys for the new rows, instead of reading the whole table
+    # safe to run from several loaders at once; each gets its own range
+    tgt.allocate_keys(con, pkey=v[3])
+    report = tgt.check_df() # one row per violation of the CREATE TABLE rules; empty when the df is ready to load
+    assert len(report) == 0, print(report.groupby(['column', 'rule'], observed=True).size())
+    # every FOREIGN KEY value must already exist in its parent table (e.g. dbo.SiteConstants); parent keys are read once and reused
+    orphans = tgt.check_fks(con)
+    assert sum(len(o) for o in orphans.values()) == 0, print({fk:len(o) for fk, o in orphans.items()})
 
 ##############################################
 # 5. Make SQL
 ##############################################
 for k,v in targets.items(): # loop over each dataframe we need to insert into db
-    sql_texts = [] # a list where each item in the list is one line of SQL
-    sql_texts.append('SET IDENTITY_INSERT dbo.SurveyEvent ON') # required syntax for this particular db because the db was created with this setting/safety-barrier
-    for index, row in v[1].iterrows(): # loop over the rows in the dataframe
-        line = 'INSERT INTO '+k+' ('+ str(', '.join(v[1].columns))+ ') VALUES '+ str(tuple(row.values)) # translate the df rows to SQL INSERT statements
-        sql_texts.append(line) # add each INSERT the list
-    sql_texts.append('SET IDENTITY_INSERT dbo.SurveyEvent OFF') # required syntax for this particular db because the db was created with this setting/safety-barrier
-    sqltext = '\n'.join(sql_texts) # concat each INSERT into one text string
-    sql_file = open(f"src/qry/{v[0]}.sql", "w") # write the text to file
-    sql_file.write(sqltext)
-    sql_file.close()
-    v.append(sql_texts)
-    print(f"Wrote SQL to 'src/qry/{v[0]}.sql'")
+    tgt = t.Target(f"src/qry/create_{k.split('.')[-1]}.sql") # parse the table's CREATE TABLE query into data types
+    tgt.set_df(v[1])
+    # translate the df column-by-column into SQL literals, up to 1000 rows per INSERT
+    # wrapped in SET IDENTITY_INSERT ON/OFF, required syntax for this particular db because the db was created with this setting/safety-barrier
+    # statements are streamed to the file as they are made, so the whole script never sits in memory
+    tgt.set_insert_qry(f"src/qry/{v[0]}.sql")
+    tgt.write_insert_qry(batch_size=1000) # or e.g. compress=True, statements_per_file=500 for very large loads
 
 ##############################################
 # 6. Load dataframes to local db
 # OPTION 6.1: open Data Studio or SSMS and run the queries from step 5
-# OPTION 6.2: use pd.to_sql() as commented-out below
+# OPTION 6.2: use Target.load() as commented-out below
+#   one prepared, parameterized INSERT reused for every batch; pyodbc's fast_executemany is switched on automatically
+# OPTION 6.3: use pd.to_sql(), e.g. v[1].to_sql(k, con, index=False,if_exists="append") # https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.to_sql.html
 ##############################################
 # if con is None: # create a connection if you don't already have one
 #     con = sa.create_engine(assets.SACXN_STR)
 # for k,v in targets.items():
+#     tgt = t.Target(f"src/qry/create_{k.split('.')[-1]}.sql")
+#     tgt.set_df(v[1])
 #     try:
-#         # option 1: load the dataframes directly
-#         v[1].to_sql(k, con, index=False,if_exists="append") # https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.to_sql.html
+#         tgt.load(con, batch_size=1000, commit_every=10) # prints rows/sec
+#         # or resumable: each committed batch is journaled; re-running this line after a failure skips what is already in the db
+#         # tgt.load(con, batch_size=1000, commit_every=10, journal_path=f"src/qry/load_{k.split('.')[-1]}.journal")
 #     except:
 #         print(f'Failed to append rows to {k}.')
 ##############################################
 # 7. Validate load
 ##############################################
 
-test_surveys = pd.read_sql_table('SurveyEvent',con)
-len(ref_surveys) == len(test_surveys)
+# reads back only the rows in the key range allocate_keys() handed out, not the whole table
+# compares their count and an order-independent checksum with the df; on a mismatch, names the missing/unexpected/changed keys
+# for k,v in targets.items():
+#     tgt = t.Target(f"src/qry/create_{k.split('.')[-1]}.sql")
+#     tgt.set_df(v[1])
+#     result = tgt.verify_load(con, pkey=v[3])
+#     assert result['ok'], print(result['missing'][:10], result['unexpected'][:10], result['changed'][:10])
@@ -12,11 +12,21 @@ import pandas as pd
 import numpy as np
 import sqlalchemy as sa
 import assets
-import src.target as t
+import src.catalog as c
+
+# time every stage (parse, read ref, allocate keys, validate, generate SQL, load, verify); off by default and free when off
+# import src.metrics as metrics
+# metrics.enable(trace_memory=False)
+# metrics.add_hook(metrics.log_hook()) # one JSON line per stage to the 'src.metrics' logger
+# ... run the load, then: metrics.to_json('load_metrics.json')
 
 # in class Target, user provides a CREATE TABLE query and the program parses it
 # then the user tells gives the program the df of rows to add and a current copy of the table to which it needs to add rows
-surveys = t.Target(r'src\qry\create_SurveyEvent.sql')
+# import src.target as t
+# surveys = t.Target(r'src\qry\create_SurveyEvent.sql')
+# the catalog parses every create_*.sql in src/qry once and caches the results on disk; later runs only re-parse files that changed
+catalog = c.Catalog('src/qry')
+surveys = catalog.target('dbo.SurveyEvent')
 # surveys.set_df(df=survey_events)
 # surveys.set_ref(ref=ref_surveys)
 surveys_xwalk ={ # a lookup table of column names {<a column in `survey_events`>:<a column in `ref_surveys`>}
@@ -24,6 +34,7 @@ surveys_xwalk ={ # a lookup table of column names {<a column in `survey_events`>
             ,'location_id':'SiteRecID'
         }
 surveys.set_col_xwalk(surveys_xwalk)
+# surveys.transform(survey_events) # rename with the crosswalk, order like the CREATE TABLE query, convert types; the compiled plan is reused for every df
 surveys.show()
 
 surveys.get_create_qry()
@@ -34,3 +45,20 @@ surveys.get_target_tablename()
 surveys.get_reqs()
 surveys.get_col_xwalk()
 
+# 3. Process csvs into dataframes that match db requirements
+# each csv is cut into chunks that worker processes read, rename/convert with the compiled crosswalk plan and validate;
+# chunks stream to the loader as they finish, so the csvs are never concatenated into one dataframe
+# (on Windows, run this under `if __name__ == '__main__':` so the worker processes can start)
+# import src.ingest as ing
+# import src.db_connect as dbc
+# con = dbc.get_engine('db_2023')
+# chunks = ing.ingest('data/survey_events/*.csv', surveys.plan, surveys.reqs, chunksize=100_000)
+# stats = ing.load_stream(surveys, con, chunks, batch_size=5000)
+# stats['rejected'] # {<csv>: <number of validation violations>}
+# or, in one process, overlap the stages so chunk N+1 is read/converted/validated while chunk N is inserted:
+# import src.pipeline as pipeline
+# stats = pipeline.run(surveys, con, 'data/survey_events/*.csv', queue_size=2, chunksize=100_000, batch_size=5000)
+# re-running a load for the same csvs: insert only new rows and update changed ones, matched on a natural key
+# stats = surveys.upsert(con, natural_key=['SiteRecID', 'SDate', 'TBegin', 'SMID'])
+# or write the changes as MERGE statements to review and run later:
+# surveys.upsert(con, natural_key=['SiteRecID', 'SDate', 'TBegin', 'SMID'], merge_script='src/qry/merge_SurveyEvent.sql')
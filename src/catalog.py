@@ -0,0 +1,133 @@
+"""A persistent, on-disk cache of the schemas parsed from a directory of CREATE TABLE queries"""
+import os
+import fnmatch
+import hashlib
+import pickle
+import src.schema as schema
+import src.target as target
+
+_CACHE_VERSION = 1 # bump whenever schema.TableSchema changes shape so that old caches are rebuilt
+
+class Catalog():
+
+    def __init__(self, ddl_dir:str='src/qry', cache:str=None, pattern:str='create_*.sql'):
+        """A Catalog holds the parsed schema of every CREATE TABLE query in a directory
+
+        Parsed schemas are saved to `cache` (a pickle) along with each file's size, modification time and sha1 hash. Opening the catalog again only re-parses files whose contents changed, so loading a Target from it costs a dictionary lookup.
+
+        Args:
+            ddl_dir (str): Relative or absolute path to the directory of CREATE TABLE .sql files. Default 'src/qry'.
+            cache (str): Relative or absolute filepath for the cache file. Default '<ddl_dir>/.schema_cache.pkl'.
+            pattern (str): Filename pattern of the CREATE TABLE .sql files. Default 'create_*.sql'.
+
+        Examples:
+            import src.catalog as c
+            cat = c.Catalog('src/qry')
+            surveys = cat.target('dbo.SurveyEvent')
+        """
+        self.ddl_dir = ddl_dir
+        self.cache = cache if cache is not None else os.path.join(ddl_dir, '.schema_cache.pkl')
+        self.pattern = pattern
+        self.entries = {} # {<filepath>: (<mtime_ns>, <size>, <sha1>, <tuple of schema.TableSchema>)}
+        self._load_cache()
+        self.refresh()
+
+    def _load_cache(self):
+        try:
+            with open(self.cache, 'rb') as f:
+                cached = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return
+        if cached.get('version') == _CACHE_VERSION:
+            self.entries = cached['entries']
+
+    def _save_cache(self):
+        tmp = self.cache + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump({'version':_CACHE_VERSION, 'entries':self.entries}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.cache)
+
+    def refresh(self) -> list:
+        """
+        Re-scan `ddl_dir` and re-parse only the files that were added or whose contents changed since the cache was written
+
+        Files are first compared by size and modification time; only files whose stats changed are hashed, and only files whose hash changed are parsed.
+
+        Returns:
+            list: The filepaths that were (re-)parsed
+        """
+        parsed = []
+        changed = False
+        seen = set()
+        for entry in os.scandir(self.ddl_dir):
+            if not entry.is_file() or not fnmatch.fnmatch(entry.name, self.pattern):
+                continue
+            fpath = entry.path
+            seen.add(fpath)
+            stat = entry.stat()
+            cached = self.entries.get(fpath)
+            if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+                continue
+            with open(fpath, 'rb') as f:
+                raw = f.read()
+            sha1 = hashlib.sha1(raw).hexdigest()
+            if cached is not None and cached[2] == sha1:
+                tables = cached[3]
+            else:
+                tables = schema.parse_ddl(raw.decode('utf-8-sig'))
+                parsed.append(fpath)
+            self.entries[fpath] = (stat.st_mtime_ns, stat.st_size, sha1, tables)
+            changed = True
+        for fpath in [f for f in self.entries if f not in seen]:
+            del self.entries[fpath]
+            changed = True
+        if changed:
+            self._save_cache()
+        return parsed
+
+    def tables(self) -> list:
+        """
+        The names of every table in the catalog, as written in their CREATE TABLE queries
+        """
+        return [t.tablename for _, _, _, tables in self.entries.values() for t in tables]
+
+    def _find(self, tablename:str) -> tuple:
+        """(<filepath>, <schema.TableSchema>) for a table name like '[dbo].[SurveyEvent]', 'dbo.SurveyEvent' or 'SurveyEvent'"""
+        wanted = schema.normalize_tablename(tablename, default_schema=None)
+        for fpath, (_, _, _, tables) in self.entries.items():
+            for t in tables:
+                full = schema.normalize_tablename(t.tablename, default_schema=None)
+                if wanted == full or wanted == t.table_name.lower():
+                    return fpath, t
+        raise KeyError(f'No CREATE TABLE query for {tablename} in {self.ddl_dir}')
+
+    def get_schema(self, tablename:str) -> schema.TableSchema:
+        """
+        Look up the parsed schema of a table
+
+        Args:
+            tablename (str): e.g. '[dbo].[SurveyEvent]', 'dbo.SurveyEvent' or 'SurveyEvent'. Required.
+
+        Returns:
+            schema.TableSchema: The table's schema
+        """
+        return self._find(tablename)[1]
+
+    def target(self, tablename:str) -> target.Target:
+        """
+        Make a Target for a table without re-reading or re-parsing its CREATE TABLE query
+
+        Args:
+            tablename (str): e.g. '[dbo].[SurveyEvent]', 'dbo.SurveyEvent' or 'SurveyEvent'. Required.
+
+        Returns:
+            target.Target: A Target whose `create_qry` is the table's .sql file and whose `schema` comes from the catalog
+
+        Examples:
+            import src.catalog as c
+            surveys = c.Catalog('src/qry').target('SurveyEvent')
+        """
+        fpath, tableschema = self._find(tablename)
+        tgt = target.Target(fpath)
+        tgt.set_schema(tableschema)
+        return tgt
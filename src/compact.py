@@ -0,0 +1,98 @@
+"""Shrink dataframes in memory by giving each column the smallest dtype its declared SQL Server type allows"""
+import decimal
+import numpy as np
+import pandas as pd
+import src.sqltypes as sqltypes
+
+_INTS = [('int8', 'Int8'), ('int16', 'Int16'), ('int32', 'Int32'), ('int64', 'Int64')]
+
+def _compact_int(s:pd.Series) -> pd.Series:
+    nums = pd.to_numeric(s)
+    nulls = nums.isna().any()
+    valid = nums.dropna()
+    if len(valid) and not (valid == valid.round()).all():
+        raise ValueError(f'`{s.name}` holds values that are not whole numbers')
+    lo, hi = (valid.min(), valid.max()) if len(valid) else (0, 0)
+    for numpy_type, nullable_type in _INTS:
+        info = np.iinfo(numpy_type)
+        if info.min <= lo and hi <= info.max:
+            return nums.astype(nullable_type if nulls else numpy_type)
+    return nums.astype('Int64' if nulls else 'int64')
+
+def compact_column(s:pd.Series, fieldtype:str, category_ratio:float=0.5) -> pd.Series:
+    """
+    One column in the smallest dtype that holds its values exactly
+
+    - int fields: the smallest int8/16/32/64 that fits the values; nullable Int8/16/32/64 when there are nulls (instead of float64)
+    - decimal/float fields: float64 instead of object, except decimal.Decimal values (wide decimal columns), which float64 would round
+    - date/datetime fields: datetime64 instead of strings
+    - char/varchar fields: category when at most `category_ratio` of the values are distinct, e.g. codes such as PIID or DetEstID
+    A column whose values do not convert (e.g. 'abc' in an int field) is returned unchanged, so validate.check() can still report it.
+
+    Args:
+        s (pd.Series): A column. Required.
+        fieldtype (str): The column's SQL Server data type. Required.
+        category_ratio (float): Largest share of distinct values for a text column to become a category. Default 0.5.
+
+    Returns:
+        pd.Series: The column in its compact dtype
+    """
+    fieldtype = str(fieldtype).lower()
+    try:
+        if fieldtype in sqltypes.INT_TYPES:
+            return _compact_int(s)
+        if fieldtype in sqltypes.FLOAT_TYPES:
+            first = s.dropna().head(1).tolist() if s.dtype == object else []
+            if first and isinstance(first[0], decimal.Decimal):
+                return s # exact values of a wide decimal column (see transform._to_decimal()); float64 would round them
+            return pd.to_numeric(s).astype('float64')
+        if fieldtype in sqltypes.DATETIME_TYPES or fieldtype in sqltypes.DATE_TYPES:
+            return sqltypes.to_datetimes(s)
+    except (ValueError, TypeError):
+        return s
+    if isinstance(s.dtype, pd.CategoricalDtype) or len(s) == 0:
+        return s
+    if s.nunique(dropna=True) <= category_ratio * len(s):
+        return s.astype('category')
+    return s
+
+def compact(df:pd.DataFrame, fieldtypes:dict, category_ratio:float=0.5) -> pd.DataFrame:
+    """
+    A copy of `df` with every column in its compact dtype; see compact_column()
+
+    Args:
+        df (pd.DataFrame): Rows of a table. Required.
+        fieldtypes (dict): A dictionary of {<column name>:<SQL Server data type>}; other columns are left as they are. Required.
+        category_ratio (float): Largest share of distinct values for a text column to become a category. Default 0.5.
+
+    Returns:
+        pd.DataFrame: The compacted rows, with the same index and columns
+
+    Examples:
+        import src.compact as cmp
+        small = cmp.compact(ref_surveys, {c.name:c.fieldtype for c in surveys.schema.columns})
+    """
+    return pd.DataFrame({c:(compact_column(df[c], fieldtypes[c], category_ratio) if c in fieldtypes else df[c]) for c in df.columns}, index=df.index)
+
+def memory_report(before:pd.DataFrame, after:pd.DataFrame) -> pd.DataFrame:
+    """
+    Memory used by each column before and after compact()
+
+    Args:
+        before (pd.DataFrame): The original rows. Required.
+        after (pd.DataFrame): The compacted rows. Required.
+
+    Returns:
+        pd.DataFrame: One row per column, plus a 'TOTAL' row, with 'dtype_before', 'dtype_after', 'mb_before', 'mb_after' and 'ratio' (before / after)
+    """
+    mb_before = before.memory_usage(index=False, deep=True) / 2**20
+    mb_after = after.memory_usage(index=False, deep=True) / 2**20
+    report = pd.DataFrame({
+        'dtype_before':before.dtypes.astype(str)
+        ,'dtype_after':after.dtypes.astype(str)
+        ,'mb_before':mb_before
+        ,'mb_after':mb_after
+    })
+    report.loc['TOTAL'] = ['', '', mb_before.sum(), mb_after.sum()]
+    report['ratio'] = report['mb_before'] / report['mb_after'].where(report['mb_after'] > 0)
+    return report
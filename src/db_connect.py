@@ -1,23 +1,314 @@
 """Connect to databases"""
-import assets
-import pyodbc
+import re
+import time
+import threading
+from collections import OrderedDict
 import sqlalchemy as sa
 import pandas as pd
+import src.schema as schema
+import src.metrics as metrics
 
-def _db_connect(db:str) -> None:
+POOL_DEFAULTS = {
+    'pool_size':5 # connections kept open
+    ,'max_overflow':10 # extra connections opened under load, closed when returned
+    ,'pool_pre_ping':True # test each connection on checkout and replace it if the server dropped it
+    ,'pool_recycle':3600 # replace connections older than this many seconds
+}
 
-    if db.lower() == 'db_2023':
-        try:
-            con = sa.create_engine(assets.SACXN_STR)
-            return con
-        except:
-            print('Connection to `{db}` failed.')
-    else:
+def _from_assets(attr:str):
+    """A connection string that is read from the (uncommitted) assets.py file when it is first needed"""
+    def _url():
+        import assets
+        return getattr(assets, attr)
+    return _url
+
+_DATABASES = { # {<db name>: (<url or function returning a url>, <pool settings>)}
+    'db_2023':(_from_assets('SACXN_STR'), {})
+}
+_ENGINES = {} # {<db name>: sa.Engine}
+_STATS = {} # {<db name>: {'connects', 'checkouts', 'checkins', 'invalidations'}} of the db's current engine
+_LOCK = threading.Lock()
+
+def register_db(db:str, url, **pool_kwargs):
+    """
+    Add (or replace) a named database that get_engine() can connect to
+
+    Args:
+        db (str): A name for the database, e.g. 'db_2023'. Case-insensitive. Required.
+        url (str or function): A sqlalchemy connection string, or a function that returns one (so secrets are only read when needed). Required.
+        **pool_kwargs: Overrides of POOL_DEFAULTS for this database, e.g. pool_size=10. Any other sa.create_engine() keyword, e.g. fast_executemany=True, is passed through.
+
+    Examples:
+        import src.db_connect as dbc
+        dbc.register_db('local_test', 'sqlite:///test.db', pool_size=2)
+        con = dbc.get_engine('local_test')
+    """
+    db = db.lower()
+    with _LOCK:
+        old = _ENGINES.pop(db, None)
+        _STATS.pop(db, None)
+        _DATABASES[db] = (url, pool_kwargs)
+    if old is not None:
+        old.dispose()
+
+def _pool_args(url:str, pool_kwargs:dict) -> dict:
+    """POOL_DEFAULTS overlaid with `pool_kwargs`, adjusted for SQLite which only pools file databases"""
+    kwargs = {**POOL_DEFAULTS, **pool_kwargs}
+    parsed = sa.engine.make_url(url)
+    if parsed.get_backend_name() == 'sqlite':
+        if parsed.database in (None, '', ':memory:'):
+            # each in-memory connection is its own empty db; keep the one connection sqlalchemy gives it
+            kwargs.pop('pool_size', None)
+            kwargs.pop('max_overflow', None)
+        else:
+            kwargs.setdefault('poolclass', sa.pool.QueuePool)
+    return kwargs
+
+def _count(stats:dict, event:str):
+    # the listener keeps its own engine's counters, so events from an engine that was disposed or replaced neither fail nor count toward the new one
+    def _listener(*args):
+        stats[event] += 1
+    return _listener
+
+def get_engine(db:str) -> sa.Engine:
+    """
+    Get the process-wide, pooled engine for a named database, creating it on first use
+
+    Every caller asking for the same `db` shares one engine and so one connection pool; connection setup is only paid when the pool needs a new connection.
+
+    Args:
+        db (str): A database name, e.g. 'db_2023', registered in _DATABASES or with register_db(). Case-insensitive. Required.
+
+    Returns:
+        sa.Engine: The database's engine
+
+    Raises:
+        KeyError: `db` is not registered
+
+    Examples:
+        import src.db_connect as dbc
+        con = dbc.get_engine('db_2023')
+    """
+    db = db.lower()
+    engine = _ENGINES.get(db)
+    if engine is not None:
+        return engine
+    with _LOCK:
+        if db in _ENGINES:
+            return _ENGINES[db]
+        if db not in _DATABASES:
+            raise KeyError(f'The connection you requested ({db}) is not registered. Try another connection or use register_db().')
+        url, pool_kwargs = _DATABASES[db]
+        with metrics.stage('connect', db=db):
+            url = url() if callable(url) else url
+            engine = sa.create_engine(url, **_pool_args(url, pool_kwargs))
+        stats = {'connects':0, 'checkouts':0, 'checkins':0, 'invalidations':0}
+        sa.event.listen(engine.pool, 'connect', _count(stats, 'connects'))
+        sa.event.listen(engine.pool, 'checkout', _count(stats, 'checkouts'))
+        sa.event.listen(engine.pool, 'checkin', _count(stats, 'checkins'))
+        sa.event.listen(engine.pool, 'invalidate', _count(stats, 'invalidations'))
+        _STATS[db] = stats
+        _ENGINES[db] = engine
+    return engine
+
+def pool_stats(db:str=None) -> dict:
+    """
+    Connection pool usage for one or every engine created by get_engine()
+
+    Args:
+        db (str): A database name. When None, stats for every engine are returned. Default None.
+
+    Returns:
+        dict: {<db name>: {'connects', 'checkouts', 'checkins', 'invalidations', 'checked_out', 'pool_size', 'overflow', 'status'}}
+            - connects: new db connections opened; compare with checkouts to see how often the pool saved a connection setup
+            - checked_out, pool_size, overflow: the pool's state right now (QueuePool only)
+    """
+    names = [db.lower()] if db is not None else list(_ENGINES)
+    out = {}
+    for name in names:
+        pool = _ENGINES[name].pool
+        queued = isinstance(pool, sa.pool.QueuePool)
+        out[name] = {
+            **_STATS[name]
+            ,'checked_out':pool.checkedout() if queued else None
+            ,'pool_size':pool.size() if queued else None
+            ,'overflow':pool.overflow() if queued else None
+            ,'status':pool.status()
+        }
+    return out
+
+def dispose(db:str=None):
+    """
+    Close every pooled connection and forget the engine(s), e.g. before forking worker processes
+
+    Args:
+        db (str): A database name. When None, every engine is disposed. Default None.
+    """
+    with _LOCK:
+        names = [db.lower()] if db is not None else list(_ENGINES)
+        for name in names:
+            engine = _ENGINES.pop(name, None)
+            _STATS.pop(name, None)
+            if engine is not None:
+                engine.dispose()
+
+def sa_table(con:sa.Engine, tablename:str, columns:list=()) -> sa.TableClause:
+    """
+    A lightweight sqlalchemy table for a table name like '[dbo].[SurveyEvent]'
+
+    SQLite has no schemas, so the schema (e.g. 'dbo') is dropped when `con` is a SQLite engine; this lets a local SQLite db stand in for SQL Server.
+
+    Args:
+        con (sa.Engine): A sqlalchemy engine for the db. Required.
+        tablename (str): The table name, optionally schema-qualified and [bracketed]. Required.
+        columns (list): Column names to declare on the table. Default ().
+
+    Returns:
+        sa.TableClause: The table
+    """
+    schema_name, table_name = schema.split_tablename(tablename)
+    if con.dialect.name == 'sqlite':
+        schema_name = None
+    return sa.table(table_name, *[sa.column(c) for c in columns], schema=schema_name)
+
+def _db_connect(db:str) -> sa.Engine:
+
+    try:
+        return get_engine(db)
+    except KeyError:
         print('The connection you requested is not in the assets file. Try another connection.')
         return None
+    except Exception:
+        print(f'Connection to `{db}` failed.')
+        return None
+
+class QueryCache():
+
+    def __init__(self, maxsize:int=32, ttl:float=300):
+        """A QueryCache holds the most recently used query results, each for a limited time
+
+        Args:
+            maxsize (int): The most results kept; the least recently used result is dropped to make room. Default 32.
+            ttl (float): Default number of seconds a result stays fresh. Default 300.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._results = OrderedDict() # {(<db url>, <qry>): (<expires at>, <pd.DataFrame>, <set of tables read>)}
+        self._lock = threading.Lock()
+        self.counts = {'hits':0, 'misses':0, 'evictions':0, 'expirations':0, 'invalidations':0}
+
+    def get(self, key:tuple) -> pd.DataFrame:
+        """The cached result for `key`, or None if there is no fresh one"""
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._results[key]
+                self.counts['expirations'] += 1
+                entry = None
+            if entry is None:
+                self.counts['misses'] += 1
+                return None
+            self._results.move_to_end(key)
+            self.counts['hits'] += 1
+            return entry[1]
+
+    def put(self, key:tuple, df:pd.DataFrame, tables:set, ttl:float=None):
+        with self._lock:
+            self._results[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), df, tables)
+            self._results.move_to_end(key)
+            while len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+                self.counts['evictions'] += 1
+
+    def invalidate(self, table:str=None) -> int:
+        """
+        Drop cached results
+
+        Args:
+            table (str): Only drop results of queries that read this table, e.g. 'dbo.SurveyEvent'. When None, drop everything. Default None.
+
+        Returns:
+            int: The number of results dropped
+        """
+        wanted = schema.normalize_tablename(table) if table is not None else None
+        with self._lock:
+            keys = [k for k, (_, _, tables) in self._results.items() if wanted is None or wanted in tables]
+            for k in keys:
+                del self._results[k]
+            self.counts['invalidations'] += len(keys)
+        return len(keys)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.counts['hits'] + self.counts['misses']
+            return {**self.counts, 'size':len(self._results), 'hit_rate':self.counts['hits'] / lookups if lookups else None}
 
-def _exec_qry(con:sa.Engine, qry:str) -> pd.DataFrame:
-    with open(f'src/qry/{qry}.sql', 'r') as query:
-        df = pd.read_sql_query(query.read(),con)
+_CACHE = QueryCache()
+_SQL_TEXT = {} # {<qry>: <text of src/qry/<qry>.sql>}
+_TABLE_REF = re.compile(r'\b(?:FROM|JOIN)\s+((?:\[[^\]]+\]|"[^"]+"|[\w#@$]+)(?:\s*\.\s*(?:\[[^\]]+\]|"[^"]+"|[\w#@$]+))*)', re.I)
+
+def _read_qry(qry:str) -> str:
+    """The text of src/qry/<qry>.sql, read from disk once per process"""
+    text = _SQL_TEXT.get(qry)
+    if text is None:
+        with open(f'src/qry/{qry}.sql', 'r') as query:
+            text = query.read()
+        _SQL_TEXT[qry] = text
+    return text
+
+def _tables_in(sqltext:str) -> set:
+    """The (normalized) names of the tables a query reads FROM or JOINs"""
+    return {schema.normalize_tablename(re.sub(r'\s+', '', m)) for m in _TABLE_REF.findall(sqltext)}
+
+def _exec_qry(con:sa.Engine, qry:str, ttl:float=None) -> pd.DataFrame:
+    """
+    Run the query in src/qry/<qry>.sql, reusing a cached result when the same query ran on the same db less than `ttl` seconds ago
+
+    Args:
+        con (sa.Engine): A sqlalchemy engine for the db. Required.
+        qry (str): The name of a .sql file in src/qry, without the extension, e.g. 'select_SurveyEvent'. Required.
+        ttl (float): Seconds the result stays fresh; 0 always runs the query. Default QueryCache.ttl (300).
+
+    Returns:
+        pd.DataFrame: The query result. A copy, so changing it does not change the cache.
+
+    Examples:
+        import src.db_connect as dbc
+        ref = dbc._exec_qry(dbc.get_engine('db_2023'), 'select_SurveyEvent', ttl=600)
+        dbc.cache_stats()
+    """
+    key = (str(con.url), qry)
+    if ttl != 0:
+        df = _CACHE.get(key)
+        if df is not None:
+            with metrics.stage('query', rows=len(df), qry=qry, cached=True):
+                return df.copy()
+    sqltext = _read_qry(qry)
+    with metrics.stage('query', qry=qry, cached=False) as st:
+        df = pd.read_sql_query(sqltext,con)
+        st.rows = len(df)
+    if ttl != 0:
+        _CACHE.put(key, df, _tables_in(sqltext), ttl)
+        return df.copy()
     return df
 
+def invalidate(table:str=None) -> int:
+    """
+    Drop cached _exec_qry() results, e.g. right after loading rows into a table
+
+    Args:
+        table (str): Only drop results of queries that read this table, e.g. '[dbo].[SurveyEvent]'. When None, drop everything. Default None.
+
+    Returns:
+        int: The number of results dropped
+    """
+    return _CACHE.invalidate(table)
+
+def cache_stats() -> dict:
+    """
+    Hit/miss counters of the _exec_qry() result cache
+
+    Returns:
+        dict: {'hits', 'misses', 'evictions', 'expirations', 'invalidations', 'size', 'hit_rate'}
+    """
+    return _CACHE.stats()
@@ -0,0 +1,228 @@
+"""Read many CSVs in parallel into chunks that are mapped to a table and validated, ready to load"""
+import io
+import os
+import glob
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+import pandas as pd
+import src.sqltypes as sqltypes
+import src.validate as validate
+
+_BLOCK = 1 << 24 # bytes scanned at a time by split_file()
+
+def expand(paths) -> list:
+    """
+    The CSV files named by a directory, a glob pattern, a filepath or a list of any of those
+
+    Args:
+        paths (str or list): e.g. 'data/surveys', 'data/surveys/*.csv' or ['a.csv', 'b.csv']. Required.
+
+    Returns:
+        list: Sorted filepaths
+    """
+    if isinstance(paths, (str, os.PathLike)):
+        paths = [paths]
+    files = []
+    for p in paths:
+        p = os.fspath(p)
+        if os.path.isdir(p):
+            files.extend(glob.glob(os.path.join(p, '*.csv')))
+        elif glob.has_magic(p):
+            files.extend(glob.glob(p, recursive=True))
+        else:
+            files.append(p)
+    return sorted(dict.fromkeys(files))
+
+def csv_dtypes(reqs:pd.DataFrame, col_xwalk:dict=None) -> dict:
+    """
+    The read_csv() dtypes of a table's columns, keyed by their names in the CSVs
+
+    Text, date and datetime fields are read as str, so codes like '007' keep their leading zeros and dates are parsed once, by the transform plan. Numeric fields are left to pandas' C parser and converted by the plan.
+
+    Args:
+        reqs (pd.DataFrame): The table's requirements, e.g. Target.reqs. Required.
+        col_xwalk (dict): A dictionary of {<a column in the CSVs>:<a column in the table>}. Default None.
+
+    Returns:
+        dict: {<CSV column>: str}
+    """
+    source = {v:k for k, v in (col_xwalk or {}).items()}
+    numeric = sqltypes.INT_TYPES | sqltypes.FLOAT_TYPES
+    return {source.get(name, name):str for name, fieldtype in zip(reqs['fieldnames'], reqs['fieldtypes']) if str(fieldtype).lower() not in numeric}
+
+def read_chunks(path:str, plan, reqs:pd.DataFrame, chunksize:int=100_000):
+    """
+    Iterate over a CSV `chunksize` rows at a time, parsing only the columns `plan` uses, with dtypes from csv_dtypes()
+
+    Only empty fields are read as null; codes such as 'NA' or 'null' are kept as text.
+
+    Args:
+        path (str): The CSV. Required.
+        plan (transform.TransformPlan): The compiled transform for the table, e.g. Target.plan. Required.
+        reqs (pd.DataFrame): The table's requirements, e.g. Target.reqs. Required.
+        chunksize (int): Rows per chunk. Default 100_000.
+
+    Returns:
+        pd.io.parsers.TextFileReader: An iterator of (untransformed) chunks
+    """
+    wanted = set(plan.rename) | set(plan.fieldnames)
+    return pd.read_csv(path, dtype=csv_dtypes(reqs, plan.rename), usecols=lambda c: c in wanted, chunksize=chunksize, keep_default_na=False, na_values=[''])
+
+def split_file(path:str, chunksize:int=100_000):
+    """
+    Split a CSV into runs of `chunksize` rows by byte offset, without parsing it
+
+    Rows end at line breaks outside double quotes, so a quoted field with a line break in it stays in one row. The file is scanned `_BLOCK` bytes at a time, so memory does not grow with the file.
+
+    Args:
+        path (str): The CSV. Required.
+        chunksize (int): Rows per run. Default 100_000.
+
+    Yields:
+        tuple: (<first byte>, <one past the last byte>, <row number of the first row>) of each run after the header line
+    """
+    assert chunksize >= 1, print(f'`chunksize` must be at least 1. You provided {chunksize}')
+    start = None # the first byte of the current run; None until the header line has ended
+    rows = 0 # rows in the runs so far, including the current one
+    in_quotes = 0
+    pos = 0
+    with open(path, 'rb') as f:
+        while block := f.read(_BLOCK):
+            buf = np.frombuffer(block, dtype=np.uint8)
+            parity = (np.cumsum(buf == ord('"')) + in_quotes) % 2
+            ends = np.flatnonzero((buf == ord('\n')) & (parity == 0)) + pos + 1
+            in_quotes = int(parity[-1])
+            pos += len(block)
+            if start is None and len(ends):
+                start, ends = int(ends[0]), ends[1:]
+            first = rows - rows % chunksize # row number of the first row of the current run
+            for end in ends[chunksize - rows % chunksize - 1::chunksize]:
+                yield start, int(end), first
+                start, first = int(end), first + chunksize
+            rows += len(ends)
+    if start is not None and start < pos:
+        yield start, pos, rows - rows % chunksize
+
+def read_range(path:str, start:int, end:int, first_row:int, columns:list, plan, reqs:pd.DataFrame, check:bool=True) -> tuple:
+    """
+    Read the rows of a CSV between two byte offsets from split_file(), transform them with `plan` and validate them against `reqs`
+
+    Runs in a worker process of ingest(); parses the same columns with the same dtypes as read_chunks().
+
+    Args:
+        path (str): The CSV. Required.
+        start (int): The first byte to read. Required.
+        end (int): One past the last byte to read. Required.
+        first_row (int): The row number of the first row, used as the index of the chunk. Required.
+        columns (list): The CSV's header. Required.
+        plan (transform.TransformPlan): The compiled transform for the table, e.g. Target.plan. Required.
+        reqs (pd.DataFrame): The table's requirements, e.g. Target.reqs. Required.
+        check (bool): Validate the chunk with validate.check(). Default True.
+
+    Returns:
+        tuple: (<transformed chunk>, <validation report, or None when `check` is False>)
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    wanted = set(plan.rename) | set(plan.fieldnames)
+    chunk = pd.read_csv(io.BytesIO(data), header=None, names=columns, dtype=csv_dtypes(reqs, plan.rename), usecols=lambda c: c in wanted, keep_default_na=False, na_values=[''])
+    chunk.index = pd.RangeIndex(first_row, first_row + len(chunk))
+    chunk = plan.apply(chunk)
+    return chunk, (validate.check(chunk, reqs) if check else None)
+
+def ingest(paths, plan, reqs:pd.DataFrame, max_workers:int=None, chunksize:int=100_000, check:bool=True, max_in_flight:int=None):
+    """
+    Stream the rows of many CSVs as transformed, validated chunks, parsing the chunks in parallel on a process pool
+
+    Each file is cut into runs of `chunksize` rows by split_file(), and each run is read, transformed and validated by a worker process (see read_range()), so one large file is spread over every worker. Finished chunks are yielded as soon as they are done, in no particular order. At most `max_in_flight` chunks are queued, being read or waiting to be yielded at a time, so memory is bounded by `chunksize`, not by the size of the files, and nothing is ever concatenated into one dataframe.
+
+    Args:
+        paths (str or list): A directory, glob pattern, filepath or list of those; see expand(). Required.
+        plan (transform.TransformPlan): The compiled transform for the table, e.g. Target.plan. Required.
+        reqs (pd.DataFrame): The table's requirements, e.g. Target.reqs. Required.
+        max_workers (int): Worker processes. 1 reads the files in this process. Default None (one per CPU).
+        chunksize (int): Rows per chunk. Default 100_000.
+        check (bool): Validate each chunk with validate.check(). Default True.
+        max_in_flight (int): The most chunks submitted to the pool at a time. Default 2 * max_workers.
+
+    Yields:
+        tuple: (<filepath>, <transformed chunk>, <validation report, or None when `check` is False>)
+
+    Examples:
+        import src.ingest as ing
+        surveys.set_col_xwalk({'visit_date':'SDate', 'location_id':'SiteRecID'})
+        for path, chunk, report in ing.ingest('data/surveys/*.csv', surveys.plan, surveys.reqs):
+            if len(report) == 0:
+                ...
+    """
+    files = expand(paths)
+    max_workers = max_workers or os.cpu_count() or 1
+    assert max_workers >= 1, print(f'`max_workers` must be at least 1. You provided {max_workers}')
+    if max_workers == 1:
+        for path in files:
+            for chunk in read_chunks(path, plan, reqs, chunksize):
+                chunk = plan.apply(chunk)
+                yield path, chunk, (validate.check(chunk, reqs) if check else None)
+        return
+
+    def _tasks():
+        for path in files:
+            columns = pd.read_csv(path, nrows=0).columns.tolist()
+            for start, end, first_row in split_file(path, chunksize):
+                yield path, start, end, first_row, columns
+
+    max_in_flight = max_in_flight or 2 * max_workers
+    pending = _tasks()
+    running = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        def _submit():
+            while len(running) < max_in_flight:
+                task = next(pending, None)
+                if task is None:
+                    return
+                running[pool.submit(read_range, *task, plan, reqs, check)] = task[0]
+
+        try:
+            _submit()
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    path = running.pop(fut)
+                    chunk, report = fut.result()
+                    yield path, chunk, report
+                _submit()
+        finally:
+            for fut in running:
+                fut.cancel()
+
+def load_stream(tgt, con, stream, pkey:str=None, **load_kwargs) -> dict:
+    """
+    Load the chunks from ingest() into a Target's table one at a time, skipping chunks that failed validation
+
+    Each passing chunk becomes `tgt.df`, gets primary keys from Target.allocate_keys() (when the table has an IDENTITY column or `pkey` is given) and is loaded with Target.load().
+
+    Args:
+        tgt (target.Target): The table to load. Required.
+        con (sa.Engine): A sqlalchemy engine for the db. Required.
+        stream (iterable): (<filepath>, <chunk>, <report>) tuples, as yielded by ingest(). Required.
+        pkey (str): The primary key field to allocate keys for. Default None (the IDENTITY column, if any).
+        **load_kwargs: Passed to Target.load(), e.g. batch_size=5000.
+
+    Returns:
+        dict: {'rows':<rows loaded>, 'chunks':<chunks loaded>, 'rejected':{<filepath>: <validation violations>}}
+    """
+    allocate = pkey is not None or len(tgt._identity_cols()) > 0
+    stats = {'rows':0, 'chunks':0, 'rejected':{}}
+    for path, chunk, report in stream:
+        if report is not None and len(report) > 0:
+            stats['rejected'][path] = stats['rejected'].get(path, 0) + len(report)
+            continue
+        tgt.set_df(chunk)
+        if allocate:
+            tgt.allocate_keys(con, pkey=pkey)
+        stats['rows'] += tgt.load(con, **load_kwargs)['rows']
+        stats['chunks'] += 1
+    if stats['rejected']:
+        print(f"FAIL: {len(stats['rejected']):,} files had chunks that failed validation and were not loaded")
+    return stats
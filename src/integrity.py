@@ -0,0 +1,86 @@
+"""Check FOREIGN KEY values against hash indexes of the parent tables before loading"""
+import threading
+import pandas as pd
+import sqlalchemy as sa
+import src.sqltypes as sqltypes
+import src.schema as schema
+import src.refindex as refindex
+import src.db_connect as db_connect
+
+_PARENTS = {} # {(<db url>, <normalized parent table>, <parent key columns>): refindex.RefIndex}
+_LOCK = threading.Lock()
+
+def fk_name(fk:schema.Constraint) -> str:
+    """The constraint's name, or a made-up one like 'FK_SiteRecID' when the CREATE TABLE query didn't name it"""
+    return fk.name if fk.name else 'FK_' + '_'.join(fk.columns)
+
+def parent_index(con:sa.Engine, fk:schema.Constraint, fieldtypes:dict, chunksize:int=100_000) -> refindex.RefIndex:
+    """
+    The index of the parent keys a FOREIGN KEY points at, read from the db once per process and shared by every Target
+
+    Only the referenced columns of the parent table are read (see refindex.stream_index()).
+
+    Args:
+        con (sa.Engine): A sqlalchemy engine for the db. Required.
+        fk (schema.Constraint): A FOREIGN KEY constraint, e.g. from Target.schema.foreign_keys. Required.
+        fieldtypes (dict): {<child column>:<SQL Server data type>}; the parent's key columns are hashed with the types of the child columns that reference them. Required.
+        chunksize (int): Rows fetched per round trip. Default 100_000.
+
+    Returns:
+        refindex.RefIndex: An index of the parent table with the referenced columns as its one key
+    """
+    key = (str(con.url), schema.normalize_tablename(fk.ref_table), fk.ref_columns)
+    with _LOCK:
+        idx = _PARENTS.get(key)
+        if idx is None:
+            parent_types = {p:fieldtypes.get(c) for c, p in zip(fk.columns, fk.ref_columns)}
+            table = db_connect.sa_table(con, fk.ref_table)
+            idx = refindex.stream_index(con, table, parent_types, key_cols=[fk.ref_columns], chunksize=chunksize)
+            _PARENTS[key] = idx
+    return idx
+
+def note_loaded(con:sa.Engine, tablename:str, df:pd.DataFrame):
+    """
+    Add freshly loaded rows to any cached parent index of `tablename`, so that children loaded later in the run see them
+
+    Args:
+        con (sa.Engine): The sqlalchemy engine the rows were loaded with. Required.
+        tablename (str): The table the rows were loaded into. Required.
+        df (pd.DataFrame): The loaded rows. Required.
+    """
+    table = schema.normalize_tablename(tablename)
+    with _LOCK:
+        for (url, parent, cols), idx in _PARENTS.items():
+            if url == str(con.url) and parent == table and all(c in df.columns for c in cols):
+                idx.update(df[list(cols)])
+
+def clear():
+    """Forget every cached parent index, e.g. at the start of a new run"""
+    with _LOCK:
+        _PARENTS.clear()
+
+def find_orphans(con:sa.Engine, df:pd.DataFrame, tableschema:schema.TableSchema, chunksize:int=100_000) -> dict:
+    """
+    Find the rows of `df` whose FOREIGN KEY values are missing from the parent table
+
+    Each check is one vectorized hash lookup per FOREIGN KEY. Rows with a null in any of a FOREIGN KEY's columns pass, as they do in SQL Server.
+
+    Args:
+        con (sa.Engine): A sqlalchemy engine for the db. Required.
+        df (pd.DataFrame): Rows to check. Required.
+        tableschema (schema.TableSchema): The schema of the table `df` will be loaded into. Required.
+        chunksize (int): Rows fetched per round trip when a parent index is first built. Default 100_000.
+
+    Returns:
+        dict: {<FOREIGN KEY name>: <pd.DataFrame of the orphan rows of `df`>} for every FOREIGN KEY whose columns are in `df`
+    """
+    fieldtypes = {c.name:sqltypes.fieldtype_of(c) for c in tableschema.columns}
+    orphans = {}
+    for fk in tableschema.foreign_keys:
+        if not all(c in df.columns for c in fk.columns):
+            continue
+        idx = parent_index(con, fk, fieldtypes, chunksize)
+        keys = df[list(fk.columns)]
+        found = idx.contains(keys.set_axis(list(fk.ref_columns), axis=1), fk.ref_columns)
+        orphans[fk_name(fk)] = df[~found & keys.notna().all(axis=1).to_numpy()]
+    return orphans
@@ -0,0 +1,166 @@
+"""A local journal of the batches a load has committed, so an interrupted load can pick up where it stopped"""
+import os
+import json
+import time
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+import src.sqltypes as sqltypes
+
+_VERSION = 3
+
+def data_checksum(df:pd.DataFrame, pkey:str) -> int:
+    """
+    An order-independent checksum of `df` without its `pkey` column, so the same rows match whatever keys they were given
+
+    It only has to recognize the same dataframe on a later attempt, so it hashes the values as they are instead of their canonical form (see sqltypes.canonical()), which costs several times more.
+    """
+    return int(pd.util.hash_pandas_object(df[[c for c in df.columns if c != pkey]], index=False).to_numpy().sum(dtype='uint64'))
+
+class LoadJournal():
+
+    def __init__(self, path:str, table:sa.TableClause, pkey:str):
+        """A LoadJournal is a JSON-lines file with one line for the start of a load, one per committed batch and one when the load is done
+
+        Each line is flushed and fsync'ed before the load moves on, so the file survives a crash of the process or the machine. A half-written last line (from a crash mid-write) is ignored.
+
+        Args:
+            path (str): Relative or absolute filepath of the journal, e.g. 'src/qry/load_SurveyEvent.journal'. Required.
+            table (sa.TableClause): The table being loaded. Required.
+            pkey (str): The (integer) primary key field; committed batches are recognized in the db by their key range. Required.
+        """
+        self.path = path
+        self.table = table
+        self.pkey = pkey
+        self.records = self._read()
+
+    def _read(self) -> list:
+        if not os.path.exists(self.path):
+            return []
+        records = []
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break # the last line was cut off by a crash
+        return records
+
+    def _append(self, record:dict):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.records.append(record)
+
+    @property
+    def header(self) -> dict:
+        return self.records[0] if self.records else None
+
+    @property
+    def done(self) -> bool:
+        return any(r['type'] == 'done' for r in self.records)
+
+    def committed_rows(self) -> int:
+        """The number of leading rows of the load that are journaled as committed"""
+        return max((r['end_row'] for r in self.records if r['type'] == 'batch'), default=0)
+
+    def begin(self, df:pd.DataFrame, commit_rows:int) -> int:
+        """
+        Start a new journal for `df`, or match `df` to the load already in the journal
+
+        When resuming, `df[pkey]` is overwritten with the keys the first attempt used, so rows that were already committed are not given new keys and nothing is loaded twice. `df` must hold the same rows in the same order as the first attempt.
+
+        Args:
+            df (pd.DataFrame): The rows to load, with `pkey` holding consecutive keys (see Target.allocate_keys()). Required.
+            commit_rows (int): Rows per committed batch. Ignored when resuming; the journal's value is kept. Required.
+
+        Returns:
+            int: The row of `df` to resume from; 0 for a new load
+
+        Raises:
+            ValueError: the journal belongs to a different table or different rows
+        """
+        checksum = data_checksum(df, self.pkey)
+        tablename = getattr(self.table, 'fullname', self.table.name)
+        if self.header is None:
+            assert self.pkey in df.columns, print(f'`{self.pkey}` is not a column of `df`; run Target.allocate_keys() first')
+            keys = pd.to_numeric(df[self.pkey]).to_numpy(dtype='int64')
+            first = int(keys[0]) if len(keys) else 0
+            assert np.array_equal(keys, np.arange(first, first + len(keys))), print(f'`{self.pkey}` must hold consecutive keys for a journaled load; run Target.allocate_keys() first')
+            self._append({'type':'start', 'version':_VERSION, 'table':tablename, 'pkey':self.pkey, 'rows':len(df), 'first_key':first, 'commit_rows':commit_rows, 'checksum':checksum, 'time':time.time()})
+            return 0
+        h = self.header
+        if h.get('version') != _VERSION or h['table'] != tablename or h['pkey'] != self.pkey or h['rows'] != len(df) or h['checksum'] != checksum:
+            raise ValueError(f"{self.path} is the journal of a different load ({h['rows']:,} rows into {h['table']}); move it aside to start a new load")
+        keys = np.arange(h['first_key'], h['first_key'] + h['rows'], dtype='int64')
+        if self.pkey in df.columns:
+            df[self.pkey] = keys
+        else:
+            df.insert(0, self.pkey, keys)
+        return self.committed_rows()
+
+    def commit_rows(self) -> int:
+        return self.header['commit_rows']
+
+    def committed(self, df:pd.DataFrame, start_row:int, end_row:int, recovered:bool=False):
+        """
+        Journal rows `start_row` to `end_row - 1` of `df` as committed; call right after the commit
+
+        Args:
+            df (pd.DataFrame): The rows being loaded. Required.
+            start_row (int): First row of the batch. Required.
+            end_row (int): One past the last row of the batch. Required.
+            recovered (bool): The batch was found committed in the db rather than seen committing. Default False.
+        """
+        batch = df.iloc[start_row:end_row]
+        self._append({
+            'type':'batch'
+            ,'start_row':start_row
+            ,'end_row':end_row
+            ,'first_key':int(batch[self.pkey].iloc[0])
+            ,'last_key':int(batch[self.pkey].iloc[-1])
+            ,'checksum':data_checksum(batch, self.pkey)
+            ,'recovered':recovered
+            ,'time':time.time()
+        })
+
+    def recover(self, con:sa.Engine, df:pd.DataFrame, start_row:int, fieldtypes:dict) -> int:
+        """
+        Journal batches that reached the db but not the journal, i.e. the process died between a commit and its journal line
+
+        Reads back the rows in the key range of each batch after `start_row`: an empty range was not committed; a full range whose checksum (see sqltypes.checksum()) matches the batch's rows in `df` was. Only the first one or two ranges are ever read.
+
+        Args:
+            con (sa.Engine): A sqlalchemy engine for the db. Required.
+            df (pd.DataFrame): The rows being loaded. Required.
+            start_row (int): The first row not journaled as committed. Required.
+            fieldtypes (dict): A dictionary of {<column name>:<SQL Server data type>} for the table. Required.
+
+        Returns:
+            int: The first row that is not in the db
+
+        Raises:
+            RuntimeError: a batch is only partly in the db, or its key range holds other rows (e.g. from another loader)
+        """
+        step = self.commit_rows()
+        cols = [c for c in df.columns if c in fieldtypes]
+        qry = sa.select(*[sa.column(c) for c in cols]).select_from(self.table).where(sa.column(self.pkey).between(sa.bindparam('lo'), sa.bindparam('hi')))
+        with con.connect() as conn:
+            while start_row < len(df):
+                end_row = min(start_row + step, len(df))
+                batch = df.iloc[start_row:end_row]
+                lo, hi = int(batch[self.pkey].iloc[0]), int(batch[self.pkey].iloc[-1])
+                found = pd.read_sql_query(qry, conn, params={'lo':lo, 'hi':hi})
+                if len(found) == 0:
+                    break
+                if len(found) != len(batch):
+                    raise RuntimeError(f'{len(found):,} of the {len(batch):,} rows with {self.pkey} {lo:,} to {hi:,} are in the db; remove them before resuming')
+                if sqltypes.checksum(found[cols], fieldtypes) != sqltypes.checksum(batch[cols], fieldtypes):
+                    raise RuntimeError(f'The rows with {self.pkey} {lo:,} to {hi:,} in the db are not the rows of this load (another loader may have used these keys); check them before resuming')
+                self.committed(df, start_row, end_row, recovered=True)
+                start_row = end_row
+        return start_row
+
+    def finish(self, rows:int, seconds:float):
+        self._append({'type':'done', 'rows':rows, 'seconds':seconds, 'time':time.time()})
@@ -0,0 +1,55 @@
+"""Reserve ranges of primary keys without reading the whole target table"""
+import threading
+import sqlalchemy as sa
+
+_LOCK = threading.Lock()
+_RESERVED = {} # {(<db url>, <table>, <pkey>): <highest key handed out by this process>}
+
+def reserve_keys(con:sa.Engine, table:sa.TableClause, pkey:str, n:int, identity:bool=False) -> int:
+    """
+    Reserve `n` consecutive primary keys in `table`
+
+    Only `MAX(pkey)` is read from the db. What keeps a reserved range from being handed out twice depends on where the other loader runs:
+        - in this process: always; a lock and a record of the highest key already handed out for the table
+        - in another process, on SQL Server, when `pkey` is an IDENTITY column: the identity is reseeded past the reserved range under an exclusive application lock (sp_getapplock), so other reserve_keys() calls and plain IDENTITY inserts start after it
+        - in another process otherwise (a non-IDENTITY `pkey`, or another db): nothing is persisted, so another process reading `MAX(pkey)` before the rows are inserted gets the same range. Run the loads of such a table from one process, e.g. with scheduler.LoadScheduler.
+
+    Args:
+        con (sa.Engine): A sqlalchemy engine for the db. Required.
+        table (sa.TableClause): The table to reserve keys in. Required.
+        pkey (str): The name of the (integer) primary key field. Required.
+        n (int): The number of keys to reserve. Required.
+        identity (bool): `pkey` is an IDENTITY column. Default False.
+
+    Returns:
+        int: The first key of the reserved range; the range is `first` to `first + n - 1`
+
+    Examples:
+        import src.keys as keys
+        first = keys.reserve_keys(con, sa.table('SurveyEvent', schema='dbo'), 'SurveyRecID', 500, identity=True)
+    """
+    assert n >= 0, print(f'`n` must be at least 0. You provided {n}')
+    prep = con.dialect.identifier_preparer
+    tablename = prep.format_table(table)
+    registry_key = (str(con.url), tablename, pkey)
+    maxqry = sa.text(f'SELECT MAX({prep.quote(pkey)}) FROM {tablename}')
+
+    with _LOCK:
+        with con.begin() as conn:
+            if con.dialect.name == 'mssql':
+                result = conn.execute(
+                    sa.text("SET NOCOUNT ON; DECLARE @result int; EXEC @result = sp_getapplock @Resource = :res, @LockMode = 'Exclusive', @LockOwner = 'Transaction', @LockTimeout = 60000; SELECT @result")
+                    ,{'res':f'reserve_keys:{tablename}'}
+                ).scalar()
+                if result is None or result < 0: # -1 timeout, -2 cancelled, -3 deadlock victim, -999 error
+                    raise RuntimeError(f'Could not lock {tablename} to reserve keys (sp_getapplock returned {result})')
+            high = conn.execute(maxqry).scalar() or 0
+            if con.dialect.name == 'mssql' and identity:
+                ident = conn.execute(sa.text('SELECT IDENT_CURRENT(:t)'), {'t':tablename}).scalar()
+                high = max(high, int(ident or 0))
+            high = max(int(high), _RESERVED.get(registry_key, 0))
+            if con.dialect.name == 'mssql' and identity and n > 0:
+                conn.execute(sa.text(f"DBCC CHECKIDENT ('{tablename}', RESEED, {high + n})"))
+        _RESERVED[registry_key] = high + n
+
+    return high + 1
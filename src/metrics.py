@@ -0,0 +1,223 @@
+"""Time and measure the stages of a load (parse, read ref, allocate keys, validate, generate SQL, load, verify)"""
+import json
+import time
+import logging
+import threading
+import tracemalloc
+
+_ENABLED = False
+_TRACE_MEMORY = False
+_KEEP = True
+_HOOKS = [] # functions called with each finished stage's record
+_RECORDS = []
+_LOCK = threading.Lock()
+_LOCAL = threading.local() # the stack of open stages of each thread, so nested stages can pass their memory peak up
+
+class _NullStage():
+    """Stands in for a Stage while metrics are disabled; entering and leaving it does nothing"""
+    rows = None
+    tags = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+class Stage():
+
+    def __init__(self, name:str, rows:int=None, **tags):
+        """A Stage times one step of a load from `with` to the end of its block, then hands its record to every hook
+
+        Args:
+            name (str): The step, e.g. 'load'. Required.
+            rows (int): Rows processed; can also be set inside the block as `st.rows = ...`. Default None.
+            **tags: Anything else to record, e.g. table='[dbo].[SurveyEvent]'.
+        """
+        self.name = name
+        self.rows = rows
+        self.tags = tags
+        self._peak = 0
+
+    def __enter__(self):
+        stack = getattr(_LOCAL, 'stack', None)
+        if stack is None:
+            stack = _LOCAL.stack = []
+        if _TRACE_MEMORY and tracemalloc.is_tracing():
+            if stack: # the peak is about to be reset; keep the parent's peak so far
+                stack[-1]._peak = max(stack[-1]._peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            self._mem_start = tracemalloc.get_traced_memory()[0]
+        stack.append(self)
+        self._stack = stack
+        self._start = time.time()
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self._t0
+        stack = self._stack # the stack of the thread that entered the stage, which may not be this one (e.g. a generator closed elsewhere)
+        for i in range(len(stack) - 1, -1, -1):
+            if stack[i] is self: # normally the top, unless a stage entered after this one was never left
+                del stack[i]
+                break
+        peak_mb = None
+        if _TRACE_MEMORY and tracemalloc.is_tracing():
+            peak = max(self._peak, tracemalloc.get_traced_memory()[1])
+            peak_mb = max(peak - self._mem_start, 0) / 2**20
+            if stack:
+                stack[-1]._peak = max(stack[-1]._peak, peak)
+        record = {
+            'stage':self.name
+            ,'start':self._start
+            ,'seconds':seconds
+            ,'rows':self.rows
+            ,'rows_per_sec':self.rows / seconds if self.rows is not None and seconds > 0 else None
+            ,'peak_mb':peak_mb
+            ,'error':repr(exc) if exc is not None else None
+            ,**self.tags
+        }
+        _emit(record)
+        return False
+
+def stage(name:str, rows:int=None, **tags):
+    """
+    Time a step of a load; use as `with metrics.stage('load', table=...) as st:`
+
+    While metrics are disabled (the default) this returns a shared do-nothing object, so instrumented code pays only for the call.
+
+    Each finished stage produces a record: {'stage', 'start' (epoch seconds), 'seconds', 'rows', 'rows_per_sec', 'peak_mb', 'error', <tags>}. 'peak_mb' is the most memory allocated by Python above the level at the start of the stage, and is only measured when enable(trace_memory=True); with several threads it includes their allocations too.
+
+    Args:
+        name (str): The step, e.g. 'parse', 'read_ref', 'allocate_keys', 'validate', 'generate_sql', 'load', 'verify'. Required.
+        rows (int): Rows processed; can also be set inside the block as `st.rows = ...`. Default None.
+        **tags: Anything else to record, e.g. table='[dbo].[SurveyEvent]'.
+
+    Returns:
+        Stage: A context manager
+
+    Examples:
+        import src.metrics as metrics
+        with metrics.stage('read_csv', file='surveys.csv') as st:
+            df = pd.read_csv('surveys.csv')
+            st.rows = len(df)
+    """
+    if not _ENABLED:
+        return _NULL_STAGE
+    return Stage(name, rows, **tags)
+
+def _emit(record:dict):
+    if _KEEP:
+        with _LOCK:
+            _RECORDS.append(record)
+    for hook in list(_HOOKS):
+        try:
+            hook(record)
+        except Exception as e:
+            print(f'metrics hook {hook!r} failed: {e!r}')
+
+def enable(trace_memory:bool=False, keep:bool=True):
+    """
+    Start recording stages
+
+    Args:
+        trace_memory (bool): Also measure each stage's peak memory with tracemalloc. This slows Python down noticeably while it is on. Default False.
+        keep (bool): Keep every record in memory for records() and to_json(); turn off when only hooks are wanted in a long-running process. Default True.
+
+    Examples:
+        import src.metrics as metrics
+        metrics.enable(trace_memory=True)
+        metrics.add_hook(metrics.log_hook())
+    """
+    global _ENABLED, _TRACE_MEMORY, _KEEP
+    _TRACE_MEMORY = trace_memory
+    _KEEP = keep
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _ENABLED = True
+
+def disable():
+    """Stop recording stages; stages already recorded are kept until clear()"""
+    global _ENABLED, _TRACE_MEMORY
+    _ENABLED = False
+    if _TRACE_MEMORY and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _TRACE_MEMORY = False
+
+def enabled() -> bool:
+    return _ENABLED
+
+def add_hook(hook):
+    """
+    Call `hook(record)` with the record of every stage as it finishes
+
+    Args:
+        hook (function): Takes one dict; see stage() for its keys. Exceptions it raises are printed and ignored. Required.
+    """
+    _HOOKS.append(hook)
+
+def remove_hook(hook):
+    if hook in _HOOKS:
+        _HOOKS.remove(hook)
+
+def log_hook(logger:logging.Logger=None, level:int=logging.INFO):
+    """
+    A hook that writes each record to `logger` as one line of JSON, for structured-log collectors
+
+    Args:
+        logger (logging.Logger): Default the 'src.metrics' logger.
+        level (int): Default logging.INFO.
+
+    Returns:
+        function: A hook for add_hook()
+    """
+    logger = logger if logger is not None else logging.getLogger(__name__)
+    def _hook(record:dict):
+        logger.log(level, json.dumps(record, default=str))
+    return _hook
+
+def records() -> list:
+    """A copy of every record kept since the last clear()"""
+    with _LOCK:
+        return list(_RECORDS)
+
+def clear():
+    with _LOCK:
+        _RECORDS.clear()
+
+def summary() -> dict:
+    """
+    Totals per stage of the records kept so far
+
+    Returns:
+        dict: {<stage>: {'calls', 'seconds', 'rows', 'rows_per_sec', 'peak_mb'}}
+    """
+    out = {}
+    for r in records():
+        s = out.setdefault(r['stage'], {'calls':0, 'seconds':0.0, 'rows':0, 'rows_per_sec':None, 'peak_mb':None})
+        s['calls'] += 1
+        s['seconds'] += r['seconds']
+        s['rows'] += r['rows'] or 0
+        if r['peak_mb'] is not None:
+            s['peak_mb'] = max(s['peak_mb'] or 0.0, r['peak_mb'])
+    for s in out.values():
+        s['rows_per_sec'] = s['rows'] / s['seconds'] if s['rows'] and s['seconds'] > 0 else None
+    return out
+
+def to_json(path:str=None) -> str:
+    """
+    The kept records and their summary() as JSON
+
+    Args:
+        path (str): Also write the JSON to this file. Default None.
+
+    Returns:
+        str: {"records": [...], "summary": {...}}
+    """
+    text = json.dumps({'records':records(), 'summary':summary()}, indent=2, default=str)
+    if path is not None:
+        with open(path, 'w') as f:
+            f.write(text)
+    return text
@@ -0,0 +1,185 @@
+"""Load a Target from many chunks with reading, transforming, validating and writing overlapped on asyncio"""
+import time
+import asyncio
+import pandas as pd
+import sqlalchemy as sa
+import src.ingest as ingest
+import src.validate as validate
+
+_DONE = object() # put on a queue after the last chunk
+
+class Pipeline():
+
+    def __init__(self, tgt, con:sa.Engine, queue_size:int=2, chunksize:int=100_000, pkey:str=None, on_invalid:str='skip', **load_kwargs):
+        """A Pipeline loads chunks of rows into a Target's table through four stages that run at the same time, connected by bounded queues:
+
+            read (CSV chunk) -> transform (Target.plan) -> check (validate.check()) -> write (Target.allocate_keys() + Target.load())
+
+        While chunk N is being inserted, chunk N+1 is being validated and chunk N+2 transformed. Each queue holds at most `queue_size` chunks, so a slow db holds back reading instead of piling chunks up in memory. The pandas and db work of each stage runs on a worker thread, so the event loop only passes chunks along.
+
+        Args:
+            tgt (target.Target): The table to load, with its `col_xwalk` set if the source columns need renaming. Required.
+            con (sa.Engine): A sqlalchemy engine for the db. A SQLite engine works for local testing. Required.
+            queue_size (int): Chunks each queue can hold before the stage feeding it waits. Default 2.
+            chunksize (int): Rows per chunk read from each CSV. Default 100_000.
+            pkey (str): The primary key field to allocate keys for. Default None (the IDENTITY column, if any).
+            on_invalid (str): 'skip' leaves chunks that fail validation out of the load; 'raise' stops the pipeline at the first one. Default 'skip'.
+            **load_kwargs: Passed to Target.load(), e.g. batch_size=5000.
+
+        Examples:
+            import src.pipeline as p
+            surveys.set_col_xwalk({'visit_date':'SDate', 'location_id':'SiteRecID'})
+            stats = p.run(surveys, con, 'data/survey_events/*.csv')
+        """
+        assert queue_size >= 1, print(f'`queue_size` must be at least 1. You provided {queue_size}')
+        assert on_invalid in ('skip', 'raise'), print(f"`on_invalid` must be 'skip' or 'raise'. You provided {on_invalid}")
+        self.tgt = tgt
+        self.con = con
+        self.queue_size = queue_size
+        self.chunksize = chunksize
+        self.pkey = pkey
+        self.on_invalid = on_invalid
+        self.load_kwargs = load_kwargs
+        self._tasks = []
+        self.stats = {}
+
+    def _reset_stats(self):
+        self.stats = {
+            'chunks_read':0, 'rows_read':0, 'chunks_loaded':0, 'rows_loaded':0
+            ,'rejected':[] # (<source>, <validation report>) of each chunk that failed validation
+            ,'busy_seconds':{'read':0.0, 'transform':0.0, 'check':0.0, 'write':0.0} # time each stage spent working, not waiting
+            ,'wall_seconds':0.0
+            ,'cancelled':False
+        }
+
+    async def _work(self, stage:str, fn, *args):
+        start = time.perf_counter()
+        try:
+            return await asyncio.to_thread(fn, *args)
+        finally:
+            self.stats['busy_seconds'][stage] += time.perf_counter() - start
+
+    def _chunks(self, source):
+        """(<source name>, <chunk>) for each chunk of `source`: CSV path(s) or an iterable of dataframes"""
+        if isinstance(source, str) or (isinstance(source, (list, tuple)) and all(isinstance(s, str) for s in source)):
+            for path in ingest.expand(source):
+                for chunk in ingest.read_chunks(path, self.tgt.plan, self.tgt.reqs, self.chunksize):
+                    yield path, chunk
+        else:
+            for i, chunk in enumerate(source):
+                yield f'chunk {i}', chunk
+
+    async def _read(self, source, out:asyncio.Queue):
+        chunks = self._chunks(source)
+        while True:
+            item = await self._work('read', next, chunks, _DONE)
+            if item is _DONE:
+                break
+            self.stats['chunks_read'] += 1
+            self.stats['rows_read'] += len(item[1])
+            await out.put(item)
+        await out.put(_DONE)
+
+    async def _transform(self, inq:asyncio.Queue, out:asyncio.Queue):
+        while (item := await inq.get()) is not _DONE:
+            name, chunk = item
+            await out.put((name, await self._work('transform', self.tgt.plan.apply, chunk)))
+        await out.put(_DONE)
+
+    async def _check(self, inq:asyncio.Queue, out:asyncio.Queue):
+        while (item := await inq.get()) is not _DONE:
+            name, chunk = item
+            report = await self._work('check', validate.check, chunk, self.tgt.reqs)
+            if len(report) > 0:
+                self.stats['rejected'].append((name, report))
+                if self.on_invalid == 'raise':
+                    raise ValueError(f'{name} failed validation with {len(report):,} violations')
+                continue
+            await out.put((name, chunk))
+        await out.put(_DONE)
+
+    def _write_chunk(self, chunk:pd.DataFrame) -> int:
+        self.tgt.set_df(chunk)
+        if self.pkey is not None or len(self.tgt._identity_cols()) > 0:
+            self.tgt.allocate_keys(self.con, pkey=self.pkey)
+        return self.tgt.load(self.con, **self.load_kwargs)['rows']
+
+    async def _write(self, inq:asyncio.Queue):
+        while (item := await inq.get()) is not _DONE:
+            write = asyncio.ensure_future(self._work('write', self._write_chunk, item[1]))
+            try:
+                rows = await asyncio.shield(write)
+            except asyncio.CancelledError:
+                # the chunk being inserted finishes (and commits or rolls back) before the pipeline stops
+                await asyncio.wait([write])
+                if not write.cancelled() and write.exception() is None:
+                    self.stats['chunks_loaded'] += 1
+                    self.stats['rows_loaded'] += write.result()
+                raise
+            self.stats['chunks_loaded'] += 1
+            self.stats['rows_loaded'] += rows
+
+    async def run(self, source) -> dict:
+        """
+        Push every chunk of `source` through the pipeline
+
+        If a stage fails, or the task running this coroutine is cancelled (e.g. with asyncio.wait_for() or stop()), the other stages are cancelled; a chunk that is mid-insert is allowed to finish first, so the db is never left mid-batch. Chunks already loaded stay loaded.
+
+        Args:
+            source (str, list or iterable): A directory, glob pattern or filepath of CSVs, a list of those (see ingest.expand()), or an iterable of dataframes. Required.
+
+        Returns:
+            dict: {'chunks_read', 'rows_read', 'chunks_loaded', 'rows_loaded', 'rejected', 'busy_seconds', 'wall_seconds', 'cancelled'}
+        """
+        self._reset_stats()
+        start = time.perf_counter()
+        self.tgt.plan # compile once, before the stages share it
+        read_q, transform_q, check_q = (asyncio.Queue(maxsize=self.queue_size) for _ in range(3))
+        self._tasks = [
+            asyncio.ensure_future(self._read(source, read_q))
+            ,asyncio.ensure_future(self._transform(read_q, transform_q))
+            ,asyncio.ensure_future(self._check(transform_q, check_q))
+            ,asyncio.ensure_future(self._write(check_q))
+        ]
+        try:
+            done, _ = await asyncio.wait(self._tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if task.cancelled():
+                    self.stats['cancelled'] = True # by stop()
+                elif task.exception() is not None:
+                    raise task.exception()
+        except asyncio.CancelledError:
+            self.stats['cancelled'] = True
+            raise
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            self.stats['wall_seconds'] = time.perf_counter() - start
+            busy = ', '.join(f'{k} {v:.2f}s' for k, v in self.stats['busy_seconds'].items())
+            print(f"Loaded {self.stats['rows_loaded']:,} of {self.stats['rows_read']:,} rows into {self.tgt.target_tablename} in {self.stats['wall_seconds']:.2f}s (busy: {busy}); {len(self.stats['rejected'])} chunks rejected")
+        return self.stats
+
+    def stop(self):
+        """Cancel every stage; the chunk being inserted, if any, finishes first"""
+        for task in self._tasks:
+            task.cancel()
+
+def run(tgt, con:sa.Engine, source, **kwargs) -> dict:
+    """
+    Run a Pipeline from ordinary (non-async) code
+
+    Args:
+        tgt (target.Target): The table to load. Required.
+        con (sa.Engine): A sqlalchemy engine for the db. Required.
+        source (str, list or iterable): CSVs or dataframes; see Pipeline.run(). Required.
+        **kwargs: Passed to Pipeline(), e.g. queue_size=4, batch_size=5000.
+
+    Returns:
+        dict: See Pipeline.run()
+
+    Examples:
+        import src.pipeline as p
+        stats = p.run(surveys, con, 'data/survey_events', chunksize=50_000, batch_size=5000)
+    """
+    return asyncio.run(Pipeline(tgt, con, **kwargs).run(source))
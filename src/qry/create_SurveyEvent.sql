@@ -0,0 +1,70 @@
+SET ANSI_NULLS ON
+GO
+
+SET QUOTED_IDENTIFIER ON
+GO
+
+CREATE TABLE [dbo].[SurveyEvent](
+	[SurveyRecID] [int] IDENTITY(1,1) NOT FOR REPLICATION NOT NULL,
+	[SiteRecID] [int] NOT NULL,
+	[PIID] [char](3) NOT NULL,
+	[EditDate] [datetime] NOT NULL,
+	[UnitID] [int] NULL,
+	[HabitatTypeID] [int] NULL,
+	[SurveyID] [int] NULL,
+	[ProjectCode] [varchar](10) NOT NULL,
+	[DetEstID] [char](2) NOT NULL,
+	[ObsDetTypeID] [char](1) NOT NULL,
+	[SMID] [char](2) NOT NULL,
+	[SDate] [datetime] NOT NULL,
+	[TBegin] [char](5) NOT NULL,
+	[TEnd] [char](5) NOT NULL,
+	[Noise] [char](1) NULL,
+	[Visit] [int] NULL,
+	[ObsName1] [varchar](30) NOT NULL,
+	[ObsName2] [varchar](30) NULL,
+	[ObsName3] [varchar](30) NULL,
+	[ObsName4] [varchar](30) NULL,
+	[ObsName5] [varchar](30) NULL,
+	[TransectDir] [varchar](1) NULL,
+	[UnitEffortID] [char](2) NULL,
+	[EffectValue1] [int] NULL,
+	[EffectValue2] [int] NULL,
+	[EffectValue3] [int] NULL,
+	[EffectValue4] [int] NULL,
+	[EffectValue5] [int] NULL,
+	[SurveyNotes] [varchar](2000) NULL,
+	[UserID] [char](5) NOT NULL,
+	[Checked] [char](1) NOT NULL,
+	[ExportDate] [datetime] NULL,
+	[PlotTransect] [varchar](50) NULL,
+ CONSTRAINT [PK_SurveyEvent] PRIMARY KEY CLUSTERED 
+(
+	[SurveyRecID] ASC
+)WITH (PAD_INDEX = OFF, STATISTICS_NORECOMPUTE = OFF, IGNORE_DUP_KEY = OFF, ALLOW_ROW_LOCKS = ON, ALLOW_PAGE_LOCKS = ON) ON [PRIMARY]
+) ON [PRIMARY]
+GO
+
+ALTER TABLE [dbo].[SurveyEvent] ADD  CONSTRAINT [DF_SurveyEvent_PIID]  DEFAULT ('NE1') FOR [PIID]
+GO
+
+ALTER TABLE [dbo].[SurveyEvent]  WITH CHECK ADD  CONSTRAINT [FK_SurveyEvent_SiteConstants] FOREIGN KEY([SiteRecID])
+REFERENCES [dbo].[SiteConstants] ([SiteRecID])
+GO
+
+ALTER TABLE [dbo].[SurveyEvent] CHECK CONSTRAINT [FK_SurveyEvent_SiteConstants]
+GO
+
+ALTER TABLE [dbo].[SurveyEvent]  WITH CHECK ADD  CONSTRAINT [FK_SurveyEvent_Project] FOREIGN KEY([ProjectCode])
+REFERENCES [dbo].[Project] ([ProjectCode])
+GO
+
+ALTER TABLE [dbo].[SurveyEvent] CHECK CONSTRAINT [FK_SurveyEvent_Project]
+GO
+
+ALTER TABLE [dbo].[SurveyEvent]  WITH CHECK ADD  CONSTRAINT [FK_SurveyEvent_LocalObserver] FOREIGN KEY([ObsName1])
+REFERENCES [dbo].[LocalObserver] ([ObsName])
+GO
+
+ALTER TABLE [dbo].[SurveyEvent] CHECK CONSTRAINT [FK_SurveyEvent_LocalObserver]
+GO
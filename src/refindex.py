@@ -0,0 +1,125 @@
+"""Compact, streamed indexes of the key columns of a db table"""
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+import src.sqltypes as sqltypes
+
+_COMPACT_AT = 2_000_000 # de-duplicate the hashes collected so far once this many are waiting
+
+class RefIndex():
+
+    def __init__(self, fieldtypes:dict, key_cols:list=(), max_cols:list=()):
+        """A RefIndex remembers just enough about the rows of a table to allocate keys, spot duplicates and check foreign keys, without keeping the rows
+
+        For each key (one column or several) it keeps the distinct 64-bit hashes of the key's values (see sqltypes.hash_rows()), i.e. 8 bytes per distinct key; for each max column it keeps one number.
+
+        Args:
+            fieldtypes (dict): A dictionary of {<column name>:<SQL Server data type>} for the table. Required.
+            key_cols (list): Keys to index; each is a column name or a tuple of column names. Default ().
+            max_cols (list): Numeric columns to track the maximum of, e.g. the primary key. Default ().
+
+        Examples:
+            import src.refindex as ri
+            idx = ri.RefIndex({'SiteRecID':'int'}, key_cols=['SiteRecID'])
+            idx.update(chunk)
+            idx.contains(surveys.get_df(), 'SiteRecID')
+        """
+        self.fieldtypes = dict(fieldtypes)
+        self.key_cols = [(k,) if isinstance(k, str) else tuple(k) for k in key_cols]
+        self.max_cols = list(max_cols)
+        self.rows = 0
+        self.max = {c:None for c in self.max_cols}
+        self._pending = {k:[] for k in self.key_cols}
+        self._keys = {k:np.empty(0, dtype='uint64') for k in self.key_cols}
+        self._lookup = {}
+
+    def update(self, chunk:pd.DataFrame):
+        """
+        Fold a chunk of the table's rows into the index; the chunk can be thrown away afterwards
+
+        Args:
+            chunk (pd.DataFrame): Rows of the table with (at least) every key and max column. Required.
+        """
+        self.rows += len(chunk)
+        for c in self.max_cols:
+            m = pd.to_numeric(chunk[c]).max()
+            if pd.notna(m) and (self.max[c] is None or m > self.max[c]):
+                self.max[c] = m.item() if hasattr(m, 'item') else m
+        for k in self.key_cols:
+            self._pending[k].append(pd.unique(sqltypes.hash_rows(chunk[list(k)], self.fieldtypes)))
+            if sum(len(h) for h in self._pending[k]) > _COMPACT_AT:
+                self._compact(k)
+        self._lookup = {}
+
+    def _compact(self, k:tuple):
+        if self._pending[k]:
+            self._keys[k] = pd.unique(np.concatenate([self._keys[k]] + self._pending[k]))
+            self._pending[k] = []
+
+    def _cols(self, cols) -> tuple:
+        k = (cols,) if isinstance(cols, str) else tuple(cols)
+        assert k in self._pending, print(f'{k} is not indexed; index it with key_cols=[..., {k}]')
+        return k
+
+    def keys(self, cols) -> np.ndarray:
+        """
+        The distinct hashes of a key's values
+
+        Args:
+            cols (str or tuple): An indexed key. Required.
+
+        Returns:
+            np.ndarray: uint64 hashes
+        """
+        k = self._cols(cols)
+        self._compact(k)
+        return self._keys[k]
+
+    def contains(self, df:pd.DataFrame, cols) -> np.ndarray:
+        """
+        Which rows of `df` have a key that is already in the table
+
+        Args:
+            df (pd.DataFrame): Rows to look up, with the key's columns. Required.
+            cols (str or tuple): An indexed key. Required.
+
+        Returns:
+            np.ndarray: A boolean mask, one element per row of `df`
+        """
+        k = self._cols(cols)
+        if k not in self._lookup:
+            self._lookup[k] = pd.Index(self.keys(k)) # hash table is built once, on the first lookup
+        return self._lookup[k].get_indexer(sqltypes.hash_rows(df[list(k)], self.fieldtypes)) >= 0
+
+    def nbytes(self) -> int:
+        """Approximate memory held by the index"""
+        return sum(self._keys[k].nbytes + sum(h.nbytes for h in self._pending[k]) for k in self.key_cols)
+
+def stream_index(con:sa.Engine, table:sa.TableClause, fieldtypes:dict, key_cols:list=(), max_cols:list=(), chunksize:int=100_000) -> RefIndex:
+    """
+    Build a RefIndex of a db table by reading only the columns it needs, `chunksize` rows at a time
+
+    Args:
+        con (sa.Engine): A sqlalchemy engine for the db. Required.
+        table (sa.TableClause): The table to read. Required.
+        fieldtypes (dict): A dictionary of {<column name>:<SQL Server data type>} for the table. Required.
+        key_cols (list): Keys to index; each is a column name or a tuple of column names. Default ().
+        max_cols (list): Numeric columns to track the maximum of. Default ().
+        chunksize (int): Rows fetched per round trip. Default 100_000.
+
+    Returns:
+        RefIndex: The index
+
+    Raises:
+        ValueError: `key_cols` and `max_cols` are both empty, so there is nothing to read
+    """
+    idx = RefIndex(fieldtypes, key_cols, max_cols)
+    cols = list(dict.fromkeys([c for k in idx.key_cols for c in k] + idx.max_cols))
+    if not cols:
+        raise ValueError(f'Nothing to index in {table.name}: provide `key_cols` or `max_cols`, e.g. the primary key')
+    qry = sa.select(*[sa.column(c) for c in cols]).select_from(table)
+    with con.connect() as conn:
+        conn = conn.execution_options(stream_results=True)
+        for chunk in pd.read_sql_query(qry, conn, chunksize=chunksize):
+            idx.update(chunk)
+    return idx
@@ -0,0 +1,176 @@
+"""Load many Targets concurrently, parents before children, following their FOREIGN KEY constraints"""
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import sqlalchemy as sa
+import src.schema as schema
+
+def build_dag(targets:list) -> dict:
+    """
+    Work out which Targets must be loaded before which from the FOREIGN KEY constraints in their CREATE TABLE queries
+
+    Only foreign keys between the given Targets count; references to tables that are not being loaded (and self-references) are ignored.
+
+    Args:
+        targets (list): target.Target objects. Required.
+
+    Returns:
+        dict: {<Target.target_tablename>: <set of the target_tablenames it references, i.e. its parents>}
+    """
+    names = {schema.normalize_tablename(tgt.target_tablename):tgt.target_tablename for tgt in targets}
+    assert len(names) == len(targets), print('Each Target must load a different table')
+    dag = {}
+    for tgt in targets:
+        parents = set()
+        for fk in tgt.schema.foreign_keys:
+            parent = names.get(schema.normalize_tablename(fk.ref_table))
+            if parent is not None and parent != tgt.target_tablename:
+                parents.add(parent)
+        dag[tgt.target_tablename] = parents
+    return dag
+
+def topological_order(dag:dict) -> list:
+    """
+    Order the tables of `dag` so that every table comes after its parents
+
+    Args:
+        dag (dict): {<table>: <set of parent tables>}, as returned by build_dag(). Required.
+
+    Returns:
+        list: Table names, parents first
+
+    Raises:
+        ValueError: the foreign keys form a cycle, so there is no safe load order
+    """
+    remaining = {k:set(v) for k, v in dag.items()}
+    order = []
+    ready = sorted(k for k, v in remaining.items() if not v)
+    while ready:
+        name = ready.pop(0)
+        order.append(name)
+        for child, parents in remaining.items():
+            if name in parents:
+                parents.discard(name)
+                if not parents and child not in order and child not in ready:
+                    ready.append(child)
+    if len(order) < len(dag):
+        raise ValueError(f'FOREIGN KEY cycle between {sorted(set(dag) - set(order))}')
+    return order
+
+def critical_path(dag:dict, seconds:dict) -> tuple:
+    """
+    The chain of parent -> child loads that took the longest in total; no schedule can finish faster than this chain
+
+    Args:
+        dag (dict): {<table>: <set of parent tables>}, as returned by build_dag(). Required.
+        seconds (dict): {<table>: <seconds its load took>}. Required.
+
+    Returns:
+        tuple: (<list of tables, parents first>, <total seconds>)
+    """
+    finish = {}
+    via = {}
+    for name in topological_order(dag):
+        before = max(dag[name], key=lambda p: finish[p], default=None)
+        finish[name] = seconds.get(name, 0.0) + (finish[before] if before is not None else 0.0)
+        via[name] = before
+    if not finish:
+        return [], 0.0
+    name = max(finish, key=finish.get)
+    total = finish[name]
+    path = []
+    while name is not None:
+        path.append(name)
+        name = via[name]
+    return path[::-1], total
+
+class LoadScheduler():
+
+    def __init__(self, targets:list, con:sa.Engine, max_workers:int=4, loader=None):
+        """A LoadScheduler loads several Targets at once on a thread pool, starting each Target only after every Target it references through a FOREIGN KEY has been loaded and committed
+
+        Args:
+            targets (list): target.Target objects with their `df` set. Required.
+            con (sa.Engine): A sqlalchemy engine for the db. Its connection pool should allow at least `max_workers` connections. Required.
+            max_workers (int): The most tables loaded at the same time, and so the most db connections in use. Default 4.
+            loader (function): Called as loader(<Target>, <con>) to load one table; returns a dict of stats. Default calls Target.load(con).
+
+        Examples:
+            import src.scheduler as s
+            sched = s.LoadScheduler([site_constants, projects, observers, surveys], con, max_workers=3)
+            report = sched.run()
+            report['critical_path']
+        """
+        assert max_workers >= 1, print(f'`max_workers` must be at least 1. You provided {max_workers}')
+        self.targets = {tgt.target_tablename:tgt for tgt in targets}
+        self.con = con
+        self.max_workers = max_workers
+        self.loader = loader if loader is not None else (lambda tgt, con: tgt.load(con))
+        self.dag = build_dag(targets)
+        self.order = topological_order(self.dag) # fail early on FOREIGN KEY cycles
+
+    def _run_one(self, name:str) -> dict:
+        start = time.perf_counter()
+        stats = self.loader(self.targets[name], self.con) or {}
+        end = time.perf_counter()
+        return {'start':start, 'end':end, 'seconds':end - start, 'rows':stats.get('rows'), 'status':'loaded'}
+
+    def run(self) -> dict:
+        """
+        Load every Target, parents before children, with up to `max_workers` tables loading at the same time
+
+        If a table fails to load, the tables that depend on it (directly or not) are skipped; unrelated tables still load.
+
+        Returns:
+            dict: {
+                'tables': {<table>: {'start', 'end', 'seconds', 'rows', 'status' ('loaded', 'failed' or 'skipped'), 'error'}}
+                ,'wall_seconds': <seconds from the first load starting to the last one finishing>
+                ,'critical_path': <list of tables, parents first; the longest chain of dependent loads>
+                ,'critical_path_seconds': <total seconds of that chain>
+            }
+        """
+        waiting = {k:set(v) for k, v in self.dag.items()}
+        results = {}
+        running = {}
+        t0 = time.perf_counter()
+
+        def _submit_ready(pool):
+            for name in [n for n in self.order if n in waiting and not waiting[n]]:
+                del waiting[name]
+                running[pool.submit(self._run_one, name)] = name
+
+        def _skip_children(name):
+            for child in [c for c, parents in waiting.items() if name in parents]:
+                del waiting[child]
+                results[child] = {'start':None, 'end':None, 'seconds':0.0, 'rows':None, 'status':'skipped', 'error':f'parent {name} did not load'}
+                _skip_children(child)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            _submit_ready(pool)
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    name = running.pop(fut)
+                    try:
+                        results[name] = {**fut.result(), 'error':None}
+                    except Exception as e:
+                        results[name] = {'start':None, 'end':None, 'seconds':0.0, 'rows':None, 'status':'failed', 'error':repr(e)}
+                        print(f'Failed to load {name}: {e!r}')
+                        _skip_children(name)
+                        continue
+                    for parents in waiting.values():
+                        parents.discard(name)
+                _submit_ready(pool)
+
+        for r in results.values():
+            for k in ('start', 'end'):
+                if r[k] is not None:
+                    r[k] -= t0
+        path, path_seconds = critical_path(self.dag, {k:v['seconds'] for k, v in results.items()})
+        report = {
+            'tables':results
+            ,'wall_seconds':max((r['end'] for r in results.values() if r['end'] is not None), default=0.0)
+            ,'critical_path':path
+            ,'critical_path_seconds':path_seconds
+        }
+        print(f"Loaded {sum(r['status'] == 'loaded' for r in results.values())} of {len(results)} tables in {report['wall_seconds']:.2f}s; critical path {' -> '.join(path)} ({path_seconds:.2f}s)")
+        return report
@@ -0,0 +1,446 @@
+"""Parse SQL Server CREATE TABLE scripts into immutable table schemas"""
+import re
+from dataclasses import dataclass, replace
+from typing import Optional, Tuple
+import numpy as np
+import pandas as pd
+
+_TOKEN = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<ident>\[(?:[^\]]|\]\])*\]|"(?:[^"]|"")*")
+  | (?P<string>N?'(?:[^']|'')*')
+  | (?P<number>\d+(?:\.\d+)?)
+  | (?P<word>[A-Za-z_@#][A-Za-z0-9_@#$]*)
+  | (?P<punct>[(),.;])
+  | (?P<other>\S)
+""", re.S | re.X)
+
+LEN_TYPES = {'char', 'varchar', 'nchar', 'nvarchar', 'binary', 'varbinary'}
+PRECISION_TYPES = {'decimal', 'numeric'}
+FRACTION_TYPES = {'datetime2', 'datetimeoffset', 'time'}
+
+@dataclass(frozen=True)
+class Column:
+    """One field of a table, as declared in its CREATE TABLE query"""
+    name: str
+    fieldtype: str
+    nullable: bool = True
+    maxlen: Optional[int] = None # char/varchar/nchar/nvarchar/binary/varbinary; None for (max)
+    precision: Optional[int] = None # decimal/numeric/float
+    scale: Optional[int] = None # decimal/numeric; fractional seconds of datetime2/datetimeoffset/time
+    identity: Optional[Tuple[int, int]] = None # (seed, increment) of an IDENTITY field
+    default: Optional[str] = None # the DEFAULT expression, e.g. "'NE1'" or 'getdate()'
+    computed: Optional[str] = None # the expression of a computed field, e.g. '[amt]*2' for `[tot] AS ([amt]*2)`; its `fieldtype` is ''
+    original: str = '' # the field's definition as written in the query
+
+@dataclass(frozen=True)
+class Constraint:
+    """A PRIMARY KEY, UNIQUE, FOREIGN KEY, CHECK or DEFAULT constraint on a table"""
+    kind: str # 'PRIMARY KEY', 'UNIQUE', 'FOREIGN KEY', 'CHECK' or 'DEFAULT'
+    name: Optional[str] = None
+    columns: Tuple[str, ...] = ()
+    ref_table: Optional[str] = None # FOREIGN KEY only; the referenced table as written, e.g. '[dbo].[SiteConstants]'
+    ref_columns: Tuple[str, ...] = () # FOREIGN KEY only
+    expression: Optional[str] = None # CHECK and DEFAULT only
+
+@dataclass(frozen=True)
+class TableSchema:
+    """Everything a CREATE TABLE query (and the ALTER TABLE ... ADD CONSTRAINT statements that follow it) says about a table"""
+    tablename: str # as written, e.g. '[dbo].[SurveyEvent]'
+    schema_name: Optional[str] # e.g. 'dbo'
+    table_name: str # e.g. 'SurveyEvent'
+    columns: Tuple[Column, ...] = () # the stored fields, which rows are inserted with
+    constraints: Tuple[Constraint, ...] = ()
+    computed_columns: Tuple[Column, ...] = () # fields SQL Server computes from the others (`AS <expression>`); they cannot be inserted, so they are not in `columns`
+
+    @property
+    def fieldnames(self) -> tuple:
+        return tuple(c.name for c in self.columns)
+
+    @property
+    def primary_key(self) -> tuple:
+        """The fieldnames of the primary key; empty when there is none"""
+        for con in self.constraints:
+            if con.kind == 'PRIMARY KEY':
+                return con.columns
+        return ()
+
+    @property
+    def identity(self) -> tuple:
+        """The fieldnames of IDENTITY fields"""
+        return tuple(c.name for c in self.columns if c.identity is not None)
+
+    @property
+    def foreign_keys(self) -> tuple:
+        """The FOREIGN KEY constraints"""
+        return tuple(con for con in self.constraints if con.kind == 'FOREIGN KEY')
+
+    def column(self, name:str) -> Column:
+        """Look up a field by name"""
+        for c in self.columns:
+            if c.name == name:
+                return c
+        raise KeyError(f'{self.tablename} has no field named {name}')
+
+    def to_reqs(self) -> pd.DataFrame:
+        """
+        A dataframe with one row per field, in CREATE TABLE order, as stored in Target.reqs
+
+        Columns: 'original', 'fieldnames', 'fieldtypes', 'maxlens', 'can_be_null' ('NOT NULL' or 'NULLABLE'), 'precision', 'scale', 'identity' (bool), 'default'
+        """
+        return pd.DataFrame({
+            'original':[c.original for c in self.columns]
+            ,'fieldnames':[c.name for c in self.columns]
+            ,'fieldtypes':[c.fieldtype for c in self.columns]
+            ,'maxlens':[np.nan if c.maxlen is None else c.maxlen for c in self.columns]
+            ,'can_be_null':['NULLABLE' if c.nullable else 'NOT NULL' for c in self.columns]
+            ,'precision':[np.nan if c.precision is None else c.precision for c in self.columns]
+            ,'scale':[np.nan if c.scale is None else c.scale for c in self.columns]
+            ,'identity':[c.identity is not None for c in self.columns]
+            ,'default':[c.default for c in self.columns]
+        })
+
+def _unquote(name:str) -> str:
+    """'[dbo]' -> 'dbo', '"dbo"' -> 'dbo'"""
+    if name.startswith('['):
+        return name[1:-1].replace(']]', ']')
+    if name.startswith('"'):
+        return name[1:-1].replace('""', '"')
+    return name
+
+def normalize_tablename(tablename:str, default_schema:str='dbo') -> str:
+    """
+    Reduce the different ways of writing a table name to one comparable key
+
+    e.g. '[dbo].[SurveyEvent]', 'dbo.SurveyEvent' and 'SurveyEvent' all become 'dbo.surveyevent'
+
+    Args:
+        tablename (str): A table name, optionally schema-qualified and [bracketed]. Required.
+        default_schema (str): The schema assumed when `tablename` has none. None leaves unqualified names unqualified. Default 'dbo'.
+
+    Returns:
+        str: The lowercased, unquoted, schema-qualified name
+    """
+    schema_name, table_name = split_tablename(tablename)
+    if schema_name is None:
+        schema_name = default_schema
+    return (table_name if schema_name is None else f'{schema_name}.{table_name}').lower()
+
+def split_tablename(tablename:str) -> tuple:
+    """
+    Split a table name into its unquoted (schema, table) parts, e.g. '[dbo].[SurveyEvent]' -> ('dbo', 'SurveyEvent'), 'SurveyEvent' -> (None, 'SurveyEvent')
+    """
+    parts = [_unquote(p.strip()) for p in tablename.split('.')]
+    return (parts[-2] if len(parts) > 1 else None), parts[-1]
+
+def tokenize(sql:str) -> list:
+    """
+    Break a SQL script into (kind, value, start, end) tokens in one pass, dropping whitespace and comments
+
+    Args:
+        sql (str): The text of a SQL script. Required.
+
+    Returns:
+        list: One (kind, value, start, end) tuple per token; kind is one of 'ident' ([bracketed] or "quoted" names), 'string', 'number', 'word', 'punct', 'other'
+    """
+    return [
+        (m.lastgroup, m.group(), m.start(), m.end())
+        for m in _TOKEN.finditer(sql)
+        if m.lastgroup not in ('space', 'comment')
+    ]
+
+class _Parser():
+    """Walks the tokens of one SQL script. Not intended to be used directly; see parse_ddl()."""
+
+    def __init__(self, sql:str, toks:list=None):
+        self.sql = sql
+        self.toks = tokenize(sql) if toks is None else toks
+        self.i = 0
+
+    def peek(self, ahead:int=0) -> tuple:
+        j = self.i + ahead
+        return self.toks[j] if j < len(self.toks) else ('eof', '', len(self.sql), len(self.sql))
+
+    def is_word(self, *words, ahead:int=0) -> bool:
+        kind, value, _, _ = self.peek(ahead)
+        return kind == 'word' and value.upper() in words
+
+    def next(self) -> tuple:
+        tok = self.peek()
+        self.i += 1
+        return tok
+
+    def name(self) -> str:
+        """Consume one name; returns it unquoted"""
+        return _unquote(self.next()[1])
+
+    def qualified_name(self) -> tuple:
+        """Consume a dotted name like [dbo].[SurveyEvent]; returns (<text as written>, <unquoted parts>)"""
+        start = self.peek()[2]
+        parts = [self.name()]
+        while self.peek()[1] == '.':
+            self.next()
+            parts.append(self.name())
+        return self.sql[start:self.toks[self.i - 1][3]], parts
+
+    def group(self) -> tuple:
+        """Consume a parenthesized group; returns (<text inside the parentheses>, <tokens inside, split on top-level commas>)"""
+        assert self.next()[1] == '('
+        start = self.peek()[2]
+        depth = 1
+        items = [[]]
+        while True:
+            tok = self.next()
+            if tok[0] == 'eof':
+                raise ValueError('Unbalanced parentheses in CREATE TABLE query')
+            if tok[1] == '(':
+                depth += 1
+            elif tok[1] == ')':
+                depth -= 1
+                if depth == 0:
+                    return self.sql[start:tok[2]], [x for x in items if x]
+            elif tok[1] == ',' and depth == 1:
+                items.append([])
+                continue
+            items[-1].append(tok)
+
+    def skip_group(self):
+        if self.peek()[1] == '(':
+            self.group()
+
+    def name_list(self) -> tuple:
+        """Consume '(a ASC, b DESC)'; returns ('a', 'b')"""
+        _, items = self.group()
+        return tuple(_unquote(item[0][1]) for item in items)
+
+def _strip_parens(expr:str) -> str:
+    """'((0))' -> '0'"""
+    expr = expr.strip()
+    while expr.startswith('(') and expr.endswith(')'):
+        inner = expr[1:-1]
+        depth = 0
+        for ch in inner:
+            depth += (ch == '(') - (ch == ')')
+            if depth < 0:
+                return expr
+        expr = inner.strip()
+    return expr
+
+def _parse_constraint(p:_Parser, name:str=None, column:str=None) -> Constraint:
+    """
+    Consume one constraint starting at its kind keyword (PRIMARY/UNIQUE/FOREIGN/REFERENCES/CHECK/DEFAULT)
+
+    `column` is the field a column-level constraint is declared on.
+    """
+    kind = p.next()[1].upper()
+    if kind in ('PRIMARY', 'UNIQUE'):
+        if kind == 'PRIMARY':
+            p.next() # KEY
+        while p.is_word('CLUSTERED', 'NONCLUSTERED'):
+            p.next()
+        cols = p.name_list() if p.peek()[1] == '(' else (column,)
+        return Constraint('PRIMARY KEY' if kind == 'PRIMARY' else 'UNIQUE', name, cols)
+    if kind in ('FOREIGN', 'REFERENCES'):
+        if kind == 'FOREIGN':
+            p.next() # KEY
+            cols = p.name_list()
+            p.next() # REFERENCES
+        else:
+            cols = (column,)
+        ref_table, _ = p.qualified_name()
+        ref_cols = p.name_list() if p.peek()[1] == '(' else cols
+        return Constraint('FOREIGN KEY', name, cols, ref_table, ref_cols)
+    if kind == 'CHECK':
+        expr, _ = p.group()
+        return Constraint('CHECK', name, (column,) if column else (), expression=_strip_parens(expr))
+    if kind == 'DEFAULT':
+        start = p.peek()[2]
+        if p.peek()[1] == '(':
+            p.group()
+        else:
+            p.next()
+        expr = p.sql[start:p.toks[p.i - 1][3]]
+        if p.is_word('FOR'):
+            p.next()
+            column = p.name()
+        return Constraint('DEFAULT', name, (column,), expression=_strip_parens(expr))
+    raise ValueError(f'Unrecognized constraint {kind}')
+
+def _parse_element(sql:str, toks:list) -> tuple:
+    """
+    Parse one comma-separated element of a CREATE TABLE body: a field definition or a table constraint
+
+    Returns:
+        tuple: (<Column or None>, <list of Constraints>)
+    """
+    p = _Parser(sql, toks)
+    constraints = []
+
+    if p.is_word('CONSTRAINT', 'PRIMARY', 'UNIQUE', 'FOREIGN', 'CHECK'):
+        name = None
+        if p.is_word('CONSTRAINT'):
+            p.next()
+            name = p.name()
+        constraints.append(_parse_constraint(p, name))
+        return None, constraints
+
+    fieldname = p.name()
+    col = {'nullable':True}
+    if p.is_word('AS'): # a computed field, e.g. [tot] AS ([amt]*2) PERSISTED
+        p.next()
+        start = p.peek()[2]
+        if p.peek()[1] == '(':
+            p.group()
+        else:
+            p.next()
+        col['computed'] = _strip_parens(p.sql[start:p.toks[p.i - 1][3]])
+        fieldtype = ''
+    else:
+        _, typeparts = p.qualified_name()
+        fieldtype = typeparts[-1].lower()
+        if p.peek()[1] == '(':
+            _, args = p.group()
+            args = [a[0][1].lower() for a in args]
+            if fieldtype in LEN_TYPES:
+                col['maxlen'] = None if args[0] == 'max' else int(args[0])
+            elif fieldtype in PRECISION_TYPES:
+                col['precision'] = int(args[0])
+                col['scale'] = int(args[1]) if len(args) > 1 else 0
+            elif fieldtype == 'float':
+                col['precision'] = int(args[0])
+            elif fieldtype in FRACTION_TYPES:
+                col['scale'] = int(args[0])
+        elif fieldtype in PRECISION_TYPES:
+            col['precision'], col['scale'] = 18, 0
+        elif fieldtype in LEN_TYPES:
+            col['maxlen'] = 1
+
+    while p.peek()[0] != 'eof':
+        name = None
+        if p.is_word('CONSTRAINT'):
+            p.next()
+            name = p.name()
+        if p.is_word('NOT') and p.is_word('NULL', ahead=1):
+            p.next(); p.next()
+            col['nullable'] = False
+        elif p.is_word('NOT') and p.is_word('FOR', ahead=1):
+            p.next(); p.next(); p.next() # NOT FOR REPLICATION
+        elif p.is_word('NULL'):
+            p.next()
+        elif p.is_word('IDENTITY'):
+            p.next()
+            seed, incr = 1, 1
+            if p.peek()[1] == '(':
+                _, args = p.group()
+                seed, incr = (int(''.join(t[1] for t in arg)) for arg in args)
+            col['identity'] = (seed, incr)
+        elif p.is_word('PRIMARY', 'UNIQUE', 'REFERENCES', 'CHECK', 'DEFAULT'):
+            constraint = _parse_constraint(p, name, fieldname)
+            if constraint.kind == 'DEFAULT':
+                col['default'] = constraint.expression
+            elif constraint.kind == 'PRIMARY KEY':
+                col['nullable'] = False
+            constraints.append(constraint)
+        elif p.is_word('COLLATE'):
+            p.next(); p.next()
+        else:
+            p.next()
+            p.skip_group()
+
+    original = ' '.join(sql[toks[0][2]:toks[-1][3]].split())
+    return Column(fieldname, fieldtype, original=original, **col), constraints
+
+def parse_ddl(sql:str) -> tuple:
+    """
+    Parse every CREATE TABLE statement in a SQL script in one pass over its tokens
+
+    `ALTER TABLE ... ADD CONSTRAINT` statements in the same script (e.g. the DEFAULT and FOREIGN KEY constraints that SSMS "Script as Create" appends) are folded into the schema of the table they alter.
+
+    Args:
+        sql (str): The text of a SQL script. Required.
+
+    Returns:
+        tuple: One TableSchema per CREATE TABLE statement, in the order they appear
+
+    Examples:
+        import src.schema as schema
+        with open('src/qry/create_SurveyEvent.sql', 'r') as f:
+            surveys, = schema.parse_ddl(f.read())
+        surveys.primary_key
+    """
+    p = _Parser(sql)
+    tables = [] # [[<tablename>, <parts>, <columns>, <constraints>], ...]
+    while p.peek()[0] != 'eof':
+        if p.is_word('CREATE') and p.is_word('TABLE', ahead=1):
+            p.next(); p.next()
+            tablename, parts = p.qualified_name()
+            _, elements = p.group()
+            columns, constraints = [], []
+            for toks in elements:
+                col, cons = _parse_element(sql, toks)
+                if col is not None:
+                    columns.append(col)
+                constraints.extend(cons)
+            tables.append([tablename, parts, columns, constraints])
+        elif p.is_word('ALTER') and p.is_word('TABLE', ahead=1):
+            p.next(); p.next()
+            _, parts = p.qualified_name()
+            if p.is_word('WITH'):
+                p.next()
+            if p.is_word('CHECK', 'NOCHECK') and p.is_word('ADD', ahead=1):
+                p.next()
+            if not p.is_word('ADD'):
+                continue
+            p.next()
+            name = None
+            if p.is_word('CONSTRAINT'):
+                p.next()
+                name = p.name()
+            if not p.is_word('PRIMARY', 'UNIQUE', 'FOREIGN', 'CHECK', 'DEFAULT'):
+                continue
+            constraint = _parse_constraint(p, name)
+            for table in tables:
+                if table[1][-1].lower() == parts[-1].lower() and (len(parts) == 1 or len(table[1]) == 1 or table[1][-2].lower() == parts[-2].lower()):
+                    table[3].append(constraint)
+                    if constraint.kind == 'DEFAULT':
+                        table[2] = [
+                            replace(c, default=constraint.expression) if c.name == constraint.columns[0] else c
+                            for c in table[2]
+                        ]
+        else:
+            p.next()
+
+    schemas = []
+    for tablename, parts, columns, constraints in tables:
+        # primary key fields are NOT NULL whether or not the query says so
+        pkey = [c for con in constraints if con.kind == 'PRIMARY KEY' for c in con.columns]
+        columns = [replace(c, nullable=False) if c.name in pkey else c for c in columns]
+        schemas.append(TableSchema(
+            tablename=tablename
+            ,schema_name=parts[-2] if len(parts) > 1 else None
+            ,table_name=parts[-1]
+            ,columns=tuple(c for c in columns if c.computed is None)
+            ,constraints=tuple(constraints)
+            ,computed_columns=tuple(c for c in columns if c.computed is not None)
+        ))
+    return tuple(schemas)
+
+def read_create_table(create_qry:str) -> TableSchema:
+    """
+    Read a CREATE TABLE query from file and parse it
+
+    Args:
+        create_qry (str): Relative or absolute filepath to a CREATE TABLE .sql file. Required.
+
+    Returns:
+        TableSchema: The schema of the first table created in the file
+
+    Examples:
+        import src.schema as schema
+        surveys = schema.read_create_table('src/qry/create_SurveyEvent.sql')
+    """
+    with open(create_qry, 'r') as f:
+        tables = parse_ddl(f.read())
+    assert len(tables) > 0, print(f'No CREATE TABLE statement found in {create_qry}')
+    return tables[0]
@@ -0,0 +1,357 @@
+"""Translate pandas columns into SQL Server values according to a table's declared data types"""
+import decimal
+import numpy as np
+import pandas as pd
+
+INT_TYPES = {'int', 'bigint', 'smallint', 'tinyint', 'bit'}
+FLOAT_TYPES = {'decimal', 'numeric', 'float', 'real', 'money', 'smallmoney'}
+EXACT_TYPES = {'decimal', 'numeric', 'money', 'smallmoney'} # FLOAT_TYPES that SQL Server stores exactly; their values are never passed through float64, which keeps only ~15 digits
+DATETIME_TYPES = {'datetime', 'datetime2', 'smalldatetime'} | {f'datetime2({n})' for n in range(8)} # datetime2(n): n digits of fractional seconds; see fieldtype_of()
+DATE_TYPES = {'date'}
+UNICODE_TYPES = {'nchar', 'nvarchar', 'ntext'}
+# pandas>=2 infers one datetime format from the first value; 'mixed' re-parses the stragglers value by value
+_MIXED_DATES = {'format':'mixed'} if int(pd.__version__.split('.')[0]) >= 2 else {}
+
+def infer_fieldtype(s:pd.Series) -> str:
+    """
+    Guess a SQL Server data type for a column that is not declared in a CREATE TABLE query
+
+    Args:
+        s (pd.Series): A column of a dataframe. Required.
+
+    Returns:
+        str: A SQL Server data type name, e.g. 'int', 'float', 'datetime', 'varchar'
+    """
+    if pd.api.types.is_bool_dtype(s) or pd.api.types.is_integer_dtype(s):
+        return 'int'
+    if pd.api.types.is_float_dtype(s):
+        return 'float'
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return 'datetime'
+    return 'varchar'
+
+def to_datetimes(s:pd.Series, errors:str='raise') -> pd.Series:
+    """
+    Parse a column of dates or date-like strings into datetimes, tolerating a mix of formats
+
+    Args:
+        s (pd.Series): A column of datetimes or strings that pandas can parse into datetimes. Required.
+        errors (str): 'raise' to raise on unparseable values, 'coerce' to turn them into NaT. Default 'raise'.
+
+    Returns:
+        pd.Series: A column of dtype datetime64
+    """
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return s
+    out = pd.to_datetime(s, errors='coerce')
+    bad = out.isna() & s.notna()
+    if bad.any():
+        out[bad] = pd.to_datetime(s[bad], errors='coerce', **_MIXED_DATES)
+        bad = out.isna() & s.notna()
+        if bad.any() and errors == 'raise':
+            raise ValueError(f'Could not parse {s[bad].iloc[0]!r} in column `{s.name}` as a datetime')
+    return out
+
+def to_decimals(s:pd.Series) -> pd.Series:
+    """
+    Parse a column of numbers or numeric strings into decimal.Decimal without passing through float64, so decimal(p,s) values with more than 15 digits keep every digit
+
+    e.g. '12345678901234.5678' -> Decimal('12345678901234.5678'); floats become the Decimal of their shortest repr, e.g. 0.1 -> Decimal('0.1'). Each distinct value is parsed once.
+
+    Args:
+        s (pd.Series): A column of numbers, Decimals or numeric strings. Required.
+
+    Returns:
+        pd.Series: A column of dtype object holding Decimals, with None for nulls
+
+    Raises:
+        ValueError: a value is not a finite number
+    """
+    def _parse(v) -> decimal.Decimal:
+        if isinstance(v, decimal.Decimal):
+            d = v
+        elif isinstance(v, (float, np.floating)):
+            d = decimal.Decimal(repr(float(v)))
+        elif isinstance(v, (int, np.integer)):
+            d = decimal.Decimal(int(v))
+        else:
+            try:
+                d = decimal.Decimal(str(v).strip())
+            except decimal.InvalidOperation:
+                d = None
+        if d is None or not d.is_finite():
+            raise ValueError(f'Could not parse {v!r} in column `{s.name}` as a number')
+        return d
+    codes, uniques = pd.factorize(s)
+    out = np.array([_parse(v) for v in uniques] + [None], dtype=object)[codes]
+    return pd.Series(out, index=s.index, name=s.name, dtype=object)
+
+_CANONICAL = decimal.Context(prec=80) # more digits than decimal(38,s) can hold, so normalize() never rounds
+
+def _decimal_text(s:pd.Series, normalize:bool=False) -> np.ndarray:
+    """
+    The exact text of each value of a decimal column, e.g. '12345678901234.5678', with None for nulls; `normalize` drops trailing zeros (46.00 -> '46') so equal values read the same
+    """
+    codes, uniques = pd.factorize(s)
+    decs = to_decimals(pd.Series(uniques, name=s.name, dtype=object))
+    if normalize:
+        decs = [decimal.Decimal(0) if d.is_zero() else _CANONICAL.normalize(d) for d in decs]
+    return np.array([format(d, 'f') for d in decs] + [None], dtype=object)[codes]
+
+def fieldtype_of(column) -> str:
+    """
+    The data type of a schema.Column as the functions here expect it: the type name, with the fractional-second digits of a datetime2 appended, e.g. 'datetime2(3)'
+
+    Args:
+        column (schema.Column): A field of a parsed CREATE TABLE query. Required.
+
+    Returns:
+        str: e.g. 'int', 'varchar', 'datetime2(3)'
+    """
+    if column.fieldtype == 'datetime2' and column.scale is not None:
+        return f'datetime2({column.scale})'
+    return column.fieldtype
+
+def _nanos(s:pd.Series) -> np.ndarray:
+    """The nanoseconds past the whole second of each datetime; 0 for NaT"""
+    nanos = (s - s.dt.floor('s')).to_numpy(dtype='timedelta64[ns]').astype('int64')
+    return np.where(s.isna().to_numpy(), 0, nanos)
+
+def round_datetimes(s:pd.Series, fieldtype:str='datetime') -> pd.Series:
+    """
+    Round datetimes the way SQL Server does when it stores them in a column of type `fieldtype`
+
+    - datetime: to 1/300 of a second, shown as .000, .003 or .007 (e.g. .995 -> .997, .999 -> the next second)
+    - smalldatetime: to the minute; 29.998 seconds round down, 29.999 up
+    - datetime2(n): to n digits of fractional seconds; 7 when n is not given
+    - date: to the day
+
+    Args:
+        s (pd.Series): A column of dtype datetime64. Required.
+        fieldtype (str): The SQL Server data type of the column. Default 'datetime'.
+
+    Returns:
+        pd.Series: A column of dtype datetime64
+    """
+    if fieldtype in DATE_TYPES:
+        return s.dt.floor('D')
+    if fieldtype.startswith('datetime2'):
+        unit = 10 ** (9 - (int(fieldtype[10:-1]) if '(' in fieldtype else 7))
+        nanos = (_nanos(s) + unit // 2) // unit * unit
+        return s.dt.floor('s') + pd.to_timedelta(nanos, unit='ns')
+    ticks = (_nanos(s) * 300 + 500_000_000) // 1_000_000_000 # 1/300 s, rounded half up
+    out = s.dt.floor('s') + pd.to_timedelta((ticks * 10 + 1) // 3, unit='ms')
+    if fieldtype == 'smalldatetime':
+        out = (out + pd.Timedelta(seconds=30)).dt.floor('min')
+    return out
+
+def format_datetimes(s:pd.Series, fieldtype:str='datetime') -> pd.Series:
+    """
+    Format a column of dates or date-like strings the way SQL Server expects them, e.g. '2024-06-23 00:00:00.000'
+
+    Values are first rounded the way SQL Server stores them (see round_datetimes()), so a value reads back from the db exactly as it was formatted. datetime2(n) keeps n digits of fractional seconds; the other datetime types show milliseconds. Nulls stay null.
+
+    Args:
+        s (pd.Series): A column of datetimes or strings that pandas can parse into datetimes. Required.
+        fieldtype (str): The SQL Server data type of the column. 'date' drops the time part. Default 'datetime'.
+
+    Returns:
+        pd.Series: A column of strings
+    """
+    s = round_datetimes(to_datetimes(s), fieldtype)
+    text = _datetime_text(s, fieldtype).astype(object)
+    return pd.Series(np.where(s.isna().to_numpy(), None, text), index=s.index, name=s.name)
+
+def _datetime_text(s:pd.Series, fieldtype:str, quote:str='') -> np.ndarray:
+    """
+    The format_datetimes() text of rounded datetimes as a fixed-width numpy str array, each value wrapped in `quote`; NaT comes out as garbage for the caller to mask
+
+    The characters are computed with integer arithmetic on whole columns and written straight into the array's buffer, a few times faster than strftime or np.datetime_as_string().
+    """
+    if isinstance(s.dtype, pd.DatetimeTZDtype):
+        s = s.dt.tz_localize(None) # keep the wall time, as strftime would
+    if fieldtype in DATE_TYPES:
+        digits = None
+    elif fieldtype.startswith('datetime2'):
+        digits = int(fieldtype[10:-1]) if '(' in fieldtype else 7
+    else:
+        digits = 3
+    ns = s.to_numpy(dtype='datetime64[ns]').view('int64')
+    days, tod = np.divmod(ns, 86_400 * 10**9)
+    # days since 1970-01-01 -> year, month, day (H. Hinnant's civil_from_days)
+    z = days + 719_468
+    era = z // 146_097
+    doe = z - era * 146_097
+    yoe = (doe - doe // 1460 + doe // 36_524 - doe // 146_096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    month = np.where(mp < 10, mp + 3, mp - 9)
+    parts = [(yoe + era * 400 + (month <= 2), 4), '-', (month, 2), '-', (doy - (153 * mp + 2) // 5 + 1, 2)]
+    if digits is not None:
+        secs, nanos = np.divmod(tod, 10**9)
+        parts += [' ', (secs // 3600, 2), ':', (secs // 60 % 60, 2), ':', (secs % 60, 2)]
+        if digits:
+            parts += ['.', (nanos // 10 ** (9 - digits), digits)]
+    if quote:
+        parts = [quote] + parts + [quote]
+    width = sum(1 if isinstance(p, str) else p[1] for p in parts)
+    chars = np.empty((width, len(ns)), dtype='uint32') # one UCS-4 code point per character; filled a character position at a time, then transposed
+    pos = 0
+    for p in parts:
+        if isinstance(p, str):
+            chars[pos] = ord(p)
+            pos += 1
+            continue
+        vals, n = p
+        vals = vals.astype('int32')
+        for k in range(n - 1, -1, -1):
+            vals, digit = np.divmod(vals, 10)
+            chars[pos + k] = digit + 48
+        pos += n
+    return np.ascontiguousarray(chars.T).view(f'U{width}').ravel() # the layout of a numpy str array
+
+def to_literals(s:pd.Series, fieldtype:str=None) -> np.ndarray:
+    """
+    Translate a whole column into SQL Server literals in one vectorized pass
+
+    e.g. 46 -> '46', 'Brander, Susanne' -> "'Brander, Susanne'", "O'Neil" -> "'O''Neil'", NaN/None/NaT -> 'NULL'. decimal/numeric/money values are written from their exact value (see to_decimals()), never through float.
+
+    Args:
+        s (pd.Series): A column of a dataframe. Required.
+        fieldtype (str): The column's SQL Server data type (e.g. from `Target.reqs['fieldtypes']`). Inferred from the column's dtype when None. Default None.
+
+    Returns:
+        np.ndarray: An object array of str, one literal per row
+    """
+    if fieldtype is None:
+        fieldtype = infer_fieldtype(s)
+    fieldtype = fieldtype.lower()
+    if fieldtype in INT_TYPES and s.dtype.kind in 'iu' and not s.hasnans:
+        # ints without nulls are usually unique (e.g. primary keys), so skip the factorizing; nullable Int64 with <NA> takes the slow path
+        return s.to_numpy().astype(str).astype(object)
+    # translate each distinct value once; code -1 (null) picks up the trailing 'NULL'
+    codes, uniques = pd.factorize(s)
+    uniques = pd.Series(uniques, name=s.name, dtype=object if uniques.dtype == object else None) # pandas>=3 would infer its slower str dtype for text
+    if fieldtype in INT_TYPES:
+        out = pd.to_numeric(uniques).astype('Int64').to_numpy(dtype='int64').astype(str)
+    elif fieldtype in EXACT_TYPES:
+        out = _decimal_text(uniques)
+    elif fieldtype in FLOAT_TYPES:
+        out = pd.to_numeric(uniques).astype('float64').astype(str)
+    elif fieldtype in DATETIME_TYPES or fieldtype in DATE_TYPES:
+        out = _datetime_text(round_datetimes(to_datetimes(uniques), fieldtype), fieldtype, quote="'")
+    else:
+        out = "'" + uniques.astype(str).str.replace("'", "''", regex=False) + "'"
+        if fieldtype in UNICODE_TYPES:
+            out = 'N' + out
+    return np.append(np.asarray(out, dtype=object), 'NULL')[codes]
+
+def to_rows(df:pd.DataFrame, fieldtypes:dict) -> list:
+    """
+    Translate every row of a dataframe into a parenthesized SQL VALUES row, e.g. "(46, 'NE1', NULL)"
+
+    Args:
+        df (pd.DataFrame): Rows to translate. Required.
+        fieldtypes (dict): A dictionary of {<column name>:<SQL Server data type>}. Columns missing from the dictionary have their type inferred. Required.
+
+    Returns:
+        list: One VALUES row (str) per row in `df`
+    """
+    lits = [to_literals(df[col], fieldtypes.get(col)) for col in df.columns]
+    lits[0] = '(' + lits[0] # the parentheses ride on the first and last literals, one vectorized add each, instead of one more format() per row
+    lits[-1] = lits[-1] + ')'
+    return list(map(', '.join, zip(*lits)))
+
+def to_params(df:pd.DataFrame, fieldtypes:dict) -> list:
+    """
+    Translate every row of a dataframe into a tuple of plain Python values that any DBAPI driver can bind
+
+    Translation is done a column at a time: ints become int, float/real become float, decimal/numeric/money become their exact text (e.g. '12345678901234.5678', which SQL Server converts without loss; a float keeps only ~15 digits), dates become SQL Server datetime strings, everything else becomes str, and NaN/None/NaT become None.
+
+    Args:
+        df (pd.DataFrame): Rows to translate. Required.
+        fieldtypes (dict): A dictionary of {<column name>:<SQL Server data type>}. Columns missing from the dictionary have their type inferred. Required.
+
+    Returns:
+        list: One tuple per row in `df`
+    """
+    cols = []
+    for col in df.columns:
+        s = df[col]
+        fieldtype = (fieldtypes.get(col) or infer_fieldtype(s)).lower()
+        isnull = s.isna().to_numpy()
+        if fieldtype in INT_TYPES:
+            vals = pd.to_numeric(s).astype('Int64').astype(object)
+        elif fieldtype in EXACT_TYPES:
+            vals = pd.Series(_decimal_text(s), dtype=object)
+        elif fieldtype in FLOAT_TYPES:
+            vals = pd.to_numeric(s).astype('float64').astype(object)
+        elif fieldtype in DATETIME_TYPES or fieldtype in DATE_TYPES:
+            vals = format_datetimes(s, fieldtype).astype(object)
+        else:
+            vals = s.astype(str).astype(object)
+        cols.append(np.where(isnull, None, vals.to_numpy(dtype=object)))
+    return list(zip(*cols))
+
+def canonical(s:pd.Series, fieldtype:str=None) -> pd.Series:
+    """
+    Translate a column into one agreed-upon string form per value, so that the same value compares equal whether it came from a CSV, a dataframe or the db
+
+    e.g. 46, 46.0 and '46' -> '46' for int fields; Decimal('46.50'), 46.5 and '46.5' -> '46.5' for decimal fields, exact to every digit; '2024-06-23' and Timestamp('2024-06-23') -> '2024-06-23 00:00:00.000' for datetime fields; trailing spaces that SQL Server pads char(n) fields with are dropped. Nulls become '\\x00NULL'.
+
+    Args:
+        s (pd.Series): A column of a dataframe. Required.
+        fieldtype (str): The column's SQL Server data type. Inferred from the column's dtype when None. Default None.
+
+    Returns:
+        pd.Series: A column of str with the same index as `s`
+    """
+    if fieldtype is None:
+        fieldtype = infer_fieldtype(s)
+    fieldtype = fieldtype.lower()
+    if fieldtype in INT_TYPES and s.dtype.kind in 'iu' and not s.hasnans:
+        return pd.Series(s.to_numpy().astype(str).astype(object), index=s.index, name=s.name)
+    codes, uniques = pd.factorize(s)
+    uniques = pd.Series(uniques, name=s.name, dtype=object if uniques.dtype == object else None) # pandas>=3 would infer its slower str dtype for text
+    if fieldtype in INT_TYPES:
+        out = pd.to_numeric(uniques).astype('Int64').astype(str)
+    elif fieldtype in EXACT_TYPES:
+        out = pd.Series(_decimal_text(uniques, normalize=True), dtype=object)
+    elif fieldtype in FLOAT_TYPES:
+        out = pd.to_numeric(uniques).astype('float64').astype(str)
+    elif fieldtype in DATETIME_TYPES or fieldtype in DATE_TYPES:
+        out = format_datetimes(uniques, fieldtype)
+    else:
+        out = uniques.astype(str).str.rstrip(' ')
+    return pd.Series(np.append(out.to_numpy(dtype=object), '\x00NULL')[codes], index=s.index, name=s.name)
+
+def hash_rows(df:pd.DataFrame, fieldtypes:dict) -> np.ndarray:
+    """
+    A 64-bit hash of every row of `df`, computed from the canonical() form of each value
+
+    Rows with the same values hash the same no matter where they came from, so hashes of rows in a dataframe can be compared with hashes of rows read back from the db.
+
+    Args:
+        df (pd.DataFrame): Rows to hash. Required.
+        fieldtypes (dict): A dictionary of {<column name>:<SQL Server data type>}. Columns missing from the dictionary have their type inferred. Required.
+
+    Returns:
+        np.ndarray: One uint64 per row of `df`
+    """
+    canon = pd.DataFrame({col:canonical(df[col], fieldtypes.get(col)) for col in df.columns}, index=df.index)
+    return pd.util.hash_pandas_object(canon, index=False).to_numpy()
+
+def checksum(df:pd.DataFrame, fieldtypes:dict) -> int:
+    """
+    An order-independent checksum of the rows of `df`: the sum of their hash_rows() hashes, modulo 2**64
+
+    The same rows give the same checksum in any order, and checksums of separate chunks add up (modulo 2**64) to the checksum of the whole, so a table can be checked one chunk at a time.
+
+    Args:
+        df (pd.DataFrame): Rows to checksum. Required.
+        fieldtypes (dict): A dictionary of {<column name>:<SQL Server data type>}. Required.
+
+    Returns:
+        int: The checksum
+    """
+    return int(hash_rows(df, fieldtypes).sum(dtype='uint64'))
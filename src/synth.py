@@ -0,0 +1,152 @@
+"""Generate synthetic rows that satisfy a table's requirements, for benchmarks and local testing"""
+import numpy as np
+import pandas as pd
+import src.sqltypes as sqltypes
+import src.validate as validate
+
+_LETTERS = np.array(list('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789 '))
+
+def _strings(rng:np.random.Generator, k:int, maxlen:int, fixed:bool) -> np.ndarray:
+    """`k` random strings of exactly `maxlen` characters (`fixed`) or of 1 to `maxlen` characters"""
+    chars = _LETTERS[rng.integers(0, len(_LETTERS) - 1, size=(k, maxlen))] # no spaces in the first character
+    chars[:, 1:] = _LETTERS[rng.integers(0, len(_LETTERS), size=(k, maxlen - 1))]
+    pool = chars.view(f'<U{maxlen}').ravel()
+    if not fixed:
+        lens = rng.integers(1, maxlen + 1, size=k)
+        pool = np.array([s[:n].rstrip() or s[0] for s, n in zip(pool, lens)])
+    return pool.astype(object)
+
+def _column(rng:np.random.Generator, n:int, fieldtype:str, maxlen, precision, scale, distinct:int, text_len:int) -> pd.Series:
+    if fieldtype in sqltypes.INT_TYPES:
+        lo, hi = validate.INT_RANGES.get(fieldtype, validate.INT_RANGES['int'])
+        return pd.Series(rng.integers(max(lo, 0), min(hi, 10_000) + 1, size=n), dtype='Int64')
+    if fieldtype in sqltypes.FLOAT_TYPES:
+        top = 10.0 ** (precision - scale) - 1 if pd.notna(precision) and pd.notna(scale) else 1000.0
+        vals = rng.uniform(0, top, size=n)
+        return pd.Series(np.round(vals, int(scale)) if pd.notna(scale) else vals)
+    if fieldtype in sqltypes.DATETIME_TYPES or fieldtype in sqltypes.DATE_TYPES:
+        secs = rng.integers(0, 5 * 365 * 86_400, size=n).astype('timedelta64[s]')
+        vals = pd.Series(np.datetime64('2020-01-01T00:00:00') + secs).astype('datetime64[ns]')
+        return vals.dt.floor('D') if fieldtype in sqltypes.DATE_TYPES else vals
+    length = int(maxlen) if pd.notna(maxlen) else text_len
+    fixed = fieldtype in ('char', 'nchar')
+    pool = _strings(rng, distinct, length if fixed else min(length, text_len), fixed)
+    return pd.Series(pool[rng.integers(0, len(pool), size=n)], dtype=object)
+
+def _unique_column(rng:np.random.Generator, n:int, fieldtype:str, maxlen, precision, scale, text_len:int) -> pd.Series:
+    """`n` distinct random values of one field; raises ValueError when the field's type cannot hold that many"""
+    order = rng.permutation(n)
+    if fieldtype in sqltypes.INT_TYPES:
+        lo, hi = validate.INT_RANGES.get(fieldtype, validate.INT_RANGES['int'])
+        lo = max(lo, 1)
+        if n > hi - lo + 1:
+            raise ValueError(f'A {fieldtype} field cannot hold {n:,} distinct values')
+        return pd.Series(lo + order, dtype='Int64')
+    if fieldtype in sqltypes.DATETIME_TYPES or fieldtype in sqltypes.DATE_TYPES:
+        unit = 'D' if fieldtype in sqltypes.DATE_TYPES else 's'
+        steps = rng.choice(max(n, 5 * 365 * (1 if unit == 'D' else 86_400)), size=n, replace=False)
+        return pd.Series(np.datetime64('2020-01-01T00:00:00') + steps.astype(f'timedelta64[{unit}]')).astype('datetime64[ns]')
+    if fieldtype in sqltypes.FLOAT_TYPES:
+        scale = int(scale) if pd.notna(scale) else 0
+        if pd.notna(precision) and n > 10 ** int(precision):
+            raise ValueError(f'A {fieldtype}({int(precision)},{scale}) field cannot hold {n:,} distinct values')
+        return pd.Series(order / 10 ** scale)
+    length = int(maxlen) if pd.notna(maxlen) else text_len
+    digits = max(1, int(np.ceil(np.log(max(n, 2)) / np.log(62))))
+    if digits > length:
+        raise ValueError(f'A {fieldtype}({length}) field cannot hold {n:,} distinct values')
+    if fieldtype in ('char', 'nchar'):
+        digits = length
+    chars = np.stack([_LETTERS[(order // 62 ** k) % 62] for k in range(digits - 1, -1, -1)], axis=1) # base-62, no spaces
+    return pd.Series(chars.view(f'<U{digits}').ravel().astype(object), dtype=object)
+
+def synthesize(reqs:pd.DataFrame, n:int, seed:int=0, null_rate:float=0.1, distinct:int=1000, text_len:int=40, identity:bool=False, unique:list=()) -> pd.DataFrame:
+    """
+    Make `n` random rows that pass validate.check() against `reqs`
+
+    Values respect each field's type, range, length and nullability: ints fall in their type's range, decimals fit their precision and scale, char(n) values are exactly n characters and varchar(n) values at most n, and only NULLABLE fields get nulls. Text fields draw from `distinct` random values, like the codes and names in real survey data. The same `seed` always makes the same rows.
+
+    Each group of fields in `unique` (e.g. the table's PRIMARY KEY and UNIQUE constraints) gets one field (an int one when it can hold `n` values) with `n` distinct, non-null values, so the group is unique too. Groups holding a left-out IDENTITY field are skipped.
+
+    Args:
+        reqs (pd.DataFrame): The table's requirements, e.g. Target.reqs. Required.
+        n (int): Number of rows. Required.
+        seed (int): Seed for the random number generator. Default 0.
+        null_rate (float): Share of nulls in each NULLABLE field. Default 0.1.
+        distinct (int): Distinct values per text field. Default 1000.
+        text_len (int): Longest value of varchar(max)/text fields, and of any varchar field longer than this. Default 40.
+        identity (bool): Include IDENTITY fields; when False they are left for Target.allocate_keys() to fill. Default False.
+        unique (list): Groups (tuples) of fieldnames whose values together must be unique, e.g. unique_groups(surveys.schema). Default () (none).
+
+    Returns:
+        pd.DataFrame: `n` rows with the fields of `reqs`, in CREATE TABLE order
+
+    Raises:
+        ValueError: no field of a group in `unique` can hold `n` distinct values, e.g. a tinyint key and 1,000 rows
+
+    Examples:
+        import src.synth as synth
+        df = synth.synthesize(surveys.reqs, 100_000, seed=42, unique=synth.unique_groups(surveys.schema))
+    """
+    rng = np.random.default_rng(seed)
+    fields = reqs.set_index('fieldnames', drop=False)
+    keyed = {}
+    for group in unique:
+        group = [c for c in group if c in fields.index]
+        if not group or any(fields.loc[c, 'identity'] and not identity for c in group) or set(keyed) & set(group):
+            continue
+        group.sort(key=lambda c: str(fields.loc[c, 'fieldtypes']).lower() not in sqltypes.INT_TYPES) # ints make the cheapest keys
+        for i, c in enumerate(group):
+            f = fields.loc[c]
+            try:
+                keyed[c] = _unique_column(rng, n, str(f['fieldtypes']).lower(), f['maxlens'], f['precision'], f['scale'], text_len)
+                break
+            except ValueError:
+                if i == len(group) - 1:
+                    raise
+    out = {}
+    for _, f in reqs.iterrows():
+        if f['identity'] and not identity:
+            continue
+        if f['fieldnames'] in keyed:
+            out[f['fieldnames']] = keyed[f['fieldnames']]
+            continue
+        s = _column(rng, n, str(f['fieldtypes']).lower(), f['maxlens'], f['precision'], f['scale'], distinct, text_len)
+        if f['can_be_null'] == 'NULLABLE' and null_rate > 0:
+            s = s.mask(rng.random(n) < null_rate)
+        out[f['fieldnames']] = s
+    return pd.DataFrame(out)
+
+def unique_groups(tableschema) -> list:
+    """
+    The fields of each PRIMARY KEY and UNIQUE constraint of a table, for synthesize()
+
+    Args:
+        tableschema (schema.TableSchema): The table, e.g. Target.schema. Required.
+
+    Returns:
+        list: A tuple of fieldnames per constraint
+    """
+    return [con.columns for con in tableschema.constraints if con.kind in ('PRIMARY KEY', 'UNIQUE')]
+
+def sqlite_ddl(tableschema) -> str:
+    """
+    A SQLite CREATE TABLE statement for a parsed SQL Server table, so a local SQLite db can stand in for it
+
+    Args:
+        tableschema (schema.TableSchema): The table, e.g. Target.schema. Required.
+
+    Returns:
+        str: The CREATE TABLE statement; the table is named without its schema, as db_connect.sa_table() expects on SQLite
+    """
+    def _affinity(fieldtype:str) -> str:
+        if fieldtype in sqltypes.INT_TYPES:
+            return 'INTEGER'
+        if fieldtype in sqltypes.FLOAT_TYPES:
+            return 'REAL'
+        return 'TEXT'
+    cols = [f'"{c.name}" {_affinity(c.fieldtype.lower())}{"" if c.nullable else " NOT NULL"}' for c in tableschema.columns]
+    if tableschema.primary_key:
+        pkey = ', '.join(f'"{c}"' for c in tableschema.primary_key)
+        cols.append(f'PRIMARY KEY ({pkey})')
+    return f'CREATE TABLE "{tableschema.table_name}" ({", ".join(cols)})'
@@ -1,17 +1,37 @@
 
-import re
+import os
+import gzip
+import time
 import pandas as pd
 import numpy as np
+import sqlalchemy as sa
+import src.sqltypes as sqltypes
+import src.keys as keys
+import src.validate as validate
+import src.schema as schemas
+import src.db_connect as db_connect
+import src.refindex as refindex
+import src.integrity as integrity
+import src.transform as transform
+import src.metrics as metrics
+import src.journal as journal
+import src.compact as compact
+import src.upsert as upsert
+
+_NO_XWALK = {'no_columns specified':'use Target.set_col_xwalk()'}
 
 class Target():
 
-    def __init__(self, create_qry:str):
+    def __init__(self, create_qry:str, verbose:bool=False):
         """A Target is a table in the SQL Server db
 
         Each attribute is needed to both a) load records to the db and b) validate that the rows were added.
 
+        `create_qry` is not read until `schema`, `reqs` or `target_tablename` is first needed, so building many Targets is cheap.
+
         Args:
             create_qry (str, required): Relative or absolute filepath to a CREATE TABLE sql query for the `Target` table. Required.
+            verbose (bool): Parse `create_qry` now and print the table name and requirements. Default False.
 
         Examples:
             import src.target as t
@@ -22,28 +42,92 @@ class Target():
         self.insert_qry = 'no query set; use Target.set_insert_qry()'
         self.df = pd.DataFrame()
         self.ref = pd.DataFrame()
-        self.col_xwalk = {'no_columns specified':'use Target.set_col_xwalk()'}
+        self.col_xwalk = _NO_XWALK
+        self.ref_index = None
+        self._schema = None
+        self._reqs = None
+        self._plan = None
         self.attrs = {
             'create_qry':"User-provided; str. Relative or absolute filepath to a .sql file. This is the filepath where your table's CREATE TABLE .sql file lives."
             ,'insert_qry':"User-provided; str. Relative or absolute filepath to a .sql file. This is the filepath to which you will write the insert SQL output for the table."
             ,'df':"User-provided; pd.DataFrame. Short for 'dataframe'. A pd.DataFrame() containing rows of data to be added to a table the SQL Server db"
             ,'ref':"User-provided; pd.DataFrame. Short for 'reference'. A pd.DataFrame() contining rows of data from the table to which you want to add rows SQL Server db"
+            ,'ref_index': "Program generated; refindex.RefIndex. A compact index of the key columns of the table in the SQL Server db (max primary key, distinct key hashes), streamed from the db by Target.index_ref(). A lightweight stand-in for `ref`."
             ,'col_xwalk': "User-provided; dict. Short for column name crosswalk. A dictionary where the keys are columns present in `df` and values are columns present in `ref`."
+            ,'schema': "Program generated; schema.TableSchema. An immutable description of the table's fields (types, lengths, precision/scale, nullability, identity, defaults) and constraints, parsed from `create_qry` on first use."
             ,'target_tablename': "Program generated; str. The name of the SQL Server table to which the `create_qry` corresponds."
             ,'reqs': "Program generated; pd.DataFrame. A dataframe of fieldnames, data types, field constraints that were extracted from the query at `create_qry`."
+            ,'plan': "Program generated; transform.TransformPlan. `col_xwalk` and `reqs` compiled into the renames and column conversions that Target.transform() applies to `df`."
         }
-        if self.create_qry:
-            print(f'Create query set to {self.create_qry}')
-            self._set_target_tablename()
-            print(f'\nTarget tablename updated to match {self.create_qry}:')
-            print(self.get_target_tablename())
-            self._set_reqs()
-            print(f'\nRequirements parsed from {self.create_qry}:')
-            print(self.get_reqs())
-        else:
-            self.reqs = pd.DataFrame()
-            self.target_tablename = 'no target tablename; use Target.set_insert_qry()'
-    
+        if self.create_qry and verbose:
+            self._describe('parsed from')
+
+    def _describe(self, verb:str):
+        print(f'Create query set to {self.create_qry}')
+        print(f'\nTarget tablename updated to match {self.create_qry}:')
+        print(self.get_target_tablename())
+        print(f'\nRequirements {verb} {self.create_qry}:')
+        print(self.get_reqs())
+
+    @property
+    def schema(self) -> schemas.TableSchema:
+        """The parsed `create_qry`; parsed on first access. None when there is no `create_qry`."""
+        if self._schema is None and self.create_qry:
+            with metrics.stage('parse', create_qry=self.create_qry):
+                self._schema = schemas.read_create_table(self.create_qry)
+        return self._schema
+
+    def get_schema(self) -> schemas.TableSchema:
+        """
+        Get the value stored as `schema` attribute of a Target
+
+        Returns:
+            schema.TableSchema: the parsed `create_qry`
+
+        Examples:
+            import src.target as t
+            surveys = t.Target('src/qry/create_SurveyEvent.sql')
+            surveys.get_schema().foreign_keys
+        """
+        return self.schema
+
+    def set_schema(self, tableschema:schemas.TableSchema):
+        """
+        Set the `schema` attribute of a Target so that `create_qry` does not have to be read and parsed
+
+        Use-case: the schema was already parsed elsewhere, e.g. by a catalog.Catalog.
+
+        Args:
+            tableschema (schema.TableSchema): the parsed `create_qry`
+
+        Examples:
+            import src.catalog as c
+            surveys = t.Target('src/qry/create_SurveyEvent.sql')
+            surveys.set_schema(c.Catalog('src/qry').get_schema('SurveyEvent'))
+        """
+        self._schema = tableschema
+        self._reqs = None
+        self._plan = None
+
+    @property
+    def target_tablename(self) -> str:
+        if not self.create_qry:
+            return 'no target tablename; use Target.set_create_qry()'
+        return self.schema.tablename
+
+    @property
+    def reqs(self) -> pd.DataFrame:
+        if self._reqs is None:
+            self._reqs = self.schema.to_reqs() if self.create_qry else pd.DataFrame()
+        return self._reqs
+
+    @property
+    def plan(self) -> transform.TransformPlan:
+        """`col_xwalk` and `reqs` compiled into a transform.TransformPlan; compiled on first access"""
+        if self._plan is None:
+            self._plan = transform.compile_plan({} if self.col_xwalk is _NO_XWALK else self.col_xwalk, self.reqs)
+        return self._plan
+
     def show(self):
         """
         Print a description of what each attribute in a `Target` object is
@@ -73,6 +157,7 @@ class Target():
             surveys.set_col_xwalk(xwalk=survey_events)
         """
         self.col_xwalk = xwalk
+        self._plan = None
 
     
     def get_target_tablename(self):
@@ -90,33 +175,6 @@ class Target():
 
         return self.target_tablename
 
-    def _set_target_tablename(self):
-        """
-        Read SQL file, break into lines, clean the lines, parse the lines to determine table name from CREATE TABLE.
-        
-        Not intended to be called directly; executes automatically when user calls set_create_qry().
-
-        Args:
-            self (src.target.Target): An object of type Target. Required.
-
-        Examples:
-            import src.target as t
-            mytarget = t.Target('src/qry/create_a_table.sql')
-            # reads the sql file and assigns the `tablename`
-        """
-
-        fname = self.create_qry
-        f = open(fname, "r")
-        # f = open(r'src\qry\create_SpeciesInfo.sql', "r")
-        lines:str = f.read()
-        f.close()
-
-        s2 = lines.replace('\n',' ').replace('\t',' ')
-        tablename = re.search('CREATE TABLE(?:(?!CONSTRAINT).)*', s2)
-        tablename = tablename.group(0).split('(',1)[0].replace('CREATE TABLE','').strip()
-
-        self.target_tablename = tablename
-
     def get_df(self):
         """
         Get the value stored as `df` attribute of a Target
@@ -149,18 +207,79 @@ class Target():
 
         self.df = df
 
-    def check_df(self) -> str:
+    def transform(self, df:pd.DataFrame=None) -> pd.DataFrame:
+        """
+        Rename the columns of a source dataframe with `col_xwalk`, put them in CREATE TABLE order and convert their values to what `reqs` expects, then store the result as `df`
+
+        The conversions (ints, decimals, SQL Server datetime strings, trimmed and padded char(n) text) run a whole column at a time; see transform.TransformPlan.apply(). The plan is compiled once and reused until `col_xwalk` or `create_qry` changes, so transforming many dataframes for the same table costs no re-planning.
+
+        Args:
+            df (pd.DataFrame): Source rows. Default None (transform the current `df`).
+
+        Returns:
+            pd.DataFrame: The transformed rows, also stored as `df`
+
+        Examples:
+            import src.target as t
+            surveys = t.Target('src/qry/create_SurveyEvent.sql')
+            surveys.set_col_xwalk({'visit_date':'SDate', 'location_id':'SiteRecID'})
+            surveys.transform(raw_survey_events)
+            surveys.check_df()
+        """
+        with metrics.stage('transform', rows=len(self.df if df is None else df), table=self.target_tablename):
+            self.df = self.plan.apply(self.df if df is None else df)
+        return self.df
+
+    def check_df(self) -> pd.DataFrame:
         """
         Checks a `Target` object's `df` attribute against rules specified in its `reqs` attribute
 
-        Returns
+        Every rule runs over a whole column at once: NOT NULL fields, `maxlens` of char/varchar fields, whether int/decimal/datetime fields can be converted to their type, and whether the columns of `df` are present and in the same order as `reqs`. See validate.check() for the list of rules.
+
+        Returns:
+            pd.DataFrame: One row per violation with columns 'row' (the `df` index label), 'column', 'rule'. Empty when `df` passes.
+
+        Examples:
+            import src.target as t
+            surveys = t.Target('src/qry/create_SurveyEvent.sql')
+            surveys.set_df(df=survey_events)
+            report = surveys.check_df()
+            report.groupby(['column', 'rule']).size() # violations per rule
+            report['row'].unique() # rows to fix or drop
         """
+        with metrics.stage('validate', rows=len(self.df), table=self.target_tablename):
+            report = validate.check(self.df, self.reqs)
+        if len(report) == 0:
+            print('PASS: Self.df passed validation')
+        else:
+            print(f"FAIL: Self.df failed validation; {len(report):,} violations in {report['row'].nunique():,} rows")
+        return report
 
-        outcome = 'FAIL: Self.df failed validation'
+    def check_fks(self, con:sa.Engine) -> dict:
+        """
+        Find the rows of `df` whose FOREIGN KEY values are not in the related table(s) in the db, before they fail an INSERT
+
+        The parent keys (e.g. SiteConstants.SiteRecID, Project.ProjectCode, LocalObserver.ObsName) are read once per run and shared by every Target; see integrity.find_orphans().
 
-        return outcome
+        Args:
+            con (sa.Engine): A sqlalchemy engine for the db. Required.
 
+        Returns:
+            dict: {<FOREIGN KEY name>: <pd.DataFrame of the orphan rows of `df`>}
 
+        Examples:
+            import src.target as t
+            surveys = t.Target('src/qry/create_SurveyEvent.sql')
+            surveys.set_df(df=survey_events)
+            orphans = surveys.check_fks(con)
+            orphans['FK_SurveyEvent_SiteConstants']
+        """
+        with metrics.stage('check_fks', rows=len(self.df), table=self.target_tablename):
+            orphans = integrity.find_orphans(con, self.df, self.schema)
+        for k, v in orphans.items():
+            if len(v):
+                print(f'FAIL: {len(v):,} rows of Self.df break {k}')
+        return orphans
 
     def get_ref(self):
 
@@ -169,7 +288,72 @@ class Target():
     def set_ref(self, ref:pd.DataFrame):
 
         self.ref = ref
-    
+
+    def index_ref(self, con:sa.Engine, key_cols:list=None, chunksize:int=100_000) -> refindex.RefIndex:
+        """
+        Index `target_tablename` in the db by streaming only its key columns, instead of reading the whole table into `ref`
+
+        The index keeps the maximum of the (integer) primary key and IDENTITY columns and the distinct 64-bit hashes of each key (see refindex.RefIndex), so memory grows with the number of distinct keys, not with the width of the table. The result is stored as `ref_index`.
+
+        Args:
+            con (sa.Engine): A sqlalchemy engine for the db. Required.
+            key_cols (list): Keys to index; each is a column name or a tuple of column names. Defaults to the primary key (or else the IDENTITY column) and each UNIQUE constraint in `create_qry`. Default None.
+            chunksize (int): Rows fetched per round trip. Default 100_000.
+
+        Returns:
+            refindex.RefIndex: The index
+
+        Examples:
+            import src.target as t
+            surveys = t.Target('src/qry/create_SurveyEvent.sql')
+            idx = surveys.index_ref(con, key_cols=['SurveyRecID', ('SiteRecID', 'SDate', 'TBegin', 'SMID')])
+            idx.max['SurveyRecID']
+            idx.contains(surveys.get_df(), ('SiteRecID', 'SDate', 'TBegin', 'SMID')) # rows already in the db
+        """
+        fieldtypes = self._fieldtypes()
+        pkey = self.schema.primary_key or self.schema.identity # a table may have an IDENTITY column and no PRIMARY KEY constraint
+        if key_cols is None:
+            key_cols = ([pkey] if pkey else []) + [c.columns for c in self.schema.constraints if c.kind == 'UNIQUE']
+        max_cols = [c for c in dict.fromkeys(self.schema.identity + pkey) if fieldtypes.get(c) in sqltypes.INT_TYPES]
+        with metrics.stage('read_ref', table=self.target_tablename) as st:
+            self.ref_index = refindex.stream_index(con, self._sa_table(con), fieldtypes, key_cols, max_cols, chunksize)
+            st.rows = self.ref_index.rows
+        return self.ref_index
+
+    def compact(self, which:str='both', category_ratio:float=0.5) -> dict:
+        """
+        Store `df` and/or `ref` with the smallest dtypes their `reqs` types allow, to hold large tables in less memory
+
+        Low-cardinality char/varchar codes (e.g. PIID, DetEstID, ObsDetTypeID, Checked, UserID) become categories, int fields become int8/16/32/64 (nullable Int8/16/32/64 instead of float64 when they have NULLs), decimals become float64 and dates datetime64; see compact.compact_column(). Values are unchanged, so check_df(), the insert SQL and load() give the same results. Compact `df` after transform(), which writes text columns back as plain strings.
+
+        Args:
+            which (str): 'df', 'ref' or 'both'. Default 'both'.
+            category_ratio (float): Largest share of distinct values for a text column to become a category. Default 0.5.
+
+        Returns:
+            dict: {<'df' or 'ref'>: <pd.DataFrame from compact.memory_report()>}
+
+        Examples:
+            import src.target as t
+            surveys = t.Target('src/qry/create_SurveyEvent.sql')
+            surveys.set_ref(ref_surveys)
+            report = surveys.compact('ref')
+            report['ref'].loc['TOTAL']
+        """
+        assert which in ('df', 'ref', 'both'), print(f"`which` must be 'df', 'ref' or 'both'. You provided {which}")
+        fieldtypes = self._fieldtypes()
+        reports = {}
+        for attr in (['df', 'ref'] if which == 'both' else [which]):
+            before = getattr(self, attr)
+            if len(before.columns) == 0:
+                continue
+            after = compact.compact(before, fieldtypes, category_ratio)
+            setattr(self, attr, after)
+            reports[attr] = compact.memory_report(before, after)
+            total = reports[attr].loc['TOTAL']
+            print(f"Self.{attr}: {total['mb_before']:,.1f} MB -> {total['mb_after']:,.1f} MB")
+        return reports
+
     def get_insert_qry(self):
         """
         Get the value stored as `insert_qry` attribute of a Target
@@ -198,111 +382,531 @@ class Target():
         """
         assert insert_qry.endswith('.sql'), print('`insert_qry` must end in ".sql". You provided {insert_qry}')
         self.insert_qry = insert_qry
-    
-    def get_reqs(self):
+
+    def _fieldtypes(self) -> dict:
         """
-        Get the value stored as `reqs` attribute of a Target
+        A dictionary of {<fieldname>:<SQL Server data type>} parsed from `create_qry`
+        """
+        if not self.create_qry:
+            return {}
+        return {c.name:sqltypes.fieldtype_of(c) for c in self.schema.columns}
+
+    def _identity_cols(self) -> list:
+        """
+        The fieldnames declared IDENTITY in `create_qry`
+        """
+        if not self.create_qry:
+            return []
+        return list(self.schema.identity)
+
+    def _resolve_pkey(self, pkey:str=None) -> str:
+        """
+        `pkey`, or else the IDENTITY column, or else the one-column primary key, in `create_qry`
+        """
+        if pkey is None:
+            candidates = self._identity_cols() or list(self.schema.primary_key)
+            assert len(candidates) == 1, print(f'{self.create_qry} has no single-column IDENTITY or primary key; provide `pkey`')
+            pkey = candidates[0]
+        return pkey
+
+    def _executemany(self, con:sa.Engine, qry:str, df:pd.DataFrame, fieldtypes:dict, batch_size:int, commit_rows:int, fast_executemany:bool=True, start_row:int=0, on_commit=None, identity_insert:bool=False) -> int:
+        """
+        Run the parameterized `qry` for the rows of `df` from `start_row` on, `batch_size` rows per executemany() call, committing every `commit_rows` rows
+
+        Every column of `df` is bound, in order. `on_commit(start, end)` is called after each commit. A failed batch rolls back the uncommitted rows; `SET IDENTITY_INSERT` is switched off again (or the connection discarded) and the query cache for `target_tablename` is cleared either way.
 
         Returns:
-            pd.DataFrame: a dataframe of fieldnames and their specifications for the Target table
+            int: The number of executemany() calls
+        """
+        tablename = con.dialect.identifier_preparer.format_table(self._sa_table(con))
+        batches = 0
+        raw = con.raw_connection()
+        cursor = None
+        try:
+            cursor = raw.cursor()
+            if fast_executemany and hasattr(cursor, 'fast_executemany'):
+                cursor.fast_executemany = True
+            if identity_insert:
+                cursor.execute(f'SET IDENTITY_INSERT {tablename} ON')
+            for c in range(start_row, len(df), commit_rows):
+                end = min(c + commit_rows, len(df))
+                for i in range(c, end, batch_size):
+                    cursor.executemany(qry, sqltypes.to_params(df.iloc[i:min(i + batch_size, end)], fieldtypes))
+                    batches += 1
+                raw.commit()
+                if on_commit is not None:
+                    on_commit(c, end)
+            raw.commit()
+        except:
+            raw.rollback()
+            raise
+        finally:
+            try:
+                if identity_insert and cursor is not None:
+                    cursor.execute(f'SET IDENTITY_INSERT {tablename} OFF')
+                if cursor is not None:
+                    cursor.close()
+            except Exception:
+                raw.invalidate() # never hand the pool a connection with IDENTITY_INSERT still ON
+            raw.close()
+            db_connect.invalidate(self.target_tablename) # cached query results for this table are stale now
+        return batches
+
+    def _iter_insert_batches(self, batch_size:int=1000, chunk_batches:int=50):
+        """
+        Generate one multi-row INSERT statement per `batch_size` rows of `df`
+
+        Not intended to be called directly; see iter_insert_sql().
+
+        `df` is translated to SQL literals `batch_size * chunk_batches` rows at a time so that the whole script never has to sit in memory.
+
+        Args:
+            batch_size (int): Number of rows per INSERT statement. SQL Server allows at most 1000. Default 1000.
+            chunk_batches (int): Number of INSERT statements to build from each vectorized chunk of `df`. Default 50.
+        """
+        assert 1 <= batch_size <= 1000, print(f'`batch_size` must be between 1 and 1000 (the SQL Server limit). You provided {batch_size}')
+        if len(self.df) == 0 or len(self.df.columns) == 0:
+            return
+        fieldtypes = self._fieldtypes()
+        head = f"INSERT INTO {self.target_tablename} ({', '.join(f'[{c}]' for c in self.df.columns)}) VALUES\n"
+        chunk_rows = batch_size * chunk_batches
+        for start in range(0, len(self.df), chunk_rows):
+            chunk = self.df.iloc[start:start+chunk_rows]
+            with metrics.stage('generate_sql', rows=len(chunk), table=self.target_tablename): # closed before yielding, so the consumer's time is not counted
+                rows = sqltypes.to_rows(chunk, fieldtypes)
+            for i in range(0, len(rows), batch_size):
+                yield head + ',\n'.join(rows[i:i+batch_size])
+
+    def iter_insert_sql(self, batch_size:int=1000, identity_insert:bool=None):
+        """
+        Generate the SQL statements that INSERT every row of `df` into `target_tablename`
+
+        Each column is translated to SQL literals in one vectorized pass according to its data type in `reqs`, and rows are grouped into multi-row `VALUES` batches.
+
+        Args:
+            batch_size (int): Number of rows per INSERT statement. SQL Server allows at most 1000. Default 1000.
+            identity_insert (bool): Wrap the INSERTs in `SET IDENTITY_INSERT <table> ON/OFF`. When None, the wrapper is added only if `df` holds values for an IDENTITY column. Default None.
+
+        Yields:
+            str: One SQL statement
 
         Examples:
             import src.target as t
-            surveys = t.Target(r'src\qry\create_SurveyEvent.sql')
-            surveys.get_reqs()
+            surveys = t.Target('src/qry/create_SurveyEvent.sql')
+            surveys.set_df(df=survey_events)
+            for stmt in surveys.iter_insert_sql(batch_size=500):
+                print(stmt)
         """
-        return self.reqs
+        if identity_insert is None:
+            identity_insert = any(c in self.df.columns for c in self._identity_cols())
+        if identity_insert:
+            yield f'SET IDENTITY_INSERT {self.target_tablename} ON'
+        yield from self._iter_insert_batches(batch_size)
+        if identity_insert:
+            yield f'SET IDENTITY_INSERT {self.target_tablename} OFF'
+
+    def make_insert_sql(self, batch_size:int=1000, identity_insert:bool=None) -> str:
+        """
+        Make one SQL script that INSERTs every row of `df` into `target_tablename`
+
+        See iter_insert_sql() for arguments.
+
+        Returns:
+            str: SQL statements separated by newlines
+
+        Examples:
+            import src.target as t
+            surveys = t.Target('src/qry/create_SurveyEvent.sql')
+            surveys.set_df(df=survey_events)
+            sqltext = surveys.make_insert_sql()
+        """
+        return '\n'.join(self.iter_insert_sql(batch_size=batch_size, identity_insert=identity_insert))
 
-    def _set_reqs(self):
+    def write_insert_qry(self, batch_size:int=1000, identity_insert:bool=None, compress:bool=False, statements_per_file:int=None) -> list:
         """
-        Read SQL file, break into lines, clean the lines, parse the lines to determine fieldnames, data types, field constraints.
-        
-        Not intended to be called directly; executes automatically when user calls set_create_qry().
+        Stream the INSERT statements for `df` to the file at `insert_qry`
+
+        Statements are written as they are generated, so memory use stays flat no matter how many rows are in `df`.
 
         Args:
-            self (src.target.Target): An object of type Target. Required.
+            batch_size (int): Number of rows per INSERT statement. SQL Server allows at most 1000. Default 1000.
+            identity_insert (bool): See iter_insert_sql(). Default None.
+            compress (bool): gzip the output and append '.gz' to the filename(s). Default False.
+            statements_per_file (int): Start a new file every `statements_per_file` INSERT statements, named like 'insert_SurveyEvent_001.sql'. Each file gets its own SET IDENTITY_INSERT ON/OFF so it can be run on its own. When None, everything goes to one file. Default None.
+
+        Returns:
+            list: The filepaths that were written
 
         Examples:
             import src.target as t
-            mytarget = t.Target('src/qry/create_a_table.sql')
-            mytarget.set_create_qry('src/qry/create_another_table.sql)
+            surveys = t.Target('src/qry/create_SurveyEvent.sql')
+            surveys.set_df(df=survey_events)
+            surveys.set_insert_qry('src/qry/insert_SurveyEvent.sql')
+            surveys.write_insert_qry(compress=True, statements_per_file=500)
         """
-        assert self.create_qry is not None
-
-        f = open(self.create_qry, "r")
-        lines:str = f.read()
-        f.close()
-        
-        s2 = lines.replace('\n',' ').replace('\t',' ')
-        fieldstr = re.search('CREATE TABLE(?:(?!CONSTRAINT).)*', s2)
-        fieldstr = fieldstr.group(0).replace('CREATE TABLE','').strip().split('(',1)[1].strip()
-        fieldlist = fieldstr.split(', ')
-        fieldlist = [x.strip() for x in fieldlist]
-
-        constraints = {
-            'original':[]
-            ,'fieldnames':[]
-            ,'fieldtypes':[]
-            ,'maxlens':[]
-            ,'can_be_null':[]
-        }
+        assert self.insert_qry.endswith('.sql'), print(f'Set `insert_qry` before writing to it; use Target.set_insert_qry(). Current value: {self.insert_qry}')
+        assert statements_per_file is None or statements_per_file >= 1, print(f'`statements_per_file` must be at least 1. You provided {statements_per_file}')
+        if identity_insert is None:
+            identity_insert = any(c in self.df.columns for c in self._identity_cols())
+        preamble = [f'SET IDENTITY_INSERT {self.target_tablename} ON'] if identity_insert else []
+        postamble = [f'SET IDENTITY_INSERT {self.target_tablename} OFF'] if identity_insert else []
+
+        def _open(n:int):
+            fname = self.insert_qry
+            if statements_per_file is not None:
+                fname = f'{os.path.splitext(fname)[0]}_{n:03d}.sql'
+            if compress:
+                fname = fname + '.gz'
+                f = gzip.open(fname, 'wt', compresslevel=6)
+            else:
+                f = open(fname, 'w')
+            for line in preamble:
+                f.write(line + '\n')
+            return fname, f
+
+        fnames = []
+        f = None
+        try:
+            fname, f = _open(1)
+            fnames.append(fname)
+            written = 0
+            for stmt in self._iter_insert_batches(batch_size):
+                if statements_per_file is not None and written == statements_per_file:
+                    for line in postamble:
+                        f.write(line + '\n')
+                    f.close()
+                    fname, f = _open(len(fnames) + 1)
+                    fnames.append(fname)
+                    written = 0
+                f.write(stmt + '\n')
+                written += 1
+            for line in postamble:
+                f.write(line + '\n')
+        finally:
+            if f is not None:
+                f.close()
+        for fname in fnames:
+            print(f"Wrote SQL to '{fname}'")
+        return fnames
+
+    def _sa_table(self, con:sa.Engine, columns:list=()) -> sa.TableClause:
+        """
+        A lightweight sqlalchemy table for `target_tablename` on `con`; see db_connect.sa_table()
+        """
+        return db_connect.sa_table(con, self.target_tablename, columns)
 
-        for field in fieldlist:
-            constraints['original'].append(field)
-            pat = r"\[(.*?)\]"
-            found = re.findall(pat,field)
-            if len(found) == 2:
-                fieldname = found[0]
-                fieldtype = found[1]
-                if fieldname:
-                    constraints['fieldnames'].append(fieldname)
-                else:
-                    constraints['fieldnames'].append(None)
-                if fieldtype:
-                    constraints['fieldtypes'].append(fieldtype)
-                else:
-                    constraints['fieldtypes'].append(None)
-                # print(f'Found: {fieldname=} of type {fieldtype=}')
-                if fieldtype == 'char':
-                    pat = r"\((.*?)\)"
-                    maxlen = int(re.search(pat, field).group(1))
-                    constraints['maxlens'].append(maxlen)
-                else:
-                    constraints['maxlens'].append(np.nan)
-                    # print(f'Found {fieldname} of {fieldtype} len {maxlen=}')
-                if 'not null' in field.lower():
-                    constraints['can_be_null'].append('NOT NULL')
-                else:
-                    constraints['can_be_null'].append('NULLABLE')
+    def allocate_keys(self, con:sa.Engine, pkey:str=None) -> tuple:
+        """
+        Assign new primary keys to every row of `df` without reading `target_tablename` into memory
+
+        Asks the db for `MAX(pkey)` and reserves a range of keys past it (see keys.reserve_keys() for what stops another loader from being handed the same range), then fills `df[pkey]` with the range in one vectorized assignment.
+
+        Args:
+            con (sa.Engine): A sqlalchemy engine for the db. Required.
+            pkey (str): The name of the primary key field. Defaults to the IDENTITY column in `create_qry`. Default None.
 
+        Returns:
+            tuple: (<first key>, <last key>) assigned to `df`
+
+        Examples:
+            import src.target as t
+            surveys = t.Target('src/qry/create_SurveyEvent.sql')
+            surveys.set_df(df=survey_events)
+            surveys.allocate_keys(con)
+        """
+        identity_cols = self._identity_cols()
+        if pkey is None:
+            assert len(identity_cols) > 0, print(f'{self.create_qry} has no IDENTITY column; provide `pkey`')
+            pkey = identity_cols[0]
+        n = len(self.df)
+        with metrics.stage('allocate_keys', rows=n, table=self.target_tablename):
+            first = keys.reserve_keys(con, self._sa_table(con), pkey, n, identity=pkey in identity_cols)
+            newkeys = np.arange(first, first + n, dtype='int64')
+            if pkey in self.df.columns:
+                self.df[pkey] = newkeys
             else:
-                print(f'WARNING: line {field} in {self.create_sql} did not include fieldname and/or fieldtype')
+                self.df.insert(0, pkey, newkeys)
+        return first, first + n - 1
 
-        constraints = pd.DataFrame(constraints)
-        self.reqs = constraints
+    def load(self, con:sa.Engine, batch_size:int=1000, commit_every:int=10, fast_executemany:bool=True, journal_path:str=None, pkey:str=None) -> dict:
+        """
+        INSERT every row of `df` into `target_tablename` with one parameterized statement that is prepared once and reused for every batch
 
-        return self
-    
-    def set_create_qry(self, create_qry:str):
+        Rows are translated to driver values column-by-column (see sqltypes.to_params()). On SQL Server, `SET IDENTITY_INSERT` is switched on for the load when `df` carries the IDENTITY column.
+
+        With `journal_path`, the load is resumable: the row count and checksum of `df` and the key range and checksum of every committed batch are written to a local journal (see journal.LoadJournal). A journal of another table or other rows raises ValueError, even when that load finished. Running the same load again with the same journal puts back the keys the first attempt used, skips the committed batches, reads back any batch that was committed but not journaled to check it holds this load's rows, and carries on from the first uncommitted batch. A crash costs at most one batch (`batch_size * commit_every` rows) of redo.
+
+        Args:
+            con (sa.Engine): A sqlalchemy engine for the db. A SQLite engine works for local testing. Required.
+            batch_size (int): Number of rows per executemany() call. Default 1000.
+            commit_every (int): Commit after this many batches. When resuming from a journal, the journal's batch size is kept. Default 10.
+            fast_executemany (bool): Turn on the driver's bulk parameter binding when it has one (pyodbc's `fast_executemany`). Default True.
+            journal_path (str): Relative or absolute filepath of the load's journal, e.g. 'src/qry/load_SurveyEvent.journal'. Requires the keys from allocate_keys() in `df`. Default None (no journal).
+            pkey (str): The primary key field the journal tracks batches by. Defaults to the IDENTITY column, or else the one-column primary key, in `create_qry`. Default None.
+
+        Returns:
+            dict: {'rows':<rows loaded>, 'batches':<executemany calls>, 'seconds':<wall time>, 'rows_per_sec':<throughput>, 'resumed_from':<first row loaded>}
+
+        Examples:
+            import sqlalchemy as sa
+            import src.target as t
+            surveys = t.Target('src/qry/create_SurveyEvent.sql')
+            surveys.set_df(df=survey_events)
+            surveys.load(sa.create_engine(assets.SACXN_STR), batch_size=5000, commit_every=4)
+            surveys.load(con, journal_path='src/qry/load_SurveyEvent.journal') # re-run the same line after a failure to resume
+        """
+        assert batch_size >= 1, print(f'`batch_size` must be at least 1. You provided {batch_size}')
+        assert commit_every >= 1, print(f'`commit_every` must be at least 1. You provided {commit_every}')
+        start = time.perf_counter()
+        table = self._sa_table(con)
+        prep = con.dialect.identifier_preparer
+        tablename = prep.format_table(table)
+        placeholder = '%s' if con.dialect.paramstyle in ('format', 'pyformat') else '?'
+        qry = f"INSERT INTO {tablename} ({', '.join(prep.quote(c) for c in self.df.columns)}) VALUES ({', '.join([placeholder]*len(self.df.columns))})"
+        identity_insert = con.dialect.name == 'mssql' and any(c in self.df.columns for c in self._identity_cols())
+        fieldtypes = self._fieldtypes()
+
+        commit_rows = batch_size * commit_every
+        start_row = 0
+        jr = None
+        if journal_path is not None:
+            jr = journal.LoadJournal(journal_path, table, self._resolve_pkey(pkey))
+            start_row = jr.begin(self.df, commit_rows) # raises when the journal is of another table or other rows
+            if jr.done:
+                print(f'{journal_path} shows this load already finished; nothing to do')
+                return {'rows':0, 'batches':0, 'seconds':0.0, 'rows_per_sec':float('nan'), 'resumed_from':len(self.df)}
+            commit_rows = jr.commit_rows()
+            start_row = jr.recover(con, self.df, start_row, fieldtypes)
+            if start_row > 0:
+                print(f'Resuming from row {start_row:,}; {start_row:,} rows were already committed')
+
+        on_commit = (lambda c, end: jr.committed(self.df, c, end)) if jr is not None else None
+        with metrics.stage('load', rows=len(self.df) - start_row, table=self.target_tablename):
+            batches = self._executemany(con, qry, self.df, fieldtypes, batch_size, commit_rows, fast_executemany, start_row, on_commit, identity_insert)
+        integrity.note_loaded(con, self.target_tablename, self.df) # children checked later in the run can reference these rows
+
+        secs = time.perf_counter() - start
+        stats = {
+            'rows':len(self.df) - start_row
+            ,'batches':batches
+            ,'seconds':secs
+            ,'rows_per_sec':(len(self.df) - start_row) / secs if secs > 0 else float('nan')
+            ,'resumed_from':start_row
+        }
+        if jr is not None:
+            jr.finish(stats['rows'], secs)
+        print(f"Loaded {stats['rows']:,} rows into {tablename} in {secs:.2f}s ({stats['rows_per_sec']:,.0f} rows/sec)")
+        return stats
+
+    def upsert(self, con:sa.Engine, natural_key:list, pkey:str=None, compare_cols:list=None, batch_size:int=1000, commit_every:int=10, fast_executemany:bool=True, merge_script:str=None, chunksize:int=100_000) -> dict:
+        """
+        Load `df` into `target_tablename` without duplicating rows that are already there: INSERT the rows whose natural key is new, UPDATE the ones whose values changed and skip the rest
+
+        The rows are matched to the table by hashes of their natural key and values, reading back only `pkey`, the natural key, `compare_cols` and audit columns of the table's rows in the key's range (see upsert.split()). Re-running an unchanged load costs one such read and writes nothing. New rows get keys from allocate_keys() (when `pkey` is an int) and go through load(); changed rows are updated by `pkey`. Afterwards `df` holds every row that was not a duplicate as it is in the table: with its key, and for unchanged rows with the table's audit column values.
+
+        The natural key may not hold nulls (ValueError), since SQL never matches them. With `merge_script`, nothing is written to the db; the new and changed rows are written to `merge_script` as SQL Server MERGE statements (see upsert.iter_merge_sql()) to run later. IDENTITY values of new rows are then left to the db.
+
+        Args:
+            con (sa.Engine): A sqlalchemy engine for the db. A SQLite engine works for local testing. Required.
+            natural_key (list): The columns that identify a row, e.g. ['SiteRecID', 'SDate', 'TBegin', 'SMID']. Required.
+            pkey (str): The primary key field. Defaults to the IDENTITY column, or else the one-column primary key, in `create_qry`. Default None.
+            compare_cols (list): The columns that decide whether a matched row changed. Changed rows get these and the audit columns (see upsert.audit_columns(), e.g. EditDate, UserID) of `df` updated. Default None (every column of `df` except the natural key, `pkey`, IDENTITY columns and audit columns).
+            batch_size (int): Number of rows per executemany() call or MERGE statement. Default 1000.
+            commit_every (int): Commit after this many batches. Default 10.
+            fast_executemany (bool): Turn on the driver's bulk parameter binding when it has one (pyodbc's `fast_executemany`). Default True.
+            merge_script (str): Relative or absolute filepath of a .sql file to write MERGE statements to instead of writing to the db. Default None.
+            chunksize (int): Rows fetched per round trip. Default 100_000.
+
+        Returns:
+            dict: {'new', 'changed', 'unchanged', 'duplicates' (rows of `df`), 'db_duplicates' (rows of the table sharing a natural key), 'inserted', 'updated', 'seconds', 'merge_script'}
+
+        Examples:
+            import src.target as t
+            surveys = t.Target('src/qry/create_SurveyEvent.sql')
+            surveys.set_df(df=survey_events)
+            surveys.upsert(con, natural_key=['SiteRecID', 'SDate', 'TBegin', 'SMID'])
+            surveys.upsert(con, natural_key=['SiteRecID', 'SDate', 'TBegin', 'SMID'], merge_script='src/qry/merge_SurveyEvent.sql')
+        """
+        start = time.perf_counter()
+        natural_key = [natural_key] if isinstance(natural_key, str) else list(natural_key)
+        assert all(c in self.df.columns for c in natural_key), print(f'Every column of `natural_key` must be in Self.df. You provided {natural_key}')
+        assert merge_script is None or merge_script.endswith('.sql'), print(f'`merge_script` must end in ".sql". You provided {merge_script}')
+        identity_cols = self._identity_cols()
+        pkey = self._resolve_pkey(pkey)
+        fieldtypes = self._fieldtypes()
+        assert fieldtypes.get(pkey) in sqltypes.INT_TYPES or pkey in self.df.columns, print(f'`{pkey}` is not an int, so its values must be in Self.df')
+        audit_cols = upsert.audit_columns(self.schema)
+        if compare_cols is None:
+            compare_cols = [c for c in self.df.columns if c in fieldtypes and c not in natural_key and c != pkey and c not in identity_cols and c not in audit_cols]
+        update_cols = compare_cols + [c for c in self.df.columns if c in audit_cols and c not in compare_cols and c not in natural_key and c != pkey]
+        carry_cols = [c for c in update_cols if c not in compare_cols]
+        table = self._sa_table(con, list(dict.fromkeys([pkey] + natural_key + compare_cols + carry_cols)))
+
+        with metrics.stage('upsert_diff', rows=len(self.df), table=self.target_tablename):
+            parts = upsert.split(con, table, self.df, fieldtypes, natural_key, pkey, compare_cols, chunksize, carry_cols)
+        df = self.df[~parts['duplicate']].copy()
+        unchanged = parts['unchanged'][~parts['duplicate']]
+        if carry_cols and unchanged.any(): # unchanged rows are not written, so they keep the table's audit values
+            df[carry_cols] = df[carry_cols].astype(object)
+            df.loc[unchanged, carry_cols] = parts['db_values'][~parts['duplicate']][unchanged].to_numpy()
+        pkeys = parts['pkeys'][~parts['duplicate']]
+        if fieldtypes.get(pkey) in sqltypes.INT_TYPES:
+            pkeys = pd.to_numeric(pkeys).astype('Int64')
+        if pkey in df.columns:
+            df[pkey] = pkeys.where(pkeys.notna(), df[pkey])
+        else:
+            df.insert(0, pkey, pkeys)
+        new = parts['new'][~parts['duplicate']]
+        changed = parts['changed'][~parts['duplicate']]
+        stats = {
+            'new':int(new.sum())
+            ,'changed':int(changed.sum())
+            ,'unchanged':int(parts['unchanged'].sum())
+            ,'duplicates':int(parts['duplicate'].sum())
+            ,'db_duplicates':parts['db_duplicates']
+            ,'inserted':0
+            ,'updated':0
+            ,'seconds':0.0
+            ,'merge_script':merge_script
+        }
+        if stats['duplicates']:
+            print(f"{stats['duplicates']:,} rows of Self.df repeat a natural key of a later row and were skipped")
+        if stats['db_duplicates']:
+            print(f"FAIL: {stats['db_duplicates']:,} rows of {self.target_tablename} repeat a natural key; the rows with the lowest {pkey} were matched")
+
+        allocate = stats['new'] > 0 and fieldtypes.get(pkey) in sqltypes.INT_TYPES and not (merge_script is not None and pkey in identity_cols)
+        if allocate:
+            self.df = df[new].copy()
+            self.allocate_keys(con, pkey=pkey)
+            df.loc[new, pkey] = self.df[pkey].to_numpy()
+
+        if merge_script is not None:
+            insert_cols = [c for c in df.columns if c in fieldtypes and (c not in identity_cols or allocate)]
+            with metrics.stage('generate_sql', rows=stats['new'] + stats['changed'], table=self.target_tablename):
+                with open(merge_script, 'w') as f:
+                    for stmt in upsert.iter_merge_sql(self.target_tablename, df[new | changed], fieldtypes, natural_key, compare_cols, update_cols, insert_cols, batch_size):
+                        f.write(stmt + '\n')
+            print(f"Wrote SQL to '{merge_script}'")
+        else:
+            if stats['new'] > 0:
+                if not allocate:
+                    self.df = df[new].copy()
+                stats['inserted'] = self.load(con, batch_size, commit_every, fast_executemany)['rows']
+            if stats['changed'] > 0:
+                with metrics.stage('update', rows=stats['changed'], table=self.target_tablename):
+                    if update_cols:
+                        self._executemany(con, upsert.update_sql(con, table, pkey, update_cols), df.loc[changed, update_cols + [pkey]], fieldtypes, batch_size, batch_size * commit_every, fast_executemany)
+                        stats['updated'] = stats['changed']
+        self.df = df
+
+        stats['seconds'] = time.perf_counter() - start
+        print(f"Upserted {self.target_tablename} in {stats['seconds']:.2f}s: {stats['new']:,} new, {stats['changed']:,} changed, {stats['unchanged']:,} unchanged")
+        return stats
+
+    def verify_load(self, con:sa.Engine, pkey:str=None, chunksize:int=100_000) -> dict:
+        """
+        Check that every row of `df` arrived in `target_tablename` intact, reading back only the rows in `df`'s key range
+
+        Run after allocate_keys() and load(). The keys allocate_keys() hands out are all above the table's previous MAX(pkey), so the rows in the key range of `df` are exactly the rows that were inserted. Those rows are streamed `chunksize` at a time and compared with `df` by:
+            - row count: rows in the key range vs. rows in `df`
+            - checksum: an order-independent sum of row hashes (see sqltypes.checksum()) of the columns of `df`
+        When either differs, the per-row hashes are matched on `pkey` to name the keys that are missing, unexpected or changed. The cost grows with the number of rows loaded, not the size of the table.
+
+        Args:
+            con (sa.Engine): A sqlalchemy engine for the db. Required.
+            pkey (str): The name of the (integer) primary key field. Defaults to the IDENTITY column, or else the one-column primary key, in `create_qry`. Default None.
+            chunksize (int): Rows fetched per round trip. Default 100_000.
+
+        Returns:
+            dict: {'ok', 'rows_expected', 'rows_found', 'checksum_expected', 'checksum_found', 'missing', 'unexpected', 'changed'}
+                - missing, unexpected, changed: lists of `pkey` values; empty when `ok`
+
+        Examples:
+            import src.target as t
+            surveys = t.Target('src/qry/create_SurveyEvent.sql')
+            surveys.set_df(df=survey_events)
+            surveys.allocate_keys(con)
+            surveys.load(con)
+            surveys.verify_load(con)['ok']
+        """
+        pkey = self._resolve_pkey(pkey)
+        assert pkey in self.df.columns, print(f'`{pkey}` is not a column of Self.df; run allocate_keys() first')
+        with metrics.stage('verify', table=self.target_tablename) as st:
+            fieldtypes = self._fieldtypes()
+            cols = [c for c in self.df.columns if c in fieldtypes]
+            local_keys = pd.to_numeric(self.df[pkey]).to_numpy(dtype='int64')
+            local_hashes = sqltypes.hash_rows(self.df[cols], fieldtypes)
+            lo, hi = (int(local_keys.min()), int(local_keys.max())) if len(local_keys) else (0, -1)
+
+            table = self._sa_table(con, cols)
+            qry = sa.select(*[table.c[c] for c in cols]).where(table.c[pkey].between(lo, hi))
+            db_keys = []
+            db_hashes = []
+            with con.connect() as conn:
+                conn = conn.execution_options(stream_results=True)
+                for chunk in pd.read_sql_query(qry, conn, chunksize=chunksize):
+                    db_keys.append(pd.to_numeric(chunk[pkey]).to_numpy(dtype='int64'))
+                    db_hashes.append(sqltypes.hash_rows(chunk[cols], fieldtypes))
+            db_keys = np.concatenate(db_keys) if db_keys else np.empty(0, dtype='int64')
+            db_hashes = np.concatenate(db_hashes) if db_hashes else np.empty(0, dtype='uint64')
+            st.rows = len(db_keys)
+
+        result = {
+            'rows_expected':len(local_keys)
+            ,'rows_found':len(db_keys)
+            ,'checksum_expected':int(local_hashes.sum(dtype='uint64'))
+            ,'checksum_found':int(db_hashes.sum(dtype='uint64'))
+            ,'missing':[]
+            ,'unexpected':[]
+            ,'changed':[]
+        }
+        result['ok'] = result['rows_expected'] == result['rows_found'] and result['checksum_expected'] == result['checksum_found']
+        if result['ok']:
+            print(f"PASS: {result['rows_found']:,} rows of {self.target_tablename} in {pkey} {lo:,} to {hi:,} match Self.df")
+            return result
+
+        local = pd.Series(local_hashes, index=local_keys)
+        found = pd.Series(db_hashes, index=db_keys)
+        result['missing'] = local.index.difference(found.index).tolist()
+        result['unexpected'] = found.index.difference(local.index).tolist()
+        both = local.index.intersection(found.index)
+        result['changed'] = both[local.loc[both].to_numpy() != found.loc[both].to_numpy()].tolist()
+        print(f"FAIL: {self.target_tablename} in {pkey} {lo:,} to {hi:,} has {result['rows_found']:,} rows, expected {result['rows_expected']:,}; {len(result['missing']):,} missing, {len(result['unexpected']):,} unexpected, {len(result['changed']):,} changed")
+        return result
+
+    def get_reqs(self):
+        """
+        Get the value stored as `reqs` attribute of a Target
+
+        Returns:
+            pd.DataFrame: a dataframe of fieldnames and their specifications for the Target table
+
+        Examples:
+            import src.target as t
+            surveys = t.Target(r'src\qry\create_SurveyEvent.sql')
+            surveys.get_reqs()
+        """
+        return self.reqs
+
+    def set_create_qry(self, create_qry:str, verbose:bool=False):
         """Set the `create_qry` attribute of a Target
 
         Use-case: a Target object exists and its `create_qry` needs to be updated.
 
         Args:
             create_qry (str): relative or absolute filepath to a .sql file. This is the filepath where your table's CREATE TABLE .sql file lives.
+            verbose (bool): Parse `create_qry` now and print the table name and requirements. Default False.
 
         Examples:
             mytarget = t.Target('src/qry/create_a_table.sql')
             mytarget.set_create_qry('src/qry/create_another_table.sql)
         """
         self.create_qry = create_qry
-        print(f'Create query set to {self.create_qry}')
-        self._set_target_tablename()
-        print(f'\nTarget tablename updated to match {self.create_qry}:')
-        print(self.get_target_tablename())
-        self._set_reqs()
-        print(f'\nRequirements updated to match {self.create_qry}:')
-        print(self.get_reqs())
+        self._schema = None
+        self._reqs = None
+        self._plan = None
+        if verbose:
+            self._describe('updated to match')
     
     def get_create_qry(self):
         return print(self.create_qry)
@@ -0,0 +1,135 @@
+"""Turn source dataframes into the shape, column names and value formats a target table expects"""
+import decimal
+import numpy as np
+import pandas as pd
+import src.sqltypes as sqltypes
+
+PAD_TYPES = {'char', 'nchar'} # fixed-length types that SQL Server pads with trailing spaces
+TRIM_TYPES = PAD_TYPES | {'varchar', 'nvarchar', 'text', 'ntext'}
+
+def _per_unique(s:pd.Series, fn) -> pd.Series:
+    """Apply a vectorized `fn` to the distinct non-null values of `s` only, then spread the results back over every row; nulls stay null"""
+    codes, uniques = pd.factorize(s)
+    out = fn(pd.Series(uniques, name=s.name)).to_numpy(dtype=object)
+    return pd.Series(np.append(out, None)[codes], index=s.index, name=s.name)
+
+def _to_int(s:pd.Series, step:dict) -> pd.Series:
+    if s.dtype.kind in 'iu':
+        return s
+    return pd.to_numeric(s).astype('Int64')
+
+def _to_float(s:pd.Series, step:dict) -> pd.Series:
+    out = pd.to_numeric(s).astype('float64')
+    return out.round(int(step['scale'])) if pd.notna(step['scale']) else out
+
+_MONEY = {'money':(19, 4), 'smallmoney':(10, 4)} # (precision, scale) the DDL does not spell out
+
+def _to_decimal(s:pd.Series, step:dict) -> pd.Series:
+    precision, scale = _MONEY.get(step['fieldtype'], (step['precision'], step['scale']))
+    if pd.isna(precision) or precision <= 15: # float64 holds 15 significant digits exactly
+        return _to_float(s, step)
+    exp = decimal.Decimal(1).scaleb(-int(scale) if pd.notna(scale) else 0)
+    ctx = decimal.Context(prec=80)
+    return _per_unique(s, lambda u: sqltypes.to_decimals(u).map(lambda d: d.quantize(exp, rounding=decimal.ROUND_HALF_UP, context=ctx))) # SQL Server rounds half away from zero
+
+def _to_datetime(s:pd.Series, step:dict) -> pd.Series:
+    return _per_unique(s, lambda u: sqltypes.format_datetimes(u, step['fieldtype']))
+
+def _to_text(s:pd.Series, step:dict) -> pd.Series:
+    if s.dtype.kind in 'iuf':
+        # e.g. a char(2) code read from a CSV as 5.0; drop the '.0' pandas added
+        s = s.astype('Int64') if s.dtype.kind == 'f' and (s.dropna() % 1 == 0).all() else s
+    def _fix(u:pd.Series) -> pd.Series:
+        u = u.astype(str).str.strip()
+        if step['fieldtype'] in PAD_TYPES and pd.notna(step['maxlen']):
+            u = u.str.pad(int(step['maxlen']), side='right')
+        return u
+    return _per_unique(s, _fix)
+
+_CASTS = {}
+_CASTS.update({t:_to_int for t in sqltypes.INT_TYPES})
+_CASTS.update({t:_to_float for t in sqltypes.FLOAT_TYPES})
+_CASTS.update({t:_to_decimal for t in sqltypes.EXACT_TYPES})
+_CASTS.update({t:_to_datetime for t in sqltypes.DATETIME_TYPES | sqltypes.DATE_TYPES})
+_CASTS.update({t:_to_text for t in TRIM_TYPES})
+
+class TransformPlan():
+
+    def __init__(self, col_xwalk:dict, reqs:pd.DataFrame, keep_extra:bool=False):
+        """A TransformPlan is the compiled list of column operations that turn a source dataframe into rows ready for a table; see compile_plan()
+
+        Args:
+            col_xwalk (dict): A dictionary of {<a column in the source df>:<a column in the table>}. Required.
+            reqs (pd.DataFrame): The table's requirements, e.g. Target.reqs. Required.
+            keep_extra (bool): Keep source columns that are not in the table, after the table's columns. Default False (drop them).
+        """
+        fieldnames = list(reqs['fieldnames'])
+        unknown = [v for v in col_xwalk.values() if v not in fieldnames]
+        assert len(unknown) == 0, print(f'`col_xwalk` maps to columns that are not in the table: {unknown}')
+        self.rename = dict(col_xwalk)
+        self.keep_extra = keep_extra
+        self.steps = [ # one per table column, in CREATE TABLE order
+            {'column':name, 'fieldtype':str(fieldtype).lower(), 'maxlen':maxlen, 'precision':precision, 'scale':scale, 'cast':_CASTS.get(str(fieldtype).lower())}
+            for name, fieldtype, maxlen, precision, scale in zip(reqs['fieldnames'], reqs['fieldtypes'], reqs['maxlens'], reqs['precision'], reqs['scale'])
+        ]
+        self.fieldnames = fieldnames
+
+    def __repr__(self):
+        ops = ', '.join(f"{s['column']}:{s['cast'].__name__.lstrip('_') if s['cast'] else 'keep'}" for s in self.steps)
+        return f'TransformPlan(rename={self.rename}, steps=[{ops}])'
+
+    def apply(self, df:pd.DataFrame) -> pd.DataFrame:
+        """
+        Rename, reorder and convert the columns of `df` in one pass, a whole column at a time
+
+        For each table column present in `df` (after renaming with `col_xwalk`):
+            - int fields become nullable Int64
+            - decimal/float fields become float64, rounded to the field's scale; decimal/numeric/money fields with more digits than float64 holds (precision > 15) become exact decimal.Decimal values instead
+            - date/datetime fields become SQL Server strings, e.g. '2024-06-23 00:00:00.000'
+            - char/varchar fields have surrounding whitespace trimmed; char(n) fields are padded to n
+        Table columns missing from `df` (e.g. an IDENTITY key) are left out; run Target.check_df() to see if any were required. A column whose values cannot be converted is left as it was, with a printed note, so that Target.check_df() can report the bad rows.
+
+        Args:
+            df (pd.DataFrame): Source rows. Not modified. Required.
+
+        Returns:
+            pd.DataFrame: A new dataframe with the table's columns, in CREATE TABLE order
+        """
+        src = df.rename(columns=self.rename)
+        out = {}
+        for step in self.steps:
+            col = step['column']
+            if col not in src.columns:
+                continue
+            s = src[col]
+            if step['cast'] is not None:
+                try:
+                    s = step['cast'](s, step)
+                except (ValueError, TypeError) as e:
+                    print(f"Could not convert `{col}` to {step['fieldtype']}; left as is ({e})")
+            out[col] = s
+        if self.keep_extra:
+            out.update({c:src[c] for c in src.columns if c not in out})
+        return pd.DataFrame(out, index=df.index)
+
+def compile_plan(col_xwalk:dict, reqs:pd.DataFrame, keep_extra:bool=False) -> TransformPlan:
+    """
+    Compile a column crosswalk and a table's requirements into a TransformPlan that can be applied to any number of dataframes
+
+    The renames, column order and per-column conversions are worked out once; TransformPlan.apply() then only runs one vectorized operation per column. Conversions of text and date columns are done once per distinct value.
+
+    Args:
+        col_xwalk (dict): A dictionary of {<a column in the source df>:<a column in the table>}, e.g. {'visit_date':'SDate', 'location_id':'SiteRecID'}. Required.
+        reqs (pd.DataFrame): The table's requirements, e.g. Target.reqs. Required.
+        keep_extra (bool): Keep source columns that are not in the table, after the table's columns. Default False (drop them).
+
+    Returns:
+        TransformPlan: The compiled plan
+
+    Examples:
+        import src.transform as tf
+        plan = tf.compile_plan({'visit_date':'SDate', 'location_id':'SiteRecID'}, surveys.reqs)
+        for chunk in pd.read_csv('survey_events.csv', chunksize=100_000):
+            rows = plan.apply(chunk)
+    """
+    return TransformPlan(col_xwalk, reqs, keep_extra)
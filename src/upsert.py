@@ -0,0 +1,206 @@
+"""Match rows to a table by a natural key, split them into new, changed and unchanged, and apply only what changed"""
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+import src.sqltypes as sqltypes
+
+AUDIT_COLS = {'EditDate', 'ExportDate', 'UserID'} # who/when columns that are rewritten on every load, so they say nothing about whether a row changed
+_AUDIT_DEFAULTS = ('getdate()', 'getutcdate()', 'sysdatetime()', 'sysutcdatetime()', 'sysdatetimeoffset()', 'current_timestamp', 'suser_sname()', 'suser_name()', 'system_user', 'user_name()')
+
+def audit_columns(tableschema) -> list:
+    """
+    The columns of a table that record who changed a row or when: those in AUDIT_COLS, and those whose DEFAULT is the current time or user (e.g. getdate())
+
+    Args:
+        tableschema (schema.TableSchema): The table, e.g. Target.schema. Required.
+
+    Returns:
+        list: Column names, in CREATE TABLE order
+    """
+    def _bare(expr:str) -> str:
+        expr = str(expr).strip().lower()
+        while expr.startswith('(') and expr.endswith(')'):
+            expr = expr[1:-1].strip()
+        return expr
+    return [c.name for c in tableschema.columns if c.name in AUDIT_COLS or (c.default is not None and _bare(c.default) in _AUDIT_DEFAULTS)]
+
+def key_bounds(df:pd.DataFrame, natural_key:list, fieldtypes:dict) -> dict:
+    """
+    The lowest and highest value of each int, date or datetime column of the natural key, as the driver values load() writes
+
+    Reading only the rows of the table inside these bounds (e.g. one day's SDate) keeps a re-run of a small load cheap on a large table.
+
+    Args:
+        df (pd.DataFrame): Rows to match. Required.
+        natural_key (list): The columns that identify a row. Required.
+        fieldtypes (dict): A dictionary of {<column name>:<SQL Server data type>}. Required.
+
+    Returns:
+        dict: {<column>: (<lowest>, <highest>)}; columns with nulls or other types are left out
+    """
+    bounds = {}
+    if len(df) == 0:
+        return bounds
+    for c in natural_key:
+        fieldtype = str(fieldtypes.get(c)).lower()
+        s = df[c]
+        if s.isna().any():
+            continue
+        if fieldtype in sqltypes.INT_TYPES:
+            s = pd.to_numeric(s)
+        elif fieldtype in sqltypes.DATETIME_TYPES or fieldtype in sqltypes.DATE_TYPES:
+            s = sqltypes.to_datetimes(s)
+        else:
+            continue
+        lo, hi = sqltypes.to_params(pd.DataFrame({c:[s.min(), s.max()]}), {c:fieldtype})
+        bounds[c] = (lo[0], hi[0])
+    return bounds
+
+def split(con:sa.Engine, table:sa.TableClause, df:pd.DataFrame, fieldtypes:dict, natural_key:list, pkey:str, compare_cols:list, chunksize:int=100_000, carry_cols:list=()) -> dict:
+    """
+    Sort the rows of `df` into new, changed and unchanged by looking their natural key up in the table
+
+    The natural key and the `compare_cols` of every row are reduced to 64-bit hashes (see sqltypes.hash_rows()). The table is streamed `chunksize` rows at a time, reading only `pkey`, the natural key and `compare_cols` of the rows inside key_bounds(); only the rows whose key hash is also in `df` are kept. A row of `df` is then:
+        - new: its key is not in the table
+        - changed: its key is in the table with different `compare_cols`
+        - unchanged: its key is in the table with the same `compare_cols`
+        - duplicate: a later row of `df` has the same key; the last one wins
+    Nulls are not allowed in the natural key, since `ON tgt.k = src.k` in SQL (and so the MERGE script) never matches them.
+    When the table holds several rows with the same key (e.g. from earlier loads without upsert), the one with the lowest `pkey` is matched.
+
+    Args:
+        con (sa.Engine): A sqlalchemy engine for the db. Required.
+        table (sa.TableClause): The table, with `pkey`, the natural key, `compare_cols` and `carry_cols` as columns. Required.
+        df (pd.DataFrame): Rows to match. Required.
+        fieldtypes (dict): A dictionary of {<column name>:<SQL Server data type>}. Required.
+        natural_key (list): The columns that identify a row, e.g. ['SiteRecID', 'SDate', 'TBegin', 'SMID']. Required.
+        pkey (str): The primary key field. Required.
+        compare_cols (list): The columns compared to decide whether a matched row changed. Required.
+        chunksize (int): Rows fetched per round trip. Default 100_000.
+        carry_cols (list): Other columns to read back for the matched rows, e.g. audit columns that are not compared. Default ().
+
+    Raises:
+        ValueError: a row of `df` has a null in its natural key
+
+    Returns:
+        dict: {'new', 'changed', 'unchanged', 'duplicate': boolean masks with one element per row of `df`, 'pkeys': pd.Series of the matched rows' `pkey` in the table (null for the others) with the index of `df`, 'db_rows': rows read, 'db_duplicates': rows of the table matched by the same key as another, 'db_values': pd.DataFrame of the matched rows' `carry_cols` in the table (null for the others) with the index of `df`}
+    """
+    nulls = df[natural_key].isna().any(axis=1)
+    if nulls.any():
+        raise ValueError(f'{int(nulls.sum()):,} rows have a null in the natural key {natural_key}, e.g. row {nulls.idxmax()!r}; a null never matches in SQL, so these rows cannot be upserted')
+    key_hash = sqltypes.hash_rows(df[natural_key], fieldtypes)
+    row_hash = sqltypes.hash_rows(df[compare_cols], fieldtypes) if compare_cols else np.zeros(len(df), dtype='uint64')
+    duplicate = pd.Series(key_hash).duplicated(keep='last').to_numpy()
+    wanted = pd.Index(pd.unique(key_hash))
+
+    cols = list(dict.fromkeys([pkey] + natural_key + compare_cols + list(carry_cols)))
+    qry = sa.select(*[table.c[c] for c in cols])
+    for c, (lo, hi) in key_bounds(df, natural_key, fieldtypes).items():
+        qry = qry.where(table.c[c].between(lo, hi))
+    found_keys, found_pkeys, found_rows, carried = [], [], [], []
+    db_rows = 0
+    with con.connect() as conn:
+        conn = conn.execution_options(stream_results=True)
+        for chunk in pd.read_sql_query(qry, conn, chunksize=chunksize):
+            db_rows += len(chunk)
+            hashes = sqltypes.hash_rows(chunk[natural_key], fieldtypes)
+            hit = wanted.get_indexer(hashes) >= 0
+            if not hit.any():
+                continue
+            chunk = chunk[hit]
+            found_keys.append(hashes[hit])
+            found_pkeys.append(chunk[pkey].to_numpy())
+            found_rows.append(sqltypes.hash_rows(chunk[compare_cols], fieldtypes) if compare_cols else np.zeros(len(chunk), dtype='uint64'))
+            carried.append(chunk[list(carry_cols)])
+
+    found = pd.DataFrame({
+        'key':np.concatenate(found_keys) if found_keys else np.empty(0, dtype='uint64')
+        ,'pkey':np.concatenate(found_pkeys) if found_pkeys else np.empty(0, dtype=object)
+        ,'row':np.concatenate(found_rows) if found_rows else np.empty(0, dtype='uint64')
+    })
+    found['at'] = np.arange(len(found)) # row of `carried`
+    found = found.sort_values('pkey', kind='stable')
+    carried = pd.concat(carried, ignore_index=True) if carried else pd.DataFrame(columns=list(carry_cols))
+    db_duplicates = int(found['key'].duplicated().sum())
+    found = found.drop_duplicates('key', keep='first').set_index('key')
+
+    pos = found.index.get_indexer(key_hash)
+    matched = pos >= 0
+    if len(found):
+        safe = np.where(matched, pos, 0)
+        same = matched & (found['row'].to_numpy()[safe] == row_hash)
+        db_pkeys = found['pkey'].to_numpy()[safe]
+        db_values = carried.iloc[found['at'].to_numpy()[safe]].set_axis(df.index)
+    else:
+        same = matched
+        db_pkeys = np.full(len(df), None, dtype=object)
+        db_values = pd.DataFrame(index=df.index, columns=list(carry_cols), dtype=object)
+    pkeys = pd.Series(db_pkeys, index=df.index, dtype=object).where(matched, None)
+    return {
+        'new':~matched & ~duplicate
+        ,'changed':matched & ~same & ~duplicate
+        ,'unchanged':same & ~duplicate
+        ,'duplicate':duplicate
+        ,'pkeys':pkeys
+        ,'db_rows':db_rows
+        ,'db_duplicates':db_duplicates
+        ,'db_values':db_values.astype(object).where(pd.Series(matched, index=df.index), None, axis=0)
+    }
+
+def update_sql(con:sa.Engine, table:sa.TableClause, pkey:str, update_cols:list) -> str:
+    """
+    A parameterized UPDATE of the `update_cols` of one row of `table`, found by `pkey`, in the placeholder style of `con`'s driver
+
+    The parameters are the `update_cols` followed by `pkey`, so the statement can be run with executemany() over df[update_cols + [pkey]].
+
+    Args:
+        con (sa.Engine): A sqlalchemy engine for the db. Required.
+        table (sa.TableClause): The table to update. Required.
+        pkey (str): The primary key field. Required.
+        update_cols (list): The columns to set. Required.
+
+    Returns:
+        str: The UPDATE statement
+    """
+    prep = con.dialect.identifier_preparer
+    placeholder = '%s' if con.dialect.paramstyle in ('format', 'pyformat') else '?'
+    return f"UPDATE {prep.format_table(table)} SET {', '.join(f'{prep.quote(c)} = {placeholder}' for c in update_cols)} WHERE {prep.quote(pkey)} = {placeholder}"
+
+def iter_merge_sql(tablename:str, df:pd.DataFrame, fieldtypes:dict, natural_key:list, compare_cols:list, update_cols:list, insert_cols:list, batch_size:int=1000):
+    """
+    Generate SQL Server MERGE statements that insert the rows of `df` whose natural key is not in `tablename` and update the ones that differ
+
+    Each statement merges up to `batch_size` rows from a VALUES list. Matched rows are only updated when one of `compare_cols` differs (compared NULL-safely with EXCEPT), so a script can be run twice.
+
+    Args:
+        tablename (str): e.g. '[dbo].[SurveyEvent]'. Required.
+        df (pd.DataFrame): The rows to merge. Required.
+        fieldtypes (dict): A dictionary of {<column name>:<SQL Server data type>}. Required.
+        natural_key (list): The columns that identify a row. Required.
+        compare_cols (list): The columns that decide whether a matched row changed. Required.
+        update_cols (list): The columns to set on matched rows that changed. Required.
+        insert_cols (list): The columns to insert for new rows; leave out IDENTITY columns to have the db number the rows. Required.
+        batch_size (int): Rows per MERGE statement. SQL Server allows at most 1000 rows in a VALUES list. Default 1000.
+
+    Yields:
+        str: One MERGE statement
+    """
+    assert 1 <= batch_size <= 1000, print(f'`batch_size` must be between 1 and 1000 (the SQL Server limit). You provided {batch_size}')
+    src_cols = list(dict.fromkeys(natural_key + insert_cols + compare_cols + update_cols))
+    on = ' AND '.join(f'tgt.[{c}] = src.[{c}]' for c in natural_key)
+    tail = ''
+    if compare_cols and update_cols:
+        tail += (
+            f"\nWHEN MATCHED AND EXISTS (SELECT {', '.join(f'src.[{c}]' for c in compare_cols)} EXCEPT SELECT {', '.join(f'tgt.[{c}]' for c in compare_cols)}) THEN"
+            f"\n    UPDATE SET {', '.join(f'tgt.[{c}] = src.[{c}]' for c in update_cols)}"
+        )
+    tail += (
+        f"\nWHEN NOT MATCHED BY TARGET THEN"
+        f"\n    INSERT ({', '.join(f'[{c}]' for c in insert_cols)}) VALUES ({', '.join(f'src.[{c}]' for c in insert_cols)});"
+    )
+    for start in range(0, len(df), batch_size):
+        rows = sqltypes.to_rows(df[src_cols].iloc[start:start+batch_size], fieldtypes)
+        yield (
+            f"MERGE INTO {tablename} WITH (HOLDLOCK) AS tgt\nUSING (VALUES\n" + ',\n'.join(rows)
+            + f"\n) AS src ({', '.join(f'[{c}]' for c in src_cols)})\nON {on}" + tail
+        )
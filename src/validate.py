@@ -0,0 +1,122 @@
+"""Validate a dataframe against the requirements parsed from a CREATE TABLE query"""
+import numpy as np
+import pandas as pd
+import src.sqltypes as sqltypes
+
+# the range of values each SQL Server integer type can hold
+INT_RANGES = {
+    'bit':(0, 1)
+    ,'tinyint':(0, 255)
+    ,'smallint':(-2**15, 2**15 - 1)
+    ,'int':(-2**31, 2**31 - 1)
+    ,'bigint':(-2**63, 2**63 - 1)
+}
+LEN_TYPES = {'char', 'varchar', 'nchar', 'nvarchar', 'binary', 'varbinary'}
+
+REPORT_COLUMNS = ['row', 'column', 'rule']
+
+def _per_unique(s:pd.Series, rule) -> np.ndarray:
+    """
+    Evaluate `rule` once per distinct non-null value of `s` and broadcast the result back to every row
+
+    Args:
+        s (pd.Series): A column of a dataframe. Required.
+        rule (function): Takes a pd.Series of distinct values, returns a boolean array that is True where a value breaks the rule. Required.
+
+    Returns:
+        np.ndarray: A boolean mask, one element per row of `s`; nulls are never flagged
+    """
+    codes, uniques = pd.factorize(s)
+    bad = np.asarray(rule(pd.Series(uniques, name=s.name)), dtype=bool)
+    return np.append(bad, False)[codes]
+
+def _too_long(maxlen:int):
+    return lambda u: (u.astype(str).str.len() > maxlen).to_numpy()
+
+def _not_int(fieldtype:str):
+    lo, hi = INT_RANGES.get(fieldtype, INT_RANGES['bigint'])
+    def rule(u):
+        nums = pd.to_numeric(u, errors='coerce').astype('float64').to_numpy()
+        with np.errstate(invalid='ignore'):
+            return np.isnan(nums) | (nums != np.floor(nums)) | (nums < lo) | (nums > hi)
+    return rule
+
+def _not_numeric(u):
+    return pd.to_numeric(u, errors='coerce').isna().to_numpy()
+
+def _not_datetime(u):
+    return sqltypes.to_datetimes(u, errors='coerce').isna().to_numpy()
+
+def check(df:pd.DataFrame, reqs:pd.DataFrame) -> pd.DataFrame:
+    """
+    Check every row of `df` against `reqs` (see Target.reqs) one whole column at a time
+
+    Column rules (one report row each, `row` is None):
+        - 'missing_column': a NOT NULL field in `reqs` is not a column in `df` (IDENTITY fields and fields with a DEFAULT are exempt)
+        - 'unknown_column': a column in `df` is not a field in `reqs`
+        - 'column_order': a column in `df` is out of order relative to `reqs`
+    Row rules (one report row per offending cell):
+        - 'not_null': a NOT NULL field is null
+        - 'maxlen': a char/varchar value is longer than the field allows
+        - 'not_int': an int field value is not a whole number in the type's range
+        - 'not_numeric': a decimal/float field value is not a number
+        - 'not_datetime': a date/datetime field value cannot be parsed as a date
+
+    Args:
+        df (pd.DataFrame): Rows to validate. Required.
+        reqs (pd.DataFrame): Requirements parsed from a CREATE TABLE query, as stored in Target.reqs. Required.
+
+    Returns:
+        pd.DataFrame: One row per violation with columns 'row' (the `df` index label), 'column', 'rule'. Empty when `df` passes.
+
+    Examples:
+        import src.validate as validate
+        report = validate.check(surveys.get_df(), surveys.get_reqs())
+        report.groupby(['column', 'rule']).size()
+    """
+    pieces = []
+    fieldnames = list(reqs['fieldnames'])
+    # IDENTITY fields get their keys later (see Target.allocate_keys()) and fields with a DEFAULT are filled in by the db
+    exempt = reqs['identity'].to_numpy(dtype=bool) | reqs['default'].notna().to_numpy()
+
+    # column rules
+    notnull = (reqs['can_be_null'] == 'NOT NULL').to_numpy()
+    missing = [f for f, nn, ex in zip(fieldnames, notnull, exempt) if nn and not ex and f not in df.columns]
+    unknown = [c for c in df.columns if c not in fieldnames]
+    pos = np.array([fieldnames.index(c) for c in df.columns if c in fieldnames], dtype='int64')
+    shared = [c for c in df.columns if c in fieldnames]
+    out_of_order = [c for c, p, m in zip(shared, pos, np.maximum.accumulate(pos) if len(pos) else pos) if p < m]
+    for rule, cols in (('missing_column', missing), ('unknown_column', unknown), ('column_order', out_of_order)):
+        if cols:
+            pieces.append(pd.DataFrame({'row':None, 'column':cols, 'rule':rule}))
+
+    # row rules
+    fields = reqs[reqs['fieldnames'].isin(df.columns)]
+    for col, fieldtype, maxlen, can_be_null in zip(fields['fieldnames'], fields['fieldtypes'], fields['maxlens'], fields['can_be_null']):
+        fieldtype = str(fieldtype).lower()
+        s = df[col]
+        masks = []
+        if can_be_null == 'NOT NULL':
+            masks.append(('not_null', s.isna().to_numpy()))
+        if fieldtype in LEN_TYPES and pd.notna(maxlen):
+            masks.append(('maxlen', _per_unique(s, _too_long(int(maxlen)))))
+        if fieldtype in sqltypes.INT_TYPES and s.dtype.kind in 'iu':
+            lo, hi = INT_RANGES.get(fieldtype, INT_RANGES['bigint'])
+            masks.append(('not_int', ((s < lo) | (s > hi)).to_numpy(dtype=bool, na_value=False))) # nullable Int64 compares to <NA>
+        elif fieldtype in sqltypes.INT_TYPES:
+            masks.append(('not_int', _per_unique(s, _not_int(fieldtype))))
+        elif fieldtype in sqltypes.FLOAT_TYPES:
+            masks.append(('not_numeric', _per_unique(s, _not_numeric)))
+        elif fieldtype in sqltypes.DATETIME_TYPES or fieldtype in sqltypes.DATE_TYPES:
+            masks.append(('not_datetime', _per_unique(s, _not_datetime)))
+        for rule, mask in masks:
+            rows = np.flatnonzero(mask)
+            if len(rows):
+                pieces.append(pd.DataFrame({'row':df.index[rows], 'column':col, 'rule':rule}))
+
+    if not pieces:
+        return pd.DataFrame({c:pd.Series(dtype=object) for c in REPORT_COLUMNS})
+    report = pd.concat(pieces, ignore_index=True)
+    report['column'] = report['column'].astype('category')
+    report['rule'] = report['rule'].astype('category')
+    return report